@@ -1,36 +1,87 @@
 import { NextRequest, NextResponse } from 'next/server';
+import { forwardEvents } from '@/lib/sse.mjs';
 
 // The URL where your FastAPI backend is running
 const API_URL = process.env.BACKEND_API_URL || process.env.NEXT_PUBLIC_BACKEND_API_URL || 'http://localhost:8000';
 
+// How long a request may take end to end, and the share of it the backend gets
+// so it can stop upstream and report partial usage before we give up
+const REQUEST_TIMEOUT_MS = 30000;
+const BACKEND_DEADLINE_MS = 28000;
+
+// How often a stream that drops mid-answer is picked up again from the backend's buffer
+const MAX_STREAM_RESUMES = 3;
+
+// Abort when any of the given signals aborts
+function anySignal(signals: AbortSignal[]): AbortSignal {
+  const controller = new AbortController();
+  for (const signal of signals) {
+    if (signal.aborted) {
+      controller.abort(signal.reason);
+      break;
+    }
+    signal.addEventListener('abort', () => controller.abort(signal.reason), { once: true });
+  }
+  return controller.signal;
+}
+
+// Stop a backend stream now instead of after its resume grace period
+function stopBackendStream(streamId: string): void {
+  fetch(`${API_URL}/api/chat/streams/${encodeURIComponent(streamId)}`, {
+    method: 'DELETE',
+    cache: 'no-store',
+    signal: AbortSignal.timeout(5000),
+  }).catch(error => console.error(`Error stopping stream ${streamId}:`, error));
+}
+
+// An error status from the backend, with its Retry-After when it sent one
+class BackendError extends Error {
+  constructor(message: string, readonly retryAfter: string | null) {
+    super(message);
+  }
+}
+
 // Retry helper function
-async function fetchWithRetry(url: string, options: RequestInit, maxRetries = 3): Promise<Response> {
+async function fetchWithRetry(url: string, options: RequestInit, maxRetries = 3, clientSignal?: AbortSignal): Promise<Response> {
   let lastError: Error;
   
   for (let attempt = 1; attempt <= maxRetries; attempt++) {
     try {
+      const timeoutSignal = AbortSignal.timeout(REQUEST_TIMEOUT_MS); // 30 second timeout
       const response = await fetch(url, {
         ...options,
-        signal: AbortSignal.timeout(30000), // 30 second timeout
+        // Also stop the backend request when the browser goes away
+        signal: clientSignal ? anySignal([clientSignal, timeoutSignal]) : timeoutSignal,
       });
       
       if (response.ok) {
         return response;
       }
       
+      // The backend already spent the whole time budget, retrying won't help
+      if (response.status === 504) {
+        throw new Error(`Deadline exceeded: ${response.status} ${response.statusText}`);
+      }
+      
       // Don't retry on 4xx errors (client errors)
       if (response.status >= 400 && response.status < 500) {
-        throw new Error(`Client error: ${response.status} ${response.statusText}`);
+        throw new BackendError(`Client error: ${response.status} ${response.statusText}`, response.headers.get('retry-after'));
       }
       
-      // Retry on 5xx errors (server errors)
+      // Don't retry a request the backend shed (503) or one upstream already
+      // failed (502): sending it again right away only adds load to that model
+      if (response.status === 502 || response.status === 503) {
+        throw new BackendError(`Server error: ${response.status} ${response.statusText}`, response.headers.get('retry-after'));
+      }
+      
+      // Retry on other 5xx errors (server errors)
       lastError = new Error(`Server error: ${response.status} ${response.statusText}`);
       
     } catch (error) {
       lastError = error instanceof Error ? error : new Error('Unknown error');
       
-      // Don't retry on AbortError (timeout)
-      if (lastError.name === 'AbortError') {
+      // Don't retry on AbortError (timeout), an exhausted deadline or an error status
+      if (lastError.name === 'AbortError' || lastError.message.startsWith('Deadline exceeded') || lastError instanceof BackendError) {
         throw lastError;
       }
     }
@@ -54,15 +105,23 @@ export async function POST(request: NextRequest) {
       throw new Error('Backend API URL not configured');
     }
     
+    // Every retry of a stream carries the same id, so a retry after a lost
+    // response joins the answer already being generated instead of starting over
+    const headers: Record<string, string> = {
+      'Content-Type': 'application/json',
+      'X-Request-Timeout-Ms': String(BACKEND_DEADLINE_MS),
+    };
+    if (stream === true) {
+      headers['X-Stream-Id'] = crypto.randomUUID();
+    }
+    
     // Forward the request to the Python backend with retry logic
     const backendResponse = await fetchWithRetry(`${API_URL}/api/chat`, {
       method: 'POST',
-      headers: {
-        'Content-Type': 'application/json',
-      },
+      headers,
       body: JSON.stringify(body),
       cache: 'no-store',
-    });
+    }, 3, request.signal);
     
     if (!backendResponse.ok) {
       const errorText = await backendResponse.text();
@@ -73,33 +132,84 @@ export async function POST(request: NextRequest) {
     // Check if streaming response
     const contentType = backendResponse.headers.get('content-type');
     if (stream === true && contentType?.includes('text/event-stream')) {
-      // Forward the stream
+      // Forward the stream, resuming it if the backend connection drops
+      const streamId = backendResponse.headers.get('x-stream-id');
+      let reader = backendResponse.body?.getReader();
+      const encoder = new TextEncoder();
+      let decoder = new TextDecoder();
       const stream = new ReadableStream({
         async start(controller) {
-          const reader = backendResponse.body?.getReader();
-          const decoder = new TextDecoder();
-          
           if (!reader) {
             controller.close();
             return;
           }
           
-          try {
-            while (true) {
+          let buffer = '';
+          let lastId: string | null = null;
+          let resumes = 0;
+          while (true) {
+            try {
               const { done, value } = await reader.read();
               
               if (done) {
+                if (buffer) {
+                  // The last event may be missing its blank line
+                  const { output } = forwardEvents(buffer + '\n\n');
+                  if (output) {
+                    controller.enqueue(encoder.encode(output));
+                  }
+                }
                 controller.close();
                 break;
               }
               
-              controller.enqueue(value);
+              // Forward whole events only, so a resume never repeats half an event.
+              // The `id:` lines are ours for resuming, the browser only gets the data.
+              buffer += decoder.decode(value, { stream: true });
+              const forwarded = forwardEvents(buffer);
+              buffer = forwarded.rest;
+              lastId = forwarded.lastId ?? lastId;
+              if (forwarded.output) {
+                controller.enqueue(encoder.encode(forwarded.output));
+              }
+            } catch (error) {
+              const aborted = request.signal.aborted || (error instanceof Error && error.name === 'AbortError');
+              if (streamId && aborted) {
+                stopBackendStream(streamId);
+              }
+              if (streamId && !aborted && resumes < MAX_STREAM_RESUMES) {
+                resumes++;
+                try {
+                  // Replays what we missed and follows the rest, without a new upstream call
+                  const resumed = await fetch(`${API_URL}/api/chat/streams/${encodeURIComponent(streamId)}`, {
+                    headers: lastId ? { 'Last-Event-ID': lastId } : {},
+                    cache: 'no-store',
+                    signal: anySignal([request.signal, AbortSignal.timeout(REQUEST_TIMEOUT_MS)]),
+                  });
+                  if (resumed.ok && resumed.body) {
+                    reader = resumed.body.getReader();
+                    decoder = new TextDecoder();
+                    buffer = '';
+                    continue;
+                  }
+                  console.error(`Backend refused to resume stream ${streamId}: ${resumed.status}`);
+                } catch (resumeError) {
+                  console.error('Error resuming stream:', resumeError);
+                }
+              }
+              console.error('Error reading stream:', error);
+              controller.error(error);
+              break;
             }
-          } catch (error) {
-            console.error('Error reading stream:', error);
-            controller.error(error);
           }
         },
+        // The browser went away: stop the backend stream so it stops upstream too
+        cancel(reason) {
+          if (streamId) {
+            stopBackendStream(streamId);
+          }
+          return reader?.cancel(reason);
+        },
       });
       
       return new Response(stream, {
@@ -133,9 +243,15 @@ export async function POST(request: NextRequest) {
       if (error.name === 'AbortError') {
         errorMessage = "Request timed out. Please try again.";
         statusCode = 408;
+      } else if (error.message.startsWith('Deadline exceeded')) {
+        errorMessage = "The model took too long to answer. Please try again.";
+        statusCode = 504;
       } else if (error.message.includes('Backend API URL not configured')) {
         errorMessage = "Service configuration error. Please contact support.";
         statusCode = 503;
+      } else if (error.message.includes('Client error: 429')) {
+        errorMessage = "The service is busy right now. Please try again in a few seconds.";
+        statusCode = 429;
       } else if (error.message.includes('Client error: 4')) {
         errorMessage = "Invalid request. Please check your input and try again.";
         statusCode = 400;
@@ -145,12 +261,15 @@ export async function POST(request: NextRequest) {
       }
     }
     
+    // Tell the browser how long the backend asked to wait before trying again
+    const retryAfter = error instanceof BackendError ? error.retryAfter : null;
+    
     return NextResponse.json(
       { 
         error: 'Failed to process request',
         message: { role: "assistant", content: errorMessage }
       },
-      { status: statusCode }
+      { status: statusCode, headers: retryAfter ? { 'Retry-After': retryAfter } : undefined }
     );
   }
 }
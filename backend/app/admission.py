@@ -0,0 +1,244 @@
+import asyncio
+import itertools
+import math
+import os
+import time
+from typing import Any, Dict, List, Optional
+
+from .catalog import model_catalog
+
+
+# Priority classes, lower is served first
+PRIORITY_INTERACTIVE = 0  # streaming chats a user is watching
+PRIORITY_STANDARD = 1     # non-streaming chats
+PRIORITY_BATCH = 2        # batch evaluation runs
+
+PRIORITY_NAMES = {
+    PRIORITY_INTERACTIVE: "interactive",
+    PRIORITY_STANDARD: "standard",
+    PRIORITY_BATCH: "batch",
+}
+
+
+class Overloaded(Exception):
+    """The request was shed instead of admitted"""
+
+    def __init__(self, status_code: int, reason: str, retry_after: int) -> None:
+        super().__init__(reason)
+        self.status_code = status_code
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class _Waiter:
+    __slots__ = ("priority", "seq", "model", "future", "enqueued")
+
+    def __init__(self, priority: int, seq: int, model: str, future: asyncio.Future) -> None:
+        self.priority = priority
+        self.seq = seq
+        self.model = model
+        self.future = future
+        self.enqueued = time.monotonic()
+
+
+class Ticket:
+    """
+    An admitted request's slot; release it exactly once when the request
+    ends. An upstream call that may outlive the request (one shared with
+    identical requests) hold()s the slot, which is then only freed once
+    that call unhold()s it too.
+    """
+
+    def __init__(self, controller: "AdmissionController", model: str) -> None:
+        self.controller = controller
+        self.model = model
+        self.admitted = time.monotonic()
+        self.released = False
+        self._holds = 0
+        self._upstream_status: Optional[int] = None
+        self._freed = False
+
+    def release(self, upstream_status: Optional[int] = None) -> None:
+        if self.released:
+            return
+        self.released = True
+        self._upstream_status = upstream_status
+        self._free()
+
+    def hold(self) -> None:
+        self._holds += 1
+
+    def unhold(self) -> None:
+        self._holds -= 1
+        self._free()
+
+    def _free(self) -> None:
+        if self.released and self._holds == 0 and not self._freed:
+            self._freed = True
+            self.controller._release(self, self._upstream_status)
+
+
+class AdmissionController:
+    """
+    Limits how many upstream calls run at once, globally and per model.
+
+    Requests over the limit wait in a bounded priority queue (interactive
+    ahead of standard ahead of batch) until a slot frees or their deadline
+    passes. A full queue is shed with 429 and an expired wait with 503,
+    both with a Retry-After estimate. Per-model limits back off
+    multiplicatively when upstream answers 429 and recover additively on
+    success. Models outside the catalog share one "other" limit, so made-up
+    names cannot grow the per-model state. Configured with:
+      ADMISSION_MAX_CONCURRENCY    global in-flight limit (default 256)
+      ADMISSION_MODEL_CONCURRENCY  per-model in-flight limit (default 64)
+      ADMISSION_QUEUE_SIZE         waiting requests before shedding (default 512)
+      ADMISSION_QUEUE_TIMEOUT      seconds a request may wait (default 10)
+    """
+
+    def __init__(self) -> None:
+        self.max_concurrency = 256
+        self.model_concurrency = 64
+        self.queue_size = 512
+        self.queue_timeout = 10.0
+        self._in_flight = 0
+        self._model_in_flight: Dict[str, int] = {}
+        self._model_limits: Dict[str, float] = {}
+        self._waiters: List[_Waiter] = []
+        self._seq = itertools.count()
+        # Exponentially weighted averages, in seconds
+        self._avg_wait = 0.0
+        self._avg_service = 1.0
+        self.max_wait = 0.0
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.throttled = 0
+
+    async def start(self) -> None:
+        self.max_concurrency = int(os.getenv("ADMISSION_MAX_CONCURRENCY", "256"))
+        self.model_concurrency = int(os.getenv("ADMISSION_MODEL_CONCURRENCY", "64"))
+        self.queue_size = int(os.getenv("ADMISSION_QUEUE_SIZE", "512"))
+        self.queue_timeout = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "10"))
+
+    def _model_limit(self, model: str) -> int:
+        return max(int(self._model_limits.get(model, self.model_concurrency)), 1)
+
+    def _has_capacity(self, model: str) -> bool:
+        return (
+            self._in_flight < self.max_concurrency
+            and self._model_in_flight.get(model, 0) < self._model_limit(model)
+        )
+
+    def _admit(self, model: str) -> Ticket:
+        self._in_flight += 1
+        self._model_in_flight[model] = self._model_in_flight.get(model, 0) + 1
+        self.admitted += 1
+        return Ticket(self, model)
+
+    def retry_after(self) -> int:
+        """Rough seconds until a queued request would be served"""
+        slots = max(self.max_concurrency, 1)
+        return max(1, math.ceil(self._avg_service * (len(self._waiters) + 1) / slots))
+
+    async def acquire(self, model: str, priority: int = PRIORITY_STANDARD, timeout: Optional[float] = -1.0) -> Ticket:
+        """
+        Wait for a slot for `model`. `timeout` defaults to ADMISSION_QUEUE_TIMEOUT;
+        None waits as long as it takes. Raises Overloaded when shed.
+        """
+        model = model_catalog.table.label(model)
+        # Serve strictly in priority order: only skip the queue if nobody waits
+        if not self._waiters and self._has_capacity(model):
+            self._record_wait(0.0)
+            return self._admit(model)
+
+        if len(self._waiters) >= self.queue_size:
+            self.rejected += 1
+            raise Overloaded(429, "Too many requests queued", self.retry_after())
+
+        if timeout is not None and timeout < 0:
+            timeout = self.queue_timeout
+        waiter = _Waiter(priority, next(self._seq), model, asyncio.get_running_loop().create_future())
+        self._waiters.append(waiter)
+        self._waiters.sort(key=lambda w: (w.priority, w.seq))
+        # Waiters ahead may only be blocked on their own model's limit
+        self._dispatch()
+        if waiter.future.done():
+            self._record_wait(0.0)
+            return waiter.future.result()
+        try:
+            ticket = await asyncio.wait_for(asyncio.shield(waiter.future), timeout)
+        except asyncio.TimeoutError:
+            self._abandon(waiter)
+            self.timed_out += 1
+            raise Overloaded(503, "Timed out waiting for capacity", self.retry_after())
+        except asyncio.CancelledError:
+            self._abandon(waiter)
+            raise
+        self._record_wait(time.monotonic() - waiter.enqueued)
+        return ticket
+
+    def _abandon(self, waiter: _Waiter) -> None:
+        if waiter in self._waiters:
+            self._waiters.remove(waiter)
+        elif waiter.future.done() and not waiter.future.cancelled():
+            # Granted a slot just as it gave up, hand the slot back
+            waiter.future.result().release()
+
+    def _record_wait(self, waited: float) -> None:
+        self._avg_wait = 0.9 * self._avg_wait + 0.1 * waited
+        self.max_wait = max(self.max_wait, waited)
+
+    def _release(self, ticket: Ticket, upstream_status: Optional[int]) -> None:
+        self._in_flight -= 1
+        self._model_in_flight[ticket.model] -= 1
+        self._avg_service = 0.9 * self._avg_service + 0.1 * (time.monotonic() - ticket.admitted)
+
+        # Adapt the model's limit to upstream throttling (AIMD)
+        limit = self._model_limits.get(ticket.model, float(self.model_concurrency))
+        if upstream_status == 429:
+            self.throttled += 1
+            self._model_limits[ticket.model] = max(1.0, limit / 2)
+        elif upstream_status is not None and upstream_status < 400 and limit < self.model_concurrency:
+            self._model_limits[ticket.model] = min(float(self.model_concurrency), limit + 1 / limit)
+
+        self._dispatch()
+
+    def _dispatch(self) -> None:
+        """Hand free slots to the highest-priority waiters whose model has room"""
+        for waiter in list(self._waiters):
+            if self._in_flight >= self.max_concurrency:
+                break
+            if waiter.future.done():
+                self._waiters.remove(waiter)
+                continue
+            if self._has_capacity(waiter.model):
+                self._waiters.remove(waiter)
+                waiter.future.set_result(self._admit(waiter.model))
+
+    def stats(self) -> Dict[str, Any]:
+        depth = {name: 0 for name in PRIORITY_NAMES.values()}
+        for waiter in self._waiters:
+            depth[PRIORITY_NAMES.get(waiter.priority, str(waiter.priority))] += 1
+        return {
+            "in_flight": self._in_flight,
+            "max_concurrency": self.max_concurrency,
+            "queue_depth": len(self._waiters),
+            "queue_depth_by_priority": depth,
+            "queue_size": self.queue_size,
+            "avg_wait_ms": round(self._avg_wait * 1000, 1),
+            "max_wait_ms": round(self.max_wait * 1000, 1),
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+            "upstream_throttled": self.throttled,
+            "models": {
+                model: {
+                    "in_flight": count,
+                    "limit": self._model_limit(model),
+                }
+                for model, count in self._model_in_flight.items()
+            },
+        }
+
+
+admission = AdmissionController()
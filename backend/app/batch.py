@@ -0,0 +1,309 @@
+"""
+Bounded-concurrency batch runner for JSONL evaluation sets.
+
+Every line makes its own upstream call: identical lines are not coalesced
+onto one call, so an eval set that repeats a prompt to sample it several
+times gets independent answers.
+
+Used by POST /api/chat/batch, and runnable directly against a file:
+
+    python -m app.batch evals.jsonl -o results.ndjson --concurrency 16 --rate openai/gpt-4o=5
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from typing import IO, Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional
+
+from pydantic import ValidationError
+
+from .catalog import model_catalog
+from .schemas import ChatRequest
+
+
+# Latency samples kept for percentiles; beyond this a reservoir sample is used
+LATENCY_SAMPLE_SIZE = 10000
+
+
+class RateLimiter:
+    """Token bucket allowing `rate` requests per second with bursts of `burst`"""
+
+    def __init__(self, rate: float, burst: Optional[float] = None) -> None:
+        self.rate = rate
+        self.capacity = burst if burst is not None else max(rate, 1.0)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+def parse_rate_limits(spec: Optional[str]) -> Dict[str, float]:
+    """Parse "model=rps,model=rps" (a "*" model sets the default for all others)"""
+    limits: Dict[str, float] = {}
+    if not spec:
+        return limits
+    for item in spec.split(","):
+        if "=" not in item:
+            continue
+        model, rate = item.rsplit("=", 1)
+        try:
+            limits[model.strip()] = float(rate)
+        except ValueError:
+            print(f"Warning: Invalid rate limit for {model.strip()}: {rate}")
+    return limits
+
+
+def _percentile(sorted_values: List[float], fraction: float) -> Optional[float]:
+    if not sorted_values:
+        return None
+    index = min(int(round(fraction * (len(sorted_values) - 1))), len(sorted_values) - 1)
+    return round(sorted_values[index], 1)
+
+
+class BatchStats:
+    """Running totals for a batch, in constant memory"""
+
+    def __init__(self) -> None:
+        self.started = time.perf_counter()
+        self.requests = 0
+        self.succeeded = 0
+        self.failed = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.total_tokens = 0
+        self.total_cost_usd = 0.0
+        self.latencies: List[float] = []
+
+    def record_latency(self, latency_ms: float) -> None:
+        # Reservoir sampling keeps the sample bounded on very large runs
+        seen = self.succeeded + self.failed
+        if len(self.latencies) < LATENCY_SAMPLE_SIZE:
+            self.latencies.append(latency_ms)
+        else:
+            slot = random.randrange(seen)
+            if slot < LATENCY_SAMPLE_SIZE:
+                self.latencies[slot] = latency_ms
+
+    def record_usage(self, usage: Dict[str, Any]) -> None:
+        self.prompt_tokens += usage.get("prompt_tokens", 0)
+        self.completion_tokens += usage.get("completion_tokens", 0)
+        self.total_tokens += usage.get("total_tokens", 0)
+        self.total_cost_usd += usage.get("cost", {}).get("total_cost_usd", 0)
+
+    def summary(self) -> Dict[str, Any]:
+        latencies = sorted(self.latencies)
+        return {
+            "type": "summary",
+            "requests": self.requests,
+            "succeeded": self.succeeded,
+            "failed": self.failed,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "total_tokens": self.total_tokens,
+            "total_cost_usd": round(self.total_cost_usd, 6),
+            "latency_ms": {
+                "p50": _percentile(latencies, 0.50),
+                "p95": _percentile(latencies, 0.95),
+                "p99": _percentile(latencies, 0.99),
+                "max": round(latencies[-1], 1) if latencies else None,
+            },
+            "wall_ms": round((time.perf_counter() - self.started) * 1000, 1),
+        }
+
+
+async def spool_body(chunks: AsyncIterator[bytes]) -> IO[bytes]:
+    """
+    Copy a request body into a temporary file that spills to disk past
+    BATCH_SPOOL_BYTES (default 1 MiB), so large inputs never sit in memory.
+    The body has to be read up front: once the response starts streaming,
+    the server's disconnect listener competes for the same receive channel.
+    """
+    spool = tempfile.SpooledTemporaryFile(max_size=int(os.getenv("BATCH_SPOOL_BYTES", str(1024 * 1024))))
+    async for chunk in chunks:
+        spool.write(chunk)
+    spool.seek(0)
+    return spool
+
+
+async def iter_lines(handle: IO) -> AsyncIterator[str]:
+    """Yield the lines of a text or binary file, closing it when done"""
+    try:
+        for line in handle:
+            yield line.decode("utf-8") if isinstance(line, bytes) else line
+    finally:
+        if handle is not sys.stdin:
+            handle.close()
+
+
+async def run_batch(
+    lines: AsyncIterator[str],
+    complete: Callable[[ChatRequest], Awaitable[Dict[str, Any]]],
+    concurrency: Optional[int] = None,
+    rate_limits: Optional[Dict[str, float]] = None,
+) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Run every ChatRequest line through `complete` and yield results in
+    completion order, followed by a summary.
+
+    At most `concurrency` (BATCH_CONCURRENCY, default 8) requests run at
+    once and input is only read as slots free up, so memory stays flat
+    however long the input is. `rate_limits` maps model names or aliases
+    to requests/second (BATCH_RATE_LIMITS, "*" for all); names are
+    normalized, so "gpt-4o" and "openai/gpt-4o" share one limit. Lines
+    using conversations or fallback routing fail on their own, since batch
+    requests are independent single calls.
+    """
+    if concurrency is None:
+        concurrency = int(os.getenv("BATCH_CONCURRENCY", "8"))
+    concurrency = max(concurrency, 1)
+    if rate_limits is None:
+        rate_limits = parse_rate_limits(os.getenv("BATCH_RATE_LIMITS"))
+    catalog = model_catalog.table
+    rate_limits = {model if model == "*" else catalog.normalize(model): rate for model, rate in rate_limits.items()}
+
+    limiters: Dict[str, RateLimiter] = {}
+    slots = asyncio.Semaphore(concurrency)
+    # Bounded so a slow reader applies backpressure instead of piling up results
+    results: asyncio.Queue = asyncio.Queue(maxsize=concurrency * 2)
+    stats = BatchStats()
+    tasks = set()
+
+    def limiter_for(model: str) -> Optional[RateLimiter]:
+        rate = rate_limits.get(model, rate_limits.get("*"))
+        if not rate or rate <= 0:
+            return None
+        if model not in limiters:
+            limiters[model] = RateLimiter(rate)
+        return limiters[model]
+
+    async def run_one(index: int, line: str) -> None:
+        try:
+            try:
+                request = ChatRequest.model_validate_json(line)
+                if not request.messages:
+                    raise ValueError("No messages provided")
+                if request.conversation_id is not None:
+                    raise ValueError("conversation_id is not supported in batch requests")
+                if request.routing is not None:
+                    raise ValueError("routing is not supported in batch requests")
+            except (ValidationError, ValueError) as e:
+                stats.failed += 1
+                await results.put({"type": "result", "index": index, "error": f"Invalid request: {str(e)}"})
+                return
+
+            limiter = limiter_for(catalog.normalize(request.model))
+            if limiter is not None:
+                await limiter.acquire()
+
+            started = time.perf_counter()
+            try:
+                result = await complete(request)
+            except Exception as e:
+                latency_ms = (time.perf_counter() - started) * 1000
+                stats.failed += 1
+                stats.record_latency(latency_ms)
+                await results.put({
+                    "type": "result",
+                    "index": index,
+                    "model": request.model,
+                    "error": str(e),
+                    "latency_ms": round(latency_ms, 1),
+                })
+                return
+
+            latency_ms = (time.perf_counter() - started) * 1000
+            stats.succeeded += 1
+            stats.record_latency(latency_ms)
+            stats.record_usage(result["usage"])
+            await results.put({
+                "type": "result",
+                "index": index,
+                "model": request.model,
+                "message": result["message"],
+                "usage": result["usage"],
+                "latency_ms": round(latency_ms, 1),
+            })
+        finally:
+            slots.release()
+
+    async def feed() -> None:
+        index = 0
+        async for line in lines:
+            if not line.strip():
+                continue
+            await slots.acquire()
+            task = asyncio.create_task(run_one(index, line))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+            index += 1
+            stats.requests = index
+        if tasks:
+            await asyncio.gather(*tasks)
+        await results.put(None)
+
+    feeder = asyncio.create_task(feed())
+    try:
+        while True:
+            result = await results.get()
+            if result is None:
+                break
+            yield result
+        # Surface errors from reading the input
+        await feeder
+        yield stats.summary()
+    finally:
+        # The client may have gone away mid-run, stop everything still in flight
+        feeder.cancel()
+        for task in tasks:
+            task.cancel()
+
+
+async def _run_cli(args: argparse.Namespace) -> None:
+    from .main import complete_batch_chat, shutdown, startup
+
+    # The same admission limits and usage ledger as the server
+    await startup()
+    output = open(args.output, "w", encoding="utf-8") if args.output else sys.stdout
+    try:
+        async for result in run_batch(
+            iter_lines(sys.stdin if args.input == "-" else open(args.input, "r", encoding="utf-8")),
+            complete_batch_chat,
+            concurrency=args.concurrency,
+            rate_limits=parse_rate_limits(",".join(args.rate)) if args.rate else None,
+        ):
+            output.write(json.dumps(result) + "\n")
+            output.flush()
+            if result["type"] == "summary":
+                print(json.dumps(result, indent=2), file=sys.stderr)
+    finally:
+        if output is not sys.stdout:
+            output.close()
+        await shutdown()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Run a JSONL file of ChatRequest objects through OpenRouter")
+    parser.add_argument("input", help="JSONL file of ChatRequest objects, or - for stdin")
+    parser.add_argument("-o", "--output", help="NDJSON results file (default: stdout)")
+    parser.add_argument("--concurrency", type=int, default=None, help="requests in flight at once")
+    parser.add_argument("--rate", action="append", metavar="MODEL=RPS",
+                        help="per-model requests/second, repeatable; use *=RPS for all models")
+    asyncio.run(_run_cli(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
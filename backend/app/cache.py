@@ -0,0 +1,214 @@
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+
+def make_cache_key(model: str, messages: List[Dict[str, str]]) -> str:
+    """Key a request by its normalized model and canonical JSON of its messages"""
+    canonical = json.dumps(
+        {"model": model, "messages": messages},
+        sort_keys=True,
+        separators=(",", ":"),
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def cache_policy(headers) -> Tuple[bool, bool]:
+    """
+    Work out (read, write) for a request from its headers.
+
+    `Cache-Control: no-cache` skips the lookup but still stores the fresh
+    answer; `Cache-Control: no-store` or `X-Cache-Bypass: 1` skips both.
+    """
+    cache_control = headers.get("cache-control", "").lower()
+    if "no-store" in cache_control or headers.get("x-cache-bypass", "") in ("1", "true"):
+        return False, False
+    if "no-cache" in cache_control:
+        return False, True
+    return True, True
+
+
+# The persistent tier is swept of expired and surplus rows every this many writes
+_DISK_SWEEP_EVERY = 100
+
+
+class _DiskTier:
+    """SQLite-backed persistent tier, accessed from worker threads"""
+
+    def __init__(self, path: str, ttl: float, max_entries: int) -> None:
+        self._lock = threading.Lock()
+        self._ttl = ttl
+        self._max_entries = max_entries
+        self._writes = 0
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT PRIMARY KEY, value TEXT NOT NULL, stored_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS responses_stored_at ON responses (stored_at)")
+        self._conn.commit()
+        self.sweep()
+
+    def sweep(self) -> None:
+        """Drop expired rows, then the oldest ones beyond the row cap"""
+        with self._lock:
+            self._conn.execute("DELETE FROM responses WHERE stored_at < ?", (time.time() - self._ttl,))
+            self._conn.execute(
+                "DELETE FROM responses WHERE key IN ("
+                " SELECT key FROM responses ORDER BY stored_at DESC LIMIT -1 OFFSET ?)",
+                (self._max_entries,),
+            )
+            self._conn.commit()
+
+    def get(self, key: str, ttl: float) -> Optional[Tuple[str, float]]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, stored_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None and time.time() - row[1] > ttl:
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._conn.commit()
+                return None
+        return row
+
+    def set(self, key: str, value: str, stored_at: float) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, value, stored_at) VALUES (?, ?, ?)",
+                (key, value, stored_at),
+            )
+            self._conn.commit()
+            self._writes += 1
+            due = self._writes % _DISK_SWEEP_EVERY == 0
+        if due:
+            self.sweep()
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class ResponseCache:
+    """
+    Opt-in cache of completed chat responses.
+
+    Entries are {"content": str, "usage": {...}} keyed by make_cache_key().
+    The in-memory tier is an LRU bounded by entry count and bytes with a
+    TTL; the optional SQLite tier survives restarts. Configured with:
+      RESPONSE_CACHE_ENABLED           "1" to turn the cache on
+      RESPONSE_CACHE_TTL               seconds (default 3600)
+      RESPONSE_CACHE_MAX_ENTRIES       default 1000
+      RESPONSE_CACHE_MAX_BYTES         default 64 MiB
+      RESPONSE_CACHE_PATH              SQLite file for the persistent tier
+      RESPONSE_CACHE_DISK_MAX_ENTRIES  row cap for that file (default 10000)
+
+    The SQLite tier is swept on start and every 100 writes: expired rows
+    are deleted, then the oldest rows beyond its row cap.
+    """
+
+    def __init__(self) -> None:
+        self.enabled = False
+        self.ttl = 3600.0
+        self.max_entries = 1000
+        self.max_bytes = 64 * 1024 * 1024
+        # key -> (json value, stored_at, size in bytes)
+        self._entries: "OrderedDict[str, Tuple[str, float, int]]" = OrderedDict()
+        self._bytes = 0
+        self._disk: Optional[_DiskTier] = None
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.bypasses = 0
+
+    async def start(self) -> None:
+        self.enabled = os.getenv("RESPONSE_CACHE_ENABLED", "").lower() in ("1", "true", "yes")
+        if not self.enabled:
+            return
+        self.ttl = float(os.getenv("RESPONSE_CACHE_TTL", "3600"))
+        self.max_entries = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "1000"))
+        self.max_bytes = int(os.getenv("RESPONSE_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+
+        path = os.getenv("RESPONSE_CACHE_PATH")
+        if path:
+            try:
+                disk_max_entries = int(os.getenv("RESPONSE_CACHE_DISK_MAX_ENTRIES", "10000"))
+                self._disk = await asyncio.to_thread(_DiskTier, path, self.ttl, disk_max_entries)
+            except sqlite3.Error as e:
+                print(f"Warning: Could not open response cache at {path}: {str(e)}")
+
+    async def close(self) -> None:
+        if self._disk is not None:
+            await asyncio.to_thread(self._disk.close)
+            self._disk = None
+        self._entries.clear()
+        self._bytes = 0
+
+    def _forget(self, key: str) -> None:
+        self._bytes -= self._entries.pop(key)[2]
+
+    def _remember(self, key: str, value: str, stored_at: float) -> None:
+        if key in self._entries:
+            self._forget(key)
+        size = len(value.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        self._entries[key] = (value, stored_at, size)
+        self._bytes += size
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            _, (_, _, evicted_size) = self._entries.popitem(last=False)
+            self._bytes -= evicted_size
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        entry = self._entries.get(key)
+        if entry is not None:
+            if time.time() - entry[1] <= self.ttl:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return json.loads(entry[0])
+            self._forget(key)
+
+        if self._disk is not None:
+            row = await asyncio.to_thread(self._disk.get, key, self.ttl)
+            if row is not None:
+                self._remember(key, row[0], row[1])
+                self.hits += 1
+                self.disk_hits += 1
+                return json.loads(row[0])
+
+        self.misses += 1
+        return None
+
+    async def set(self, key: str, content: str, usage: Dict[str, Any]) -> None:
+        value = json.dumps({"content": content, "usage": usage})
+        stored_at = time.time()
+        self._remember(key, value, stored_at)
+        if self._disk is not None:
+            try:
+                await asyncio.to_thread(self._disk.set, key, value, stored_at)
+            except sqlite3.Error as e:
+                print(f"Warning: Could not persist cached response: {str(e)}")
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "bypasses": self.bypasses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "persistent": self._disk is not None,
+        }
+
+
+response_cache = ResponseCache()
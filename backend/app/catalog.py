@@ -0,0 +1,454 @@
+import asyncio
+import hashlib
+import json
+import os
+import signal
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+
+# Shipped catalog of models, rates (USD per 1000 tokens), context windows and aliases
+DEFAULT_CATALOG_FILE = os.path.join(os.path.dirname(__file__), "models.json")
+
+# Models not in the catalog are billed at openai/gpt-3.5-turbo rates
+FALLBACK_MODEL = "openai/gpt-3.5-turbo"
+FALLBACK_PRICING = {"input": 0.0005, "output": 0.0015}
+# Shared metric label and per-model key for names outside the catalog
+OTHER_MODEL = "other"
+
+
+class CatalogError(Exception):
+    """A catalog source could not be read or is not a valid catalog"""
+
+
+def _env_key(model_key: str) -> str:
+    """MODEL_PRICE_<NAME> prefix for a model, e.g. openai/gpt-4o -> MODEL_PRICE_GPT4O"""
+    base_model_key = model_key.split("/")[-1] if "/" in model_key else model_key
+    normalized_model = base_model_key.replace("-", "").replace(".", "").upper()
+    return f"MODEL_PRICE_{normalized_model}"
+
+
+def _load_data_file(path: str) -> Dict[str, Any]:
+    """Read a JSON or TOML file"""
+    if path.endswith(".toml"):
+        try:
+            import tomllib
+        except ImportError:  # Python < 3.11
+            import tomli as tomllib
+        with open(path, "rb") as f:
+            return tomllib.load(f)
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def _load_pricing_file(path: str) -> Dict[str, Any]:
+    """Read a JSON or TOML pricing file of {model: {input, output, aliases}}"""
+    data = _load_data_file(path)
+    # Allow the entries to be nested under a "pricing" key
+    if isinstance(data.get("pricing"), dict):
+        data = data["pricing"]
+    return data
+
+
+def _validate_catalog(data: Any) -> None:
+    """Raise ValueError unless `data` has the shape of a catalog file"""
+    if not isinstance(data, dict):
+        raise ValueError("expected an object at the top level")
+    models = data.get("models", {})
+    if not isinstance(models, dict) or not all(isinstance(entry, dict) for entry in models.values()):
+        raise ValueError("models must map model ids to objects")
+    aliases = data.get("aliases", {})
+    if not isinstance(aliases, dict) or not all(isinstance(model_id, str) for model_id in aliases.values()):
+        raise ValueError("aliases must map names to model ids")
+    if not isinstance(data.get("default_provider", ""), str):
+        raise ValueError("default_provider must be a string")
+    cache_pricing = data.get("cache_pricing", {})
+    if not isinstance(cache_pricing, dict) or not all(isinstance(entry, dict) for entry in cache_pricing.values()):
+        raise ValueError("cache_pricing must map providers to objects")
+
+
+def _snapshot_models(data: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
+    """
+    Catalog entries from a saved OpenRouter /models response. OpenRouter
+    prices per token; models without a fixed price (e.g. routers) are skipped.
+    """
+    models: Dict[str, Dict[str, Any]] = {}
+    for item in data.get("data", []):
+        try:
+            pricing = item["pricing"]
+            prompt, completion = float(pricing["prompt"]), float(pricing["completion"])
+        except (KeyError, TypeError, ValueError):
+            continue
+        if prompt < 0 or completion < 0:
+            continue
+        entry = {"input": round(prompt * 1000, 10), "output": round(completion * 1000, 10)}
+        for field, key in (("cache_read", "input_cache_read"), ("cache_write", "input_cache_write")):
+            try:
+                price = float(pricing[key])
+            except (KeyError, TypeError, ValueError):
+                continue
+            if price >= 0:
+                entry[field] = round(price * 1000, 10)
+        if item.get("context_length"):
+            entry["context_length"] = int(item["context_length"])
+        if item.get("name"):
+            entry["name"] = item["name"]
+        models[item["id"]] = entry
+    return models
+
+
+class ModelCatalog:
+    """
+    Immutable snapshot of the known models, their rates and context windows,
+    plus a lookup index.
+
+    The index maps lower-cased ids, aliases and unambiguous provider-less
+    names (e.g. "gpt-4o") to the canonical model id, so resolving a name is
+    a dictionary lookup. `problems` lists aliases that point at unknown or
+    unpriced models. `cache_pricing` holds per-provider multipliers of the
+    input rate for prompt cache reads and writes, for models without their
+    own cache rates.
+    """
+
+    def __init__(
+        self,
+        models: Dict[str, Dict[str, Any]],
+        aliases: Dict[str, str],
+        default_provider: str = "openai",
+        sources: Optional[List[str]] = None,
+        cache_pricing: Optional[Dict[str, Dict[str, float]]] = None,
+    ) -> None:
+        self.models = models
+        self.default_provider = default_provider
+        self.sources = sources or []
+        self.cache_pricing = cache_pricing or {}
+        self.problems: List[str] = []
+        self.rates: Dict[str, Dict[str, float]] = {}
+        for model_id, entry in models.items():
+            if "input" in entry and "output" in entry:
+                self.rates[model_id] = {"input": entry["input"], "output": entry["output"]}
+            else:
+                self.problems.append(f"{model_id} has no price")
+
+        self.aliases: Dict[str, str] = {}
+        for alias, model_id in aliases.items():
+            if model_id not in self.rates:
+                self.problems.append(f"alias {alias} points at unpriced model {model_id}")
+                continue
+            self.aliases[alias] = model_id
+
+        self.index: Dict[str, str] = {}
+        base_names: Dict[str, Optional[str]] = {}
+        for model_id in self.rates:
+            if "/" in model_id:
+                base = model_id.split("/")[-1].lower()
+                # Two providers sharing a base name make it ambiguous
+                base_names[base] = None if base in base_names else model_id
+
+        for base, model_id in base_names.items():
+            if model_id is not None:
+                self.index[base] = model_id
+        # Explicit aliases win over base names
+        for alias, model_id in self.aliases.items():
+            self.index[alias.lower()] = model_id
+        for model_id in self.rates:
+            self.index[model_id.lower()] = model_id
+            self.index[model_id] = model_id
+
+        # Pre-serialised /api/models body and its ETag
+        self.body = self._listing()
+        self.etag = '"' + hashlib.sha256(self.body).hexdigest()[:32] + '"'
+
+    def _listing(self) -> bytes:
+        aliases_by_model: Dict[str, List[str]] = {}
+        for alias, model_id in self.aliases.items():
+            aliases_by_model.setdefault(model_id, []).append(alias)
+        listing = [
+            {
+                "id": model_id,
+                "name": self.models[model_id].get("name", model_id),
+                "input": rate["input"],
+                "output": rate["output"],
+                "context_length": self.models[model_id].get("context_length"),
+                "aliases": sorted(aliases_by_model.get(model_id, [])),
+            }
+            for model_id, rate in sorted(self.rates.items())
+        ]
+        return json.dumps({
+            "models": listing,
+            "default_provider": self.default_provider,
+            "note": "Costs are in USD per 1000 tokens",
+        }).encode("utf-8")
+
+    def resolve(self, model: str) -> Optional[str]:
+        return self.index.get(model) or self.index.get(model.lower())
+
+    def normalize(self, model: str) -> str:
+        """Canonical id for a model name; unknown names without a provider get the default one"""
+        model_id = self.resolve(model)
+        if model_id is not None:
+            return model_id
+        if "/" not in model:
+            return f"{self.default_provider}/{model}"
+        return model
+
+    def label(self, model: str) -> str:
+        """Canonical id for metric labels and per-model state; unknown names share OTHER_MODEL"""
+        return self.resolve(model) or OTHER_MODEL
+
+    def get(self, model: str) -> Dict[str, float]:
+        model_id = self.resolve(model)
+        if model_id is None:
+            return self.rates.get(FALLBACK_MODEL, FALLBACK_PRICING)
+        return self.rates[model_id]
+
+    def cache_rates(self, model: str) -> Dict[str, float]:
+        """Rates for prompt tokens read from and written to the provider's prompt cache"""
+        rates = self.get(model)
+        model_id = self.resolve(model)
+        entry = self.models[model_id] if model_id is not None else {}
+        # Without known discounts cached tokens cost the same as any other input
+        multipliers = self.cache_pricing.get((model_id or model).split("/")[0], {})
+        return {
+            "cache_read": entry.get("cache_read", round(rates["input"] * multipliers.get("read", 1.0), 10)),
+            "cache_write": entry.get("cache_write", round(rates["input"] * multipliers.get("write", 1.0), 10)),
+        }
+
+    def context_length(self, model: str) -> Optional[int]:
+        model_id = self.resolve(model)
+        return self.models[model_id].get("context_length") if model_id is not None else None
+
+
+def build_catalog(
+    catalog_file: Optional[str] = DEFAULT_CATALOG_FILE,
+    snapshot_file: Optional[str] = None,
+    pricing_file: Optional[str] = None,
+    strict: bool = False,
+) -> ModelCatalog:
+    """
+    Build a catalog from the catalog file, an optional OpenRouter /models
+    snapshot, an optional pricing file and MODEL_PRICE_<NAME>_INPUT /
+    _OUTPUT / _CACHE_READ / _CACHE_WRITE env overrides, in that order of
+    precedence (env wins). A source that cannot be read is skipped with a
+    warning, or with `strict` raises CatalogError, as does ending up with
+    no models at all.
+    """
+    models: Dict[str, Dict[str, Any]] = {}
+    aliases: Dict[str, str] = {}
+    default_provider = "openai"
+    cache_pricing: Dict[str, Dict[str, float]] = {}
+    sources: List[str] = []
+
+    def failed(message: str) -> None:
+        if strict:
+            raise CatalogError(message)
+        print(f"Warning: {message}")
+
+    def merge(entries: Dict[str, Any]) -> None:
+        for model_id, entry in entries.items():
+            model = models.setdefault(model_id, {})
+            for field in ("input", "output", "cache_read", "cache_write"):
+                if field in entry:
+                    model[field] = float(entry[field])
+            for field in ("context_length", "name"):
+                if entry.get(field):
+                    model[field] = entry[field]
+            for alias in entry.get("aliases", []):
+                aliases[alias] = model_id
+
+    if catalog_file:
+        try:
+            data = _load_data_file(catalog_file)
+            _validate_catalog(data)
+            merge(data.get("models", {}))
+            default_provider = data.get("default_provider", default_provider)
+            cache_pricing = data.get("cache_pricing", cache_pricing)
+            for alias, model_id in data.get("aliases", {}).items():
+                aliases[alias] = model_id
+            sources.append(catalog_file)
+        except Exception as e:
+            failed(f"Could not load model catalog {catalog_file}: {str(e)}")
+
+    if snapshot_file and os.path.exists(snapshot_file):
+        try:
+            merge(_snapshot_models(_load_data_file(snapshot_file)))
+            sources.append(snapshot_file)
+        except Exception as e:
+            failed(f"Could not load model snapshot {snapshot_file}: {str(e)}")
+
+    if pricing_file:
+        try:
+            for model_id, entry in _load_pricing_file(pricing_file).items():
+                if model_id not in models:
+                    models[model_id] = dict(FALLBACK_PRICING)
+                merge({model_id: entry})
+            sources.append(pricing_file)
+        except Exception as e:
+            failed(f"Could not load pricing file {pricing_file}: {str(e)}")
+
+    for model_id, model in models.items():
+        prefix = _env_key(model_id)
+        for field in ("input", "output", "cache_read", "cache_write"):
+            env_key = f"{prefix}_{field.upper()}"
+            price_str = os.getenv(env_key)
+            if price_str:
+                try:
+                    model[field] = float(price_str)
+                except ValueError:
+                    print(f"Warning: Invalid price format for {env_key}: {price_str}")
+
+    if strict and not models:
+        raise CatalogError("No models were loaded")
+    return ModelCatalog(models, aliases, default_provider, sources, cache_pricing)
+
+
+class ModelCatalogRegistry:
+    """
+    Process-wide model catalog, built once and swapped atomically on reload.
+
+    Sources are read from:
+      MODEL_CATALOG_FILE              models, rates, context windows and aliases
+                                      (default: the shipped app/models.json)
+      MODEL_CATALOG_SNAPSHOT          saved OpenRouter /models list (optional)
+      MODEL_CATALOG_REFRESH_INTERVAL  seconds between snapshot downloads
+                                      (default 86400, 0 never downloads)
+      MODEL_CATALOG_STRICT            "1" to refuse to start (or reload) when a
+                                      source cannot be read or an alias
+                                      resolves to an unpriced model
+      MODEL_PRICING_FILE              rate overrides and extra aliases
+    A reload happens on SIGHUP, or when a source file's mtime changes
+    (polled every PRICING_RELOAD_INTERVAL seconds, default 5, 0 disables polling).
+    A reload whose sources cannot be read keeps the current catalog.
+    """
+
+    def __init__(self) -> None:
+        self.catalog_file: Optional[str] = None
+        self.snapshot_file: Optional[str] = None
+        self.pricing_file: Optional[str] = None
+        self._table: Optional[ModelCatalog] = None
+        self._mtimes: Tuple[Optional[float], ...] = ()
+        self._watch_task: Optional[asyncio.Task] = None
+        self._refresh_task: Optional[asyncio.Task] = None
+
+    @property
+    def table(self) -> ModelCatalog:
+        if self._table is None:
+            # Used before start(), e.g. by a script: take what can be read
+            self._table = self._build(strict=False)
+        return self._table
+
+    @property
+    def strict(self) -> bool:
+        return os.getenv("MODEL_CATALOG_STRICT", "").lower() in ("1", "true", "yes")
+
+    @staticmethod
+    def _mtime(path: Optional[str]) -> Optional[float]:
+        if not path:
+            return None
+        try:
+            return os.path.getmtime(path)
+        except OSError:
+            return None
+
+    def _current_mtimes(self) -> Tuple[Optional[float], ...]:
+        return tuple(self._mtime(path) for path in (self.catalog_file, self.snapshot_file, self.pricing_file))
+
+    def _build(self, strict: bool) -> ModelCatalog:
+        # Read lazily so values from .env are picked up
+        self.catalog_file = os.getenv("MODEL_CATALOG_FILE") or DEFAULT_CATALOG_FILE
+        self.snapshot_file = os.getenv("MODEL_CATALOG_SNAPSHOT") or None
+        self.pricing_file = os.getenv("MODEL_PRICING_FILE") or None
+        # Taken first, so a file changed while it is read is read again
+        self._mtimes = self._current_mtimes()
+        return build_catalog(self.catalog_file, self.snapshot_file, self.pricing_file, strict=strict)
+
+    def _check(self, table: ModelCatalog) -> None:
+        for problem in table.problems:
+            print(f"Warning: Model catalog: {problem}")
+        if table.problems and self.strict:
+            raise CatalogError(f"Model catalog has {len(table.problems)} problem(s), see the warnings above")
+
+    def reload(self) -> bool:
+        """
+        Rebuild the catalog and swap it in. The current catalog stays if a
+        source cannot be read or is invalid, or under MODEL_CATALOG_STRICT if
+        the new one has problems. Returns whether the new catalog was taken.
+        """
+        try:
+            # Built and checked fully before it is swapped in
+            table = self._build(strict=True)
+            self._check(table)
+        except CatalogError as e:
+            if self._table is None:
+                raise
+            print(f"Warning: Keeping the current model catalog: {str(e)}")
+            return False
+        self._table = table
+        return True
+
+    async def _watch(self, interval: float) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            if self._current_mtimes() != self._mtimes:
+                print("Reloading the model catalog")
+                self.reload()
+
+    async def refresh_snapshot(self) -> None:
+        """Download OpenRouter's model list to the snapshot file and reload"""
+        from .upstream import upstream
+
+        response = await upstream.client.get(upstream.models_url)
+        response.raise_for_status()
+        data = response.json()
+        if not isinstance(data.get("data"), list):
+            raise ValueError("unexpected /models response")
+        # Write to a temporary file first so readers never see half a snapshot
+        partial = f"{self.snapshot_file}.tmp"
+        with open(partial, "wb") as f:
+            f.write(response.content)
+        os.replace(partial, self.snapshot_file)
+        if not self.reload():
+            raise CatalogError("The downloaded snapshot was not taken, see the warning above")
+
+    async def _refresh(self, interval: float) -> None:
+        age = time.time() - (self._mtime(self.snapshot_file) or 0)
+        delay = max(interval - age, 0)
+        while True:
+            await asyncio.sleep(delay)
+            try:
+                await self.refresh_snapshot()
+                print(f"Saved {len(self.table.models)} models from OpenRouter to {self.snapshot_file}")
+            except Exception as e:
+                print(f"Warning: Could not refresh model snapshot: {str(e)}")
+            delay = interval
+
+    async def start(self) -> None:
+        # Without MODEL_CATALOG_STRICT, start with whatever could be read
+        table = self._build(strict=self.strict)
+        self._check(table)
+        self._table = table
+
+        loop = asyncio.get_running_loop()
+        try:
+            loop.add_signal_handler(signal.SIGHUP, self.reload)
+        except (AttributeError, NotImplementedError, RuntimeError, ValueError):
+            # No SIGHUP on Windows, or not running in the main thread
+            pass
+
+        interval = float(os.getenv("PRICING_RELOAD_INTERVAL", "5"))
+        if interval > 0:
+            self._watch_task = asyncio.create_task(self._watch(interval))
+
+        refresh_interval = float(os.getenv("MODEL_CATALOG_REFRESH_INTERVAL", "86400"))
+        if self.snapshot_file and refresh_interval > 0:
+            self._refresh_task = asyncio.create_task(self._refresh(refresh_interval))
+
+    async def close(self) -> None:
+        for task in (self._watch_task, self._refresh_task):
+            if task is not None:
+                task.cancel()
+        self._watch_task = None
+        self._refresh_task = None
+
+
+model_catalog = ModelCatalogRegistry()
@@ -0,0 +1,232 @@
+import email.message
+import json
+import os
+from typing import Any, Dict, List, Optional, Sequence
+
+from fastapi.exceptions import RequestValidationError
+from pydantic import ValidationError
+
+from .schemas import ChatRequest
+from .tokens import CONTEXT_STRATEGIES
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+# The string encoder json.dumps(ensure_ascii=False) uses, so hand-built
+# JSON is byte-for-byte what httpx (0.28 and later) serialises the dict to
+_encode_string = json.encoder.encode_basestring
+
+# Starlette's JSONResponse settings. orjson is not used for responses: it
+# writes 1e-6 where Python writes 1e-06, and costs are often that small.
+_response_encoder = json.JSONEncoder(ensure_ascii=False, allow_nan=False, separators=(",", ":"))
+
+_DEFAULT_MODEL = ChatRequest.model_fields["model"].default
+
+
+class Message:
+    """One chat message, in place of a ChatMessage model on the fast path"""
+
+    __slots__ = ("role", "content")
+
+    def __init__(self, role: str, content: str) -> None:
+        self.role = role
+        self.content = content
+
+
+class FastChatRequest:
+    """
+    A ChatRequest built without pydantic. Only made for bodies whose fields
+    already have their final types, so it holds exactly what
+    ChatRequest.model_validate would have produced.
+    """
+
+    __slots__ = ("messages", "model", "stream", "conversation_id", "conversation_reset", "routing", "context_overflow")
+
+    def __init__(
+        self,
+        messages: List[Message],
+        model: str,
+        stream: Optional[bool],
+        conversation_id: Optional[str],
+        conversation_reset: Optional[bool],
+        context_overflow: Optional[str],
+    ) -> None:
+        self.messages = messages
+        self.model = model
+        self.stream = stream
+        self.conversation_id = conversation_id
+        self.conversation_reset = conversation_reset
+        self.routing = None
+        self.context_overflow = context_overflow
+
+
+def _fast_request(data: Any) -> Optional[FastChatRequest]:
+    """The request in `data`, or None if it needs pydantic (coercion, routing or an error)"""
+    if type(data) is not dict:
+        return None
+    items = data.get("messages")
+    if type(items) is not list:
+        return None
+    messages = []
+    for item in items:
+        if type(item) is not dict:
+            return None
+        role = item.get("role")
+        content = item.get("content")
+        if type(role) is not str or type(content) is not str:
+            return None
+        messages.append(Message(role, content))
+
+    model = data.get("model", _DEFAULT_MODEL)
+    stream = data.get("stream", False)
+    conversation_id = data.get("conversation_id")
+    conversation_reset = data.get("conversation_reset", False)
+    context_overflow = data.get("context_overflow")
+    if (
+        type(model) is not str
+        or not model
+        or (stream is not None and type(stream) is not bool)
+        or (conversation_id is not None and type(conversation_id) is not str)
+        or (conversation_reset is not None and type(conversation_reset) is not bool)
+        or (context_overflow is not None and context_overflow not in CONTEXT_STRATEGIES)
+        or data.get("routing") is not None
+    ):
+        return None
+    return FastChatRequest(messages, model, stream, conversation_id, conversation_reset, context_overflow)
+
+
+def _is_json(content_type: Optional[str]) -> bool:
+    # FastAPI only parses application/json and */*+json bodies as JSON
+    if not content_type:
+        return False
+    message = email.message.Message()
+    message["content-type"] = content_type
+    subtype = message.get_content_subtype()
+    return message.get_content_maintype() == "application" and (subtype == "json" or subtype.endswith("+json"))
+
+
+def loads(data: bytes) -> Any:
+    """json.loads, through orjson when it is installed"""
+    if orjson is not None:
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            # e.g. NaN, which only the standard library accepts
+            pass
+    return json.loads(data)
+
+
+def _encode_message(message: Any, breakpoint: bool) -> str:
+    if breakpoint:
+        # The text block form prompt_cache.cached_message() builds
+        return (
+            '{"role":' + _encode_string(message.role) + ',"content":[{"type":"text","text":'
+            + _encode_string(message.content) + ',"cache_control":{"type":"ephemeral"}}]}'
+        )
+    return '{"role":' + _encode_string(message.role) + ',"content":' + _encode_string(message.content) + "}"
+
+
+def encode_payload(model: str, messages: Sequence[Any], stream: bool, breakpoints: Sequence[int] = ()) -> bytes:
+    """
+    The upstream request body for `messages` in one pass, without building
+    the dicts first, with cache breakpoints after the messages at
+    `breakpoints`. Byte-for-byte what httpx (0.28 and later, which encodes
+    compactly without escaping non-ASCII) sends for the same dict.
+    """
+    return "".join((
+        '{"model":', _encode_string(model), ',"messages":[',
+        ",".join([_encode_message(message, index in breakpoints) for index, message in enumerate(messages)]),
+        '],"stream":true}' if stream else "]}",
+    )).encode("utf-8")
+
+
+def encode_response(content: Any) -> bytes:
+    """A JSON response body, identical to what FastAPI renders for the same dict"""
+    return _response_encoder.encode(content).encode("utf-8")
+
+
+class ChatCodec:
+    """
+    Parsing of /api/chat bodies and encoding of upstream payloads and
+    responses. With FAST_CODEC=1 bodies are read with orjson (when
+    installed) straight into slotted message objects, upstream payloads are
+    encoded in one pass and responses skip FastAPI's jsonable_encoder walk.
+    Bodies that need coercion, carry a routing policy or fail validation go
+    through the ChatRequest model as usual, so responses and 422 errors are
+    the same either way.
+    """
+
+    def __init__(self) -> None:
+        self.fast = 0
+        self.fallbacks = 0
+
+    @property
+    def enabled(self) -> bool:
+        # Read lazily, environment variables are loaded after import
+        return os.getenv("FAST_CODEC", "0").lower() in ("1", "true", "yes")
+
+    def parse(self, body: bytes, content_type: Optional[str]):
+        """
+        The chat request in `body`, validated the way FastAPI validates a
+        ChatRequest parameter. Raises RequestValidationError.
+        """
+        if not body:
+            data = None
+        elif not _is_json(content_type):
+            data = body
+        elif self.enabled:
+            try:
+                data = loads(body)
+            except json.JSONDecodeError:
+                data = self._loads(body)
+        else:
+            data = self._loads(body)
+        if data is None:
+            raise RequestValidationError([{"type": "missing", "loc": ("body",), "msg": "Field required", "input": None}])
+        return self.validate(data)
+
+    def validate(self, data: Any):
+        """The chat request in already decoded JSON. Raises RequestValidationError."""
+        if self.enabled:
+            request = _fast_request(data)
+            if request is not None:
+                self.fast += 1
+                return request
+            self.fallbacks += 1
+        try:
+            # FastAPI validates with from_attributes, which words the errors differently
+            return ChatRequest.model_validate(data, from_attributes=True)
+        except ValidationError as e:
+            raise RequestValidationError(
+                [{**error, "loc": ("body", *error["loc"])} for error in e.errors(include_url=False)],
+                body=data
+            )
+
+    def _loads(self, body: bytes) -> Any:
+        try:
+            return json.loads(body)
+        except json.JSONDecodeError as e:
+            raise RequestValidationError(
+                [{"type": "json_invalid", "loc": ("body", e.pos), "msg": "JSON decode error", "input": {}, "ctx": {"error": e.msg}}],
+                body=e.doc
+            )
+
+    def payload(self, model: str, messages: Sequence[Any], stream: bool, breakpoints: Sequence[int] = ()) -> Optional[bytes]:
+        """The pre-serialised upstream body, or None to let httpx encode the dict"""
+        return encode_payload(model, messages, stream, breakpoints) if self.enabled else None
+
+    def stats(self) -> Dict[str, Any]:
+        parsed = self.fast + self.fallbacks
+        return {
+            "enabled": self.enabled,
+            "json": "orjson" if orjson is not None else "json",
+            "fast": self.fast,
+            "fallbacks": self.fallbacks,
+            "fast_ratio": round(self.fast / parsed, 4) if parsed else 0.0,
+        }
+
+
+chat_codec = ChatCodec()
@@ -0,0 +1,174 @@
+import json
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+from .tokens import token_estimator
+
+
+def _encode_messages(messages: List[Dict[str, str]]) -> bytes:
+    """Encode messages as the comma-separated body of a JSON array"""
+    return b",".join(
+        json.dumps(message, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        for message in messages
+    )
+
+
+class Conversation:
+    """
+    Message history for one conversation, kept pre-serialised.
+
+    `prefix` holds the JSON of every message so far without the enclosing
+    brackets, so a turn only encodes its new messages and splices them on.
+    `tokens` is the estimated prompt size of those messages.
+    """
+
+    __slots__ = ("id", "prefix", "message_count", "tokens", "last_used")
+
+    def __init__(self, conversation_id: str) -> None:
+        self.id = conversation_id
+        self.prefix = bytearray()
+        self.message_count = 0
+        self.tokens = 0
+        self.last_used = time.monotonic()
+
+    def payload(self, model: str, new_messages: List[Dict[str, str]], stream: bool = False) -> bytes:
+        """Build the full upstream request body for this history plus `new_messages`"""
+        parts = [b'{"model":', json.dumps(model).encode("utf-8"), b',"messages":[', bytes(self.prefix)]
+        if new_messages:
+            if self.prefix:
+                parts.append(b",")
+            parts.append(_encode_messages(new_messages))
+        parts.append(b'],"stream":true}' if stream else b"]}")
+        return b"".join(parts)
+
+
+class ConversationTurn:
+    """A running turn of a conversation; release it exactly once when the turn ends"""
+
+    __slots__ = ("store", "conversation_id", "released")
+
+    def __init__(self, store: "ConversationStore", conversation_id: str) -> None:
+        self.store = store
+        self.conversation_id = conversation_id
+        self.released = False
+
+    def release(self) -> None:
+        if self.released:
+            return
+        self.released = True
+        self.store._end_turn(self)
+
+
+class ConversationStore:
+    """
+    Bounded in-memory store of conversations, evicted least-recently-used
+    first once over CONVERSATION_MAX_SESSIONS (default 10000) sessions or
+    CONVERSATION_MAX_BYTES (default 256 MiB) of history, and dropped after
+    CONVERSATION_IDLE_TTL seconds (default 3600) without a turn. Turns of
+    one conversation run one at a time, so each sees the one before it.
+    """
+
+    def __init__(self) -> None:
+        self._conversations: "OrderedDict[str, Conversation]" = OrderedDict()
+        self._turns: Dict[str, ConversationTurn] = {}
+        self._bytes = 0
+        self.evictions = 0
+        self.busy = 0
+
+    @property
+    def max_sessions(self) -> int:
+        return int(os.getenv("CONVERSATION_MAX_SESSIONS", "10000"))
+
+    @property
+    def max_bytes(self) -> int:
+        return int(os.getenv("CONVERSATION_MAX_BYTES", str(256 * 1024 * 1024)))
+
+    @property
+    def idle_ttl(self) -> float:
+        return float(os.getenv("CONVERSATION_IDLE_TTL", "3600"))
+
+    def _evict_idle(self) -> None:
+        cutoff = time.monotonic() - self.idle_ttl
+        # Oldest-used conversations sit at the front
+        while self._conversations:
+            conversation = next(iter(self._conversations.values()))
+            if conversation.last_used >= cutoff:
+                break
+            self._remove(conversation.id)
+            self.evictions += 1
+
+    def _remove(self, conversation_id: str) -> None:
+        conversation = self._conversations.pop(conversation_id)
+        self._bytes -= len(conversation.prefix)
+
+    def get(self, conversation_id: str) -> Optional[Conversation]:
+        self._evict_idle()
+        conversation = self._conversations.get(conversation_id)
+        if conversation is not None:
+            conversation.last_used = time.monotonic()
+            self._conversations.move_to_end(conversation_id)
+        return conversation
+
+    def begin_turn(self, conversation_id: str) -> Optional[ConversationTurn]:
+        """Claim a conversation for one turn, or None while another turn of it is running"""
+        if conversation_id in self._turns:
+            self.busy += 1
+            return None
+        turn = ConversationTurn(self, conversation_id)
+        self._turns[conversation_id] = turn
+        return turn
+
+    def _end_turn(self, turn: ConversationTurn) -> None:
+        if self._turns.get(turn.conversation_id) is turn:
+            del self._turns[turn.conversation_id]
+
+    def commit(self, conversation: Conversation, messages: List[Dict[str, str]]) -> None:
+        """Append a finished turn to the history and (re)install it in the store"""
+        if conversation.id in self._conversations:
+            if self._conversations[conversation.id] is not conversation:
+                # A reset replaced the history while this turn was running
+                self._remove(conversation.id)
+            else:
+                self._bytes -= len(conversation.prefix)
+
+        if messages:
+            if conversation.prefix:
+                conversation.prefix += b","
+            conversation.prefix += _encode_messages(messages)
+            conversation.message_count += len(messages)
+            conversation.tokens += sum(token_estimator.count_message(message["role"], message["content"]) for message in messages)
+        conversation.last_used = time.monotonic()
+
+        self._conversations[conversation.id] = conversation
+        self._conversations.move_to_end(conversation.id)
+        self._bytes += len(conversation.prefix)
+
+        max_sessions, max_bytes = self.max_sessions, self.max_bytes
+        while len(self._conversations) > 1 and (
+            len(self._conversations) > max_sessions or self._bytes > max_bytes
+        ):
+            self._remove(next(iter(self._conversations)))
+            self.evictions += 1
+
+    def discard(self, conversation_id: str) -> bool:
+        if conversation_id not in self._conversations:
+            return False
+        self._remove(conversation_id)
+        return True
+
+    def stats(self) -> Dict[str, Any]:
+        self._evict_idle()
+        return {
+            "conversations": len(self._conversations),
+            "bytes": self._bytes,
+            "evictions": self.evictions,
+            "running_turns": len(self._turns),
+            "busy": self.busy,
+            "max_sessions": self.max_sessions,
+            "max_bytes": self.max_bytes,
+        }
+
+
+conversation_store = ConversationStore()
@@ -0,0 +1,266 @@
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+
+# Rollup granularities and their bucket width in seconds (UTC aligned)
+GRANULARITIES = {"hour": 3600, "day": 86400}
+
+# Outcomes that are not counted as errors in the rollups
+OK_STATUSES = ("ok", "cached", "coalesced")
+
+# (ts, model, status, stream, prompt_tokens, completion_tokens, total_tokens, cost_usd, latency_ms)
+UsageRecord = Tuple[float, str, str, int, int, int, int, float, float]
+
+
+class _LedgerStore:
+    """SQLite ledger, written and read from worker threads"""
+
+    def __init__(self, path: str) -> None:
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS usage ("
+            " id INTEGER PRIMARY KEY, ts REAL NOT NULL, model TEXT NOT NULL, status TEXT NOT NULL,"
+            " stream INTEGER NOT NULL, prompt_tokens INTEGER NOT NULL, completion_tokens INTEGER NOT NULL,"
+            " total_tokens INTEGER NOT NULL, cost_usd REAL NOT NULL, latency_ms REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS usage_rollup ("
+            " granularity TEXT NOT NULL, bucket INTEGER NOT NULL, model TEXT NOT NULL,"
+            " requests INTEGER NOT NULL, errors INTEGER NOT NULL, cached INTEGER NOT NULL,"
+            " prompt_tokens INTEGER NOT NULL, completion_tokens INTEGER NOT NULL, total_tokens INTEGER NOT NULL,"
+            " cost_usd REAL NOT NULL, latency_ms_sum REAL NOT NULL, latency_ms_max REAL NOT NULL,"
+            " PRIMARY KEY (granularity, bucket, model))"
+        )
+        self._conn.commit()
+
+    def write(self, records: List[UsageRecord]) -> None:
+        """Append records and fold them into the rollups in one transaction"""
+        rollups: Dict[Tuple[str, int, str], List[float]] = {}
+        for ts, model, status, _, prompt_tokens, completion_tokens, total_tokens, cost, latency in records:
+            for granularity, width in GRANULARITIES.items():
+                key = (granularity, int(ts // width) * width, model)
+                row = rollups.get(key)
+                if row is None:
+                    row = rollups[key] = [0, 0, 0, 0, 0, 0, 0.0, 0.0, 0.0]
+                row[0] += 1
+                row[1] += status not in OK_STATUSES
+                row[2] += status == "cached"
+                row[3] += prompt_tokens
+                row[4] += completion_tokens
+                row[5] += total_tokens
+                row[6] += cost
+                row[7] += latency
+                row[8] = max(row[8], latency)
+
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT INTO usage (ts, model, status, stream, prompt_tokens, completion_tokens,"
+                " total_tokens, cost_usd, latency_ms) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                records,
+            )
+            self._conn.executemany(
+                "INSERT INTO usage_rollup VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+                " ON CONFLICT (granularity, bucket, model) DO UPDATE SET"
+                " requests = requests + excluded.requests, errors = errors + excluded.errors,"
+                " cached = cached + excluded.cached, prompt_tokens = prompt_tokens + excluded.prompt_tokens,"
+                " completion_tokens = completion_tokens + excluded.completion_tokens,"
+                " total_tokens = total_tokens + excluded.total_tokens, cost_usd = cost_usd + excluded.cost_usd,"
+                " latency_ms_sum = latency_ms_sum + excluded.latency_ms_sum,"
+                " latency_ms_max = MAX(latency_ms_max, excluded.latency_ms_max)",
+                [key + tuple(row) for key, row in rollups.items()],
+            )
+
+    def rollups(self, granularity: str, since: float, until: float, model: Optional[str]) -> List[Tuple]:
+        query = (
+            "SELECT bucket, model, requests, errors, cached, prompt_tokens, completion_tokens, total_tokens,"
+            " cost_usd, latency_ms_sum, latency_ms_max FROM usage_rollup"
+            " WHERE granularity = ? AND bucket >= ? AND bucket < ?"
+        )
+        params: List[Any] = [granularity, int(since // GRANULARITIES[granularity]) * GRANULARITIES[granularity], until]
+        if model is not None:
+            query += " AND model = ?"
+            params.append(model)
+        with self._lock:
+            return self._conn.execute(query + " ORDER BY bucket, model", params).fetchall()
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class UsageLedger:
+    """
+    Append-only ledger of per-request usage and cost.
+
+    record() only appends to an in-memory queue; a background task writes
+    the queue to SQLite in batches and keeps hourly and daily rollups per
+    model up to date, so reports never scan the raw records. If the queue
+    fills up faster than it drains, new records are dropped and counted
+    rather than slowing requests down. Configured with:
+      USAGE_LEDGER_ENABLED         "0" to turn the ledger off (default on)
+      USAGE_LEDGER_PATH            SQLite file (default usage.db)
+      USAGE_LEDGER_FLUSH_INTERVAL  seconds between writes (default 1)
+      USAGE_LEDGER_BATCH_SIZE      records that trigger an early write (default 500)
+      USAGE_LEDGER_QUEUE_SIZE      records held in memory at most (default 100000)
+    """
+
+    def __init__(self) -> None:
+        self.enabled = False
+        self.flush_interval = 1.0
+        self.batch_size = 500
+        self.queue_size = 100000
+        self._pending: Deque[UsageRecord] = deque()
+        self._store: Optional[_LedgerStore] = None
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._write_lock: Optional[asyncio.Lock] = None
+        self.recorded = 0
+        self.written = 0
+        self.dropped = 0
+        self.batches = 0
+
+    async def start(self) -> None:
+        self.enabled = os.getenv("USAGE_LEDGER_ENABLED", "1").lower() in ("1", "true", "yes")
+        if not self.enabled:
+            return
+        self.flush_interval = float(os.getenv("USAGE_LEDGER_FLUSH_INTERVAL", "1"))
+        self.batch_size = int(os.getenv("USAGE_LEDGER_BATCH_SIZE", "500"))
+        self.queue_size = int(os.getenv("USAGE_LEDGER_QUEUE_SIZE", "100000"))
+
+        path = os.getenv("USAGE_LEDGER_PATH", "usage.db")
+        try:
+            self._store = await asyncio.to_thread(_LedgerStore, path)
+        except sqlite3.Error as e:
+            print(f"Warning: Could not open usage ledger at {path}: {str(e)}")
+            self.enabled = False
+            return
+        self._wakeup = asyncio.Event()
+        self._write_lock = asyncio.Lock()
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._store is not None:
+            # Write out whatever is still queued before shutting down
+            await self.flush()
+            await asyncio.to_thread(self._store.close)
+            self._store = None
+
+    def record(self, model: str, status: str, stream: bool, usage: Optional[Dict[str, Any]], latency_ms: float) -> None:
+        """Queue one request's usage; never blocks"""
+        if not self.enabled:
+            return
+        if len(self._pending) >= self.queue_size:
+            self.dropped += 1
+            return
+        usage = usage or {}
+        # Cached and coalesced answers did not cost anything upstream
+        cost = 0.0 if status == "cached" or usage.get("coalesced") else usage.get("cost", {}).get("total_cost_usd", 0.0)
+        self._pending.append((
+            time.time(),
+            model,
+            status,
+            int(stream),
+            usage.get("prompt_tokens", 0),
+            usage.get("completion_tokens", 0),
+            usage.get("total_tokens", 0),
+            cost,
+            round(latency_ms, 1),
+        ))
+        self.recorded += 1
+        if len(self._pending) >= self.batch_size and self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    async def flush(self) -> None:
+        """Write everything queued so far"""
+        if self._store is None:
+            return
+        async with self._write_lock:
+            while self._pending:
+                batch = [self._pending.popleft() for _ in range(min(len(self._pending), self.batch_size))]
+                try:
+                    await asyncio.to_thread(self._store.write, batch)
+                except sqlite3.Error as e:
+                    print(f"Warning: Could not write {len(batch)} usage records: {str(e)}")
+                    self.dropped += len(batch)
+                    continue
+                self.written += len(batch)
+                self.batches += 1
+
+    async def report(self, granularity: str, since: float, until: float, model: Optional[str] = None) -> Dict[str, Any]:
+        """Usage per time bucket and model, plus totals per model, from the rollups"""
+        await self.flush()
+        rows = await asyncio.to_thread(self._store.rollups, granularity, since, until, model)
+        buckets = []
+        totals: Dict[str, Dict[str, Any]] = {}
+        for bucket, name, requests, errors, cached, prompt, completion, total, cost, latency_sum, latency_max in rows:
+            buckets.append({
+                "bucket": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(bucket)),
+                "model": name,
+                "requests": requests,
+                "errors": errors,
+                "cached": cached,
+                "prompt_tokens": prompt,
+                "completion_tokens": completion,
+                "total_tokens": total,
+                "cost_usd": round(cost, 6),
+                "avg_latency_ms": round(latency_sum / requests, 1) if requests else None,
+                "max_latency_ms": latency_max,
+            })
+            summary = totals.setdefault(name, {
+                "requests": 0, "errors": 0, "cached": 0,
+                "prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0, "cost_usd": 0.0,
+            })
+            summary["requests"] += requests
+            summary["errors"] += errors
+            summary["cached"] += cached
+            summary["prompt_tokens"] += prompt
+            summary["completion_tokens"] += completion
+            summary["total_tokens"] += total
+            summary["cost_usd"] += cost
+        for summary in totals.values():
+            summary["cost_usd"] = round(summary["cost_usd"], 6)
+        return {
+            "granularity": granularity,
+            "since": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(since)),
+            "until": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(until)),
+            "buckets": buckets,
+            "totals": totals,
+            "total_cost_usd": round(sum(summary["cost_usd"] for summary in totals.values()), 6),
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "pending": len(self._pending),
+            "recorded": self.recorded,
+            "written": self.written,
+            "dropped": self.dropped,
+            "batches": self.batches,
+        }
+
+
+usage_ledger = UsageLedger()
@@ -0,0 +1,195 @@
+import asyncio
+import contextvars
+import time
+from typing import Any, AsyncIterator, Awaitable, Dict, Optional
+
+from .catalog import model_catalog
+from .metrics import Counter, registry
+
+
+class DeadlineExceeded(Exception):
+    """The request's time budget ran out"""
+
+
+class ClientDisconnected(Exception):
+    """The client went away before the answer was ready"""
+
+
+class Deadline:
+    """A point in time by which a request has to be answered"""
+
+    __slots__ = ("expires",)
+
+    def __init__(self, seconds: float) -> None:
+        self.expires = time.monotonic() + seconds
+
+    def remaining(self) -> float:
+        return max(self.expires - time.monotonic(), 0.0)
+
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def clamp(self, seconds: Optional[float]) -> float:
+        """The smaller of `seconds` (None meaning unbounded) and the time left"""
+        remaining = self.remaining()
+        return remaining if seconds is None else min(seconds, remaining)
+
+
+# Deadline of the request being served, so upstream calls can bound their
+# timeouts by it without threading it through every call
+current_deadline: contextvars.ContextVar[Optional[Deadline]] = contextvars.ContextVar("current_deadline", default=None)
+
+
+def parse_deadline(headers) -> Optional[Deadline]:
+    """
+    Read a request's time budget from `X-Request-Timeout-Ms` (relative) or
+    `X-Request-Deadline` (absolute, Unix seconds). Invalid values are ignored.
+    """
+    timeout_ms = headers.get("x-request-timeout-ms")
+    if timeout_ms:
+        try:
+            return Deadline(float(timeout_ms) / 1000)
+        except ValueError:
+            print(f"Warning: Invalid X-Request-Timeout-Ms: {timeout_ms}")
+    deadline = headers.get("x-request-deadline")
+    if deadline:
+        try:
+            return Deadline(float(deadline) - time.time())
+        except ValueError:
+            print(f"Warning: Invalid X-Request-Deadline: {deadline}")
+    return None
+
+
+async def with_deadline(events: AsyncIterator[Dict[str, Any]], deadline: Deadline) -> AsyncIterator[Dict[str, Any]]:
+    """Pass events through, raising DeadlineExceeded once the budget is spent"""
+    iterator = events.__aiter__()
+    try:
+        while True:
+            try:
+                # Timing out cancels the pending read, which closes the upstream stream
+                event = await asyncio.wait_for(iterator.__anext__(), deadline.remaining())
+            except StopAsyncIteration:
+                return
+            except asyncio.TimeoutError:
+                raise DeadlineExceeded("Deadline exceeded")
+            yield event
+    finally:
+        if hasattr(iterator, "aclose"):
+            await iterator.aclose()
+
+
+async def wait_for_disconnect(receive) -> None:
+    """Return once the ASGI server reports that the client has gone away"""
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            return
+
+
+def server_watches_disconnects(scope: Dict[str, Any]) -> bool:
+    """
+    Whether Starlette's StreamingResponse will notice a disconnect by itself.
+    Before ASGI spec 2.4 it listens for http.disconnect and cancels the stream;
+    from 2.4 on it only notices when a write fails.
+    """
+    spec_version = scope.get("asgi", {}).get("spec_version", "2.0")
+    return tuple(map(int, spec_version.split("."))) < (2, 4)
+
+
+async def cancel_on_disconnect(request, frames: AsyncIterator[Any]) -> AsyncIterator[Any]:
+    """
+    Stop a streaming response as soon as the client disconnects, even while
+    upstream is quiet, for servers where StreamingResponse only finds out on
+    the next write.
+    """
+    iterator = frames.__aiter__()
+    watcher = asyncio.ensure_future(wait_for_disconnect(request.receive))
+    try:
+        while True:
+            next_frame = asyncio.ensure_future(iterator.__anext__())
+            done, _ = await asyncio.wait({next_frame, watcher}, return_when=asyncio.FIRST_COMPLETED)
+            if next_frame not in done:
+                # Cancelling the read runs the generator's cancellation cleanup
+                next_frame.cancel()
+                await asyncio.gather(next_frame, return_exceptions=True)
+                return
+            try:
+                frame = next_frame.result()
+            except StopAsyncIteration:
+                return
+            yield frame
+    finally:
+        watcher.cancel()
+        await asyncio.gather(watcher, return_exceptions=True)
+        if hasattr(iterator, "aclose"):
+            await iterator.aclose()
+
+
+async def run_until_disconnected(request, awaitable: Awaitable[Any], deadline: Optional[Deadline] = None) -> Any:
+    """
+    Await `awaitable`, cancelling it if the client disconnects
+    (ClientDisconnected) or the deadline passes (DeadlineExceeded).
+    """
+    task = asyncio.ensure_future(awaitable)
+    watcher = asyncio.ensure_future(wait_for_disconnect(request.receive))
+    try:
+        done, _ = await asyncio.wait(
+            {task, watcher},
+            timeout=deadline.remaining() if deadline is not None else None,
+            return_when=asyncio.FIRST_COMPLETED,
+        )
+        if task in done:
+            return task.result()
+        if watcher in done:
+            raise ClientDisconnected("Client disconnected")
+        raise DeadlineExceeded("Deadline exceeded")
+    finally:
+        for future in (task, watcher):
+            if not future.done():
+                future.cancel()
+        await asyncio.gather(task, watcher, return_exceptions=True)
+
+
+cancellations_total = registry.register(Counter(
+    "modellab_cancellations_total", "Chat requests abandoned before the answer finished", ("model", "reason")))
+wasted_tokens_total = registry.register(Counter(
+    "modellab_wasted_tokens_total", "Estimated tokens spent on abandoned answers", ("model",)))
+wasted_cost_usd_total = registry.register(Counter(
+    "modellab_wasted_cost_usd_total", "Estimated cost of abandoned answers in USD", ("model",)))
+
+
+class CancellationStats:
+    """Counts abandoned requests and what they cost"""
+
+    def __init__(self) -> None:
+        self.client_disconnects = 0
+        self.deadlines_exceeded = 0
+        self.wasted_tokens = 0
+        self.wasted_cost_usd = 0.0
+
+    def record(self, model: str, reason: str, usage: Optional[Dict[str, Any]]) -> None:
+        if reason == "deadline_exceeded":
+            self.deadlines_exceeded += 1
+        else:
+            self.client_disconnects += 1
+        model = model_catalog.table.label(model)
+        cancellations_total.inc(model, reason)
+        # A coalesced request leaving wastes nothing, its leader pays for the call
+        if usage and not usage.get("coalesced"):
+            tokens = usage.get("total_tokens", 0)
+            cost = usage.get("cost", {}).get("total_cost_usd", 0.0)
+            self.wasted_tokens += tokens
+            self.wasted_cost_usd += cost
+            wasted_tokens_total.inc(model, amount=tokens)
+            wasted_cost_usd_total.inc(model, amount=cost)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "client_disconnects": self.client_disconnects,
+            "deadlines_exceeded": self.deadlines_exceeded,
+            "wasted_tokens": self.wasted_tokens,
+            "wasted_cost_usd": round(self.wasted_cost_usd, 6),
+        }
+
+
+cancellation_stats = CancellationStats()
@@ -1,145 +1,80 @@
-from fastapi import FastAPI, HTTPException
-from fastapi.responses import StreamingResponse
+from fastapi import FastAPI, HTTPException, Request, Response, WebSocket
+from fastapi.encoders import jsonable_encoder
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from typing import List, Optional, Dict, Any
+from starlette.background import BackgroundTask
+from typing import List, Optional, Dict, Any, Tuple
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+import asyncio
+import hashlib
+import httpx
 import os
+import time
 import openai
-import requests
 import json
 from dotenv import load_dotenv
 
+from .schemas import ChatMessage, ChatRequest, ChatResponse, CompareRequest
+from .admission import PRIORITY_BATCH, PRIORITY_INTERACTIVE, PRIORITY_STANDARD, Overloaded, Ticket, admission
+from .batch import iter_lines, parse_rate_limits, run_batch, spool_body
+from .cache import cache_policy, make_cache_key, response_cache
+from .catalog import model_catalog
+from .codec import chat_codec, encode_response
+from .conversations import Conversation, ConversationTurn, conversation_store
+from .ledger import GRANULARITIES, usage_ledger
+from .lifecycle import (
+    ClientDisconnected, Deadline, DeadlineExceeded, cancel_on_disconnect, cancellation_stats, current_deadline,
+    parse_deadline, run_until_disconnected, server_watches_disconnects, with_deadline
+)
+from .metrics import Gauge, RequestTimer, current_timer, registry
+from .multiplex import chat_sockets
+from .pricing import calculate_cost
+from .profiler import profiler
+from .prompt_cache import CacheHint, cache_token_counts, cached_message, prompt_cache
+from .resume import STREAM_ID_PATTERN, BufferedStream, parse_last_event_id, resumable_streams
+from .routing import Attempt, HedgedStream, hedged_call, latency_tracker
+from .singleflight import single_flight
+from .sse import coalesce_content, content_frame
+from .tokens import CONTEXT_STRATEGIES, ContextOverflow, fit_messages, token_estimator
+from .upstream import OPENROUTER_BASE_URL, UpstreamError, upstream
 
-def calculate_cost(model: str, prompt_tokens: int, completion_tokens: int) -> Dict[str, Any]:
-    """
-    Calculate the cost of an API call based on token usage.
-    Rates are as of 2025 and subject to change. Check OpenAI's pricing page for updates.
-    
-    Returns a dictionary with cost information.
-    """
-    # Load pricing from environment variables if available, otherwise use defaults
-    # Format for env vars: OPENAI_PRICE_GPT4O_INPUT=0.005
-    
-    # Cost per 1000 tokens in USD (OpenRouter pricing)
-    default_pricing = {
-        # OpenAI GPT-5 Series
-        "openai/gpt-5.1": {"input": 0.00125, "output": 0.01},
-        "openai/gpt-5.1-chat": {"input": 0.00125, "output": 0.01},
-        "openai/gpt-5.1-codex": {"input": 0.00125, "output": 0.01},
-        "openai/gpt-5.1-codex-mini": {"input": 0.00025, "output": 0.002},
-        "openai/gpt-5-codex": {"input": 0.00125, "output": 0.01},
-        "openai/gpt-5-chat": {"input": 0.00125, "output": 0.01},
-        "openai/gpt-5": {"input": 0.00125, "output": 0.01},
-        "openai/gpt-5-mini": {"input": 0.00025, "output": 0.002},
-        "openai/gpt-5-nano": {"input": 0.00005, "output": 0.0004},
-        
-        # OpenAI GPT OSS Series
-        "openai/gpt-oss-120b": {"input": 0.00004, "output": 0.0004},
-        "openai/gpt-oss-20b:free": {"input": 0, "output": 0},
-        "openai/gpt-oss-20b": {"input": 0.00003, "output": 0.00014},
-        
-        # OpenAI o-Series (Reasoning Models)
-        "openai/o4-mini-deep-research": {"input": 0.002, "output": 0.008},
-        "openai/o3": {"input": 0.002, "output": 0.008},
-        "openai/o4-mini": {"input": 0.0011, "output": 0.0044},
-        "openai/o3-mini-high": {"input": 0.0011, "output": 0.0044},
-        "openai/o3-mini": {"input": 0.0011, "output": 0.0044},
-        "openai/o1": {"input": 0.015, "output": 0.06},
-
-        # OpenAI GPT-4.1 Series
-        "openai/gpt-4.1": {"input": 0.002, "output": 0.008},
-        "openai/gpt-4.1-mini": {"input": 0.0004, "output": 0.0016},
-        "openai/gpt-4.1-nano": {"input": 0.0001, "output": 0.0004},
-        
-        # OpenAI GPT-4o Series
-        "openai/gpt-4o-mini": {"input": 0.00015, "output": 0.0006},
-        "openai/gpt-4o": {"input": 0.0025, "output": 0.01},
-        
-        # OpenAI GPT-4 Series
-        "openai/gpt-4": {"input": 0.03, "output": 0.06},
-        
-        # Anthropic Models
-        "anthropic/claude-sonnet-4.5": {"input": 0.003, "output": 0.015},
-        "anthropic/claude-sonnet-4": {"input": 0.003, "output": 0.015},
-        "anthropic/claude-haiku-4.5": {"input": 0.001, "output": 0.005},
-        "anthropic/claude-3.7-sonnet": {"input": 0.003, "output": 0.015},
-        "anthropic/claude-3.5-haiku": {"input": 0.0008, "output": 0.004},
-        "anthropic/claude-opus-4.1": {"input": 0.015, "output": 0.075},
-        "anthropic/claude-3.5-sonnet": {"input": 0.003, "output": 0.015},
-        "anthropic/claude-3.7-sonnet:thinking": {"input": 0.003, "output": 0.015},
-        "anthropic/claude-opus-4": {"input": 0.015, "output": 0.075},
-        "anthropic/claude-3-opus": {"input": 0.015, "output": 0.075},
-        "anthropic/claude-3-haiku": {"input": 0.0025, "output": 0.0125},
-        
-        # DeepSeek Models
-        "deepseek/deepseek-chat-v3-0324": {"input": 0.00024, "output": 0.00084},
-        "deepseek/deepseek-chat-v3.1": {"input": 0.0002, "output": 0.0008},
-        "tngtech/deepseek-r1t2-chimera:free": {"input": 0, "output": 0},
-        "deepseek/deepseek-v3.2-exp": {"input": 0.00027, "output": 0.0004},
-        "deepseek/deepseek-v3.1-terminus": {"input": 0.00023, "output": 0.0009},
-        "deepseek/deepseek-r1-0528": {"input": 0.0002, "output": 0.0045},
-        "tngtech/deepseek-r1t-chimera:free": {"input": 0, "output": 0},
-        "deepseek/deepseek-chat": {"input": 0.0003, "output": 0.0012},
-        "deepseek/deepseek-chat-v3-0324:free": {"input": 0, "output": 0},
-        "tngtech/deepseek-r1t2-chimera": {"input": 0.0003, "output": 0.0012},
-        "deepseek/deepseek-r1-0528:free": {"input": 0, "output": 0},
-        "deepseek/deepseek-r1": {"input": 0.0003, "output": 0.0012},
-        "deepseek/deepseek-r1:free": {"input": 0, "output": 0},
-
-    }
-    
-    # Strip provider prefix if present (e.g., "openai/gpt-4o" -> "gpt-4o") for env var lookups
-    model_base = model.split("/")[-1] if "/" in model else model
-    
-    # Initialize model_pricing with defaults
-    model_pricing = default_pricing.copy()
-    
-    # Try to get pricing from environment variables
-    for model_key in default_pricing:
-        # Extract base model name without provider prefix for env var lookups
-        base_model_key = model_key.split("/")[-1] if "/" in model_key else model_key
-        normalized_model = base_model_key.replace("-", "").replace(".", "").upper()
-        input_env_key = f"MODEL_PRICE_{normalized_model}_INPUT"
-        output_env_key = f"MODEL_PRICE_{normalized_model}_OUTPUT"
-        
-        input_price_str = os.getenv(input_env_key)
-        output_price_str = os.getenv(output_env_key)
-        
-        if input_price_str:
-            try:
-                model_pricing[model_key]["input"] = float(input_price_str)
-            except ValueError:
-                print(f"Warning: Invalid price format for {input_env_key}: {input_price_str}")
-                
-        if output_price_str:
-            try:
-                model_pricing[model_key]["output"] = float(output_price_str)
-            except ValueError:
-                print(f"Warning: Invalid price format for {output_env_key}: {output_price_str}")
-    
-    # Default to openai/gpt-3.5-turbo pricing if model not found
-    default_model = "openai/gpt-3.5-turbo"
-    pricing = model_pricing.get(model, model_pricing.get(default_model, {"input": 0.0005, "output": 0.0015}))
-    
-    input_cost = (prompt_tokens / 1000) * pricing["input"]
-    output_cost = (completion_tokens / 1000) * pricing["output"]
-    total_cost = input_cost + output_cost
-    
-    return {
-        "input_cost_usd": round(input_cost, 6),
-        "output_cost_usd": round(output_cost, 6),
-        "total_cost_usd": round(total_cost, 6),
-        "pricing_rate": pricing
-    }
 
 # Load environment variables
 load_dotenv()
 
 # Set up OpenRouter API key (fallback to OpenAI key for backward compatibility)
 openai.api_key = os.getenv("OPENROUTER_API_KEY") or os.getenv("OPENAI_API_KEY")
-openai.base_url = "https://openrouter.ai/api/v1"
+openai.base_url = os.getenv("OPENROUTER_BASE_URL", OPENROUTER_BASE_URL)
+
+async def startup():
+    """Start the shared services, for the app's lifespan and the batch CLI"""
+    # Shared upstream connection pool and model catalog for the lifetime of the worker
+    await upstream.start()
+    await model_catalog.start()
+    await token_estimator.start()
+    await response_cache.start()
+    await admission.start()
+    await usage_ledger.start()
+
+async def shutdown():
+    """Close what startup() started"""
+    # Cancelled streams still reach the ledger before it flushes
+    await chat_sockets.close()
+    await resumable_streams.close()
+    await usage_ledger.close()
+    await response_cache.close()
+    await model_catalog.close()
+    await upstream.close()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await startup()
+    yield
+    await shutdown()
 
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 # Add CORS middleware
 app.add_middleware(
@@ -150,19 +85,6 @@ app.add_middleware(
     allow_headers=["*"],  # Allows all headers
 )
 
-class ChatMessage(BaseModel):
-    role: str
-    content: str
-
-class ChatRequest(BaseModel):
-    messages: List[ChatMessage]
-    model: Optional[str] = "openai/gpt-4o-mini"
-    stream: Optional[bool] = False
-
-class ChatResponse(BaseModel):
-    role: str
-    content: str
-
 @app.get("/")
 async def root():
     return {"message": "Welcome to the Model Lab API"}
@@ -170,236 +92,638 @@ async def root():
 @app.get("/api/pricing")
 async def get_pricing():
     """Return the current pricing information for all models"""
-    # Re-use the logic from calculate_cost to get current pricing
-    default_pricing = {
-        # OpenAI GPT-5 Series
-        "openai/gpt-5.1": {"input": 0.00125, "output": 0.01},
-        "openai/gpt-5.1-chat": {"input": 0.00125, "output": 0.01},
-        "openai/gpt-5.1-codex": {"input": 0.00125, "output": 0.01},
-        "openai/gpt-5.1-codex-mini": {"input": 0.00025, "output": 0.002},
-        "openai/gpt-5-codex": {"input": 0.00125, "output": 0.01},
-        "openai/gpt-5-chat": {"input": 0.00125, "output": 0.01},
-        "openai/gpt-5": {"input": 0.00125, "output": 0.01},
-        "openai/gpt-5-mini": {"input": 0.00025, "output": 0.002},
-        "openai/gpt-5-nano": {"input": 0.00005, "output": 0.0004},
-        
-        # OpenAI GPT OSS Series
-        "openai/gpt-oss-120b": {"input": 0.00004, "output": 0.0004},
-        "openai/gpt-oss-20b:free": {"input": 0, "output": 0},
-        "openai/gpt-oss-20b": {"input": 0.00003, "output": 0.00014},
-        
-        # OpenAI o-Series (Reasoning Models)
-        "openai/o4-mini-deep-research": {"input": 0.002, "output": 0.008},
-        "openai/o3": {"input": 0.002, "output": 0.008},
-        "openai/o4-mini": {"input": 0.0011, "output": 0.0044},
-        "openai/o3-mini-high": {"input": 0.0011, "output": 0.0044},
-        "openai/o3-mini": {"input": 0.0011, "output": 0.0044},
-        "openai/o1": {"input": 0.015, "output": 0.06},
-
-        # OpenAI GPT-4.1 Series
-        "openai/gpt-4.1": {"input": 0.002, "output": 0.008},
-        "openai/gpt-4.1-mini": {"input": 0.0004, "output": 0.0016},
-        "openai/gpt-4.1-nano": {"input": 0.0001, "output": 0.0004},
-        
-        # OpenAI GPT-4o Series
-        "openai/gpt-4o-mini": {"input": 0.00015, "output": 0.0006},
-        "openai/gpt-4o": {"input": 0.0025, "output": 0.01},
-        
-        # OpenAI GPT-4 Series
-        "openai/gpt-4": {"input": 0.03, "output": 0.06},
- 
-        # Anthropic Models
-        "anthropic/claude-sonnet-4.5": {"input": 0.003, "output": 0.015},
-        "anthropic/claude-sonnet-4": {"input": 0.003, "output": 0.015},
-        "anthropic/claude-haiku-4.5": {"input": 0.001, "output": 0.005},
-        "anthropic/claude-3.7-sonnet": {"input": 0.003, "output": 0.015},
-        "anthropic/claude-3.5-haiku": {"input": 0.0008, "output": 0.004},
-        "anthropic/claude-opus-4.1": {"input": 0.015, "output": 0.075},
-        "anthropic/claude-3.5-sonnet": {"input": 0.003, "output": 0.015},
-        "anthropic/claude-3.7-sonnet:thinking": {"input": 0.003, "output": 0.015},
-        "anthropic/claude-opus-4": {"input": 0.015, "output": 0.075},
-        "anthropic/claude-3-opus": {"input": 0.015, "output": 0.075},
-        "anthropic/claude-3-haiku": {"input": 0.0025, "output": 0.0125},
-        
-        # DeepSeek Models
-        "deepseek/deepseek-chat-v3-0324": {"input": 0.00024, "output": 0.00084},
-        "deepseek/deepseek-chat-v3.1": {"input": 0.0002, "output": 0.0008},
-        "tngtech/deepseek-r1t2-chimera:free": {"input": 0, "output": 0},
-        "deepseek/deepseek-v3.2-exp": {"input": 0.00027, "output": 0.0004},
-        "deepseek/deepseek-v3.1-terminus": {"input": 0.00023, "output": 0.0009},
-        "deepseek/deepseek-r1-0528": {"input": 0.0002, "output": 0.0045},
-        "tngtech/deepseek-r1t-chimera:free": {"input": 0, "output": 0},
-        "deepseek/deepseek-chat": {"input": 0.0003, "output": 0.0012},
-        "deepseek/deepseek-chat-v3-0324:free": {"input": 0, "output": 0},
-        "tngtech/deepseek-r1t2-chimera": {"input": 0.0003, "output": 0.0012},
-        "deepseek/deepseek-r1-0528:free": {"input": 0, "output": 0},
-        "deepseek/deepseek-r1": {"input": 0.0003, "output": 0.0012},
-        "deepseek/deepseek-r1:free": {"input": 0, "output": 0},
-        # Legacy DeepSeek models
-        "deepseek-ai/deepseek-chat": {"input": 0.0025, "output": 0.0075},
-        "deepseek-ai/deepseek-coder": {"input": 0.0015, "output": 0.005}
-    }
-    
-    # Initialize model_pricing with defaults
-    model_pricing = default_pricing.copy()
-    
-    # Try to get pricing from environment variables
-    for model_key in default_pricing:
-        # Extract base model name without provider prefix for env var lookups
-        base_model_key = model_key.split("/")[-1] if "/" in model_key else model_key
-        normalized_model = base_model_key.replace("-", "").replace(".", "").upper()
-        input_env_key = f"MODEL_PRICE_{normalized_model}_INPUT"
-        output_env_key = f"MODEL_PRICE_{normalized_model}_OUTPUT"
-        
-        input_price_str = os.getenv(input_env_key)
-        output_price_str = os.getenv(output_env_key)
-        
-        if input_price_str:
-            try:
-                model_pricing[model_key]["input"] = float(input_price_str)
-            except ValueError:
-                pass
-                
-        if output_price_str:
-            try:
-                model_pricing[model_key]["output"] = float(output_price_str)
-            except ValueError:
-                pass
+    model_pricing = model_catalog.table.rates
     
     return {
         "pricing": model_pricing,
         "note": "Costs are in USD per 1000 tokens",
-        "source": "These rates are based on default values or environment variables. Check OpenRouter's pricing page for the most up-to-date rates: https://openrouter.ai/pricing"
+        "source": "These rates are based on the model catalog, the OpenRouter snapshot, the pricing file or environment variables. Check OpenRouter's pricing page for the most up-to-date rates: https://openrouter.ai/pricing"
     }
 
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [candidate.strip() for candidate in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates or f"W/{etag}" in candidates
+
+@app.get("/api/models")
+async def get_models(raw_request: Request):
+    """Return the model catalog (aliases, rates, context windows), answering 304 when the ETag still matches"""
+    table = model_catalog.table
+    headers = {"ETag": table.etag, "Cache-Control": "no-cache"}
+    if etag_matches(raw_request.headers.get("if-none-match"), table.etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=table.body, media_type="application/json", headers=headers)
+
+@app.get("/api/cache/stats")
+async def get_cache_stats():
+    """Return hit/miss counters for the response cache"""
+    return response_cache.stats()
+
+@app.get("/api/conversations/stats")
+async def get_conversation_stats():
+    """Return the size of the server-side conversation store"""
+    return conversation_store.stats()
+
+@app.delete("/api/conversations/{conversation_id}")
+async def delete_conversation(conversation_id: str):
+    """Drop a server-side conversation history"""
+    if not conversation_store.discard(conversation_id):
+        raise HTTPException(status_code=404, detail="Conversation not found")
+    return {"deleted": conversation_id}
+
+@app.get("/api/admission/stats")
+async def get_admission_stats():
+    """Return in-flight counts, queue depth and wait times of the admission controller"""
+    return admission.stats()
+
+@app.get("/api/usage")
+async def get_usage(granularity: str = "hour", since: Optional[str] = None, until: Optional[str] = None, model: Optional[str] = None):
+    """
+    Requests, tokens, cost and latency per model and hour or day, read from
+    the ledger's rollups. `since`/`until` are ISO 8601 times or Unix seconds
+    and default to the last day (hourly) or the last 30 days (daily).
+    """
+    if not usage_ledger.enabled:
+        raise HTTPException(status_code=404, detail="Usage ledger is disabled")
+    if granularity not in GRANULARITIES:
+        raise HTTPException(status_code=400, detail=f"granularity must be one of: {', '.join(GRANULARITIES)}")
+    try:
+        until_ts = parse_timestamp(until) if until else time.time()
+        since_ts = parse_timestamp(since) if since else until_ts - (86400 if granularity == "hour" else 30 * 86400)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid time: {str(e)}")
+    return await usage_ledger.report(
+        granularity, since_ts, until_ts, normalize_model_name(model) if model else None
+    )
+
+@app.get("/api/usage/stats")
+async def get_usage_stats():
+    """Return queue and write counters of the usage ledger"""
+    return usage_ledger.stats()
+
+@app.get("/api/cancellations/stats")
+async def get_cancellation_stats():
+    """Return how many chats were abandoned and the estimated tokens and cost spent on them"""
+    return cancellation_stats.stats()
+
+@app.get("/api/routing/stats")
+async def get_routing_stats():
+    """Return rolling per-model latency and the hedging deadline each model currently gets"""
+    return latency_tracker.stats()
+
+@app.get("/api/streams/stats")
+async def get_stream_stats():
+    """Return how many streams are buffered for resumption and how often clients resumed them"""
+    return resumable_streams.stats()
+
+@app.get("/api/sockets/stats")
+async def get_socket_stats():
+    """Return open /ws/chat connections, their streams and how many were cancelled or rejected"""
+    return chat_sockets.stats()
+
+@app.get("/api/prompt-cache/stats")
+async def get_prompt_cache_stats():
+    """Return how many requests got prompt cache breakpoints and the cached share of their prompt tokens"""
+    return prompt_cache.stats()
+
+@app.get("/api/tokens/stats")
+async def get_token_stats():
+    """Return which tokenizers are loaded and how often per-message counts were memoised"""
+    return token_estimator.stats()
+
+@app.get("/api/codec/stats")
+async def get_codec_stats():
+    """Return whether the fast codec is on and how many requests took the fast path"""
+    return chat_codec.stats()
+
+@app.get("/api/singleflight/stats")
+async def get_single_flight_stats():
+    """Return how many requests were coalesced onto in-flight upstream calls"""
+    return single_flight.stats()
+
+registry.register(Gauge(
+    "modellab_admission_in_flight", "Upstream calls currently admitted",
+    lambda: {(): admission.stats()["in_flight"]}))
+registry.register(Gauge(
+    "modellab_admission_queue_depth", "Requests waiting for an upstream slot",
+    lambda: {(): admission.stats()["queue_depth"]}))
+
+@app.get("/metrics")
+async def get_metrics():
+    """Latency, throughput and cost histograms in the Prometheus text format"""
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
+def require_profiler():
+    if not profiler.enabled:
+        raise HTTPException(status_code=404, detail="Profiler is disabled, set PROFILER_ENABLED to use it")
+
+@app.get("/api/profiler")
+async def get_profiler():
+    """Return the state of the sampling profiler and its hottest frames"""
+    require_profiler()
+    return profiler.status()
+
+@app.post("/api/profiler/start")
+async def start_profiler(interval_ms: float = 5.0, duration_s: Optional[float] = None):
+    """Start sampling the event loop every `interval_ms` for up to `duration_s` seconds"""
+    require_profiler()
+    # Runs on the event loop thread, which is the thread that gets sampled
+    profiler.start(interval_ms / 1000, duration_s)
+    return profiler.status()
+
+@app.post("/api/profiler/stop")
+async def stop_profiler():
+    """Stop sampling and return the collapsed stacks, ready for flamegraph.pl or speedscope"""
+    require_profiler()
+    await asyncio.to_thread(profiler.stop)
+    return PlainTextResponse(profiler.collapsed())
+
+def parse_timestamp(value: str) -> float:
+    """Unix seconds or an ISO 8601 time (UTC unless it has an offset)"""
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
 def normalize_model_name(model: str) -> str:
-    """Normalize model name to OpenRouter format"""
-    model_lower = model.lower()
-    
-    # Anthropic models
-    if model_lower in ["claude-3.5-sonnet", "claude-3-5-sonnet", "claude-3.5", "claude3.5", "claude3.5-sonnet"]:
-        return "anthropic/claude-3.5-sonnet"
-    elif model_lower in ["claude-3-opus", "claude3-opus", "claude3opus", "claude-opus"]:
-        return "anthropic/claude-3-opus"
-    elif model_lower in ["claude-3-sonnet", "claude3-sonnet", "claude3sonnet", "claude-sonnet"]:
-        return "anthropic/claude-3-sonnet"
-    elif model_lower in ["claude-3-haiku", "claude3-haiku", "claude3haiku", "claude-haiku"]:
-        return "anthropic/claude-3-haiku"
-    
-    # DeepSeek models
-    elif model_lower in ["deepseek", "deepseek-chat", "deepseek-llm"]:
-        return "deepseek/deepseek-v3.2-exp"
-    elif model_lower in ["deepseek-coder", "deepseekcoder"]:
-        return "deepseek/deepseek-chat-v3.1:free"
-    
-    # OpenAI models
-    elif model_lower in ["gpt4o", "4o"]:
-        return "openai/gpt-4o"
-    elif model_lower in ["gpt4o-mini", "4o-mini"]:
-        return "openai/gpt-4o-mini"
-    elif model_lower in ["gpt-4-vision", "gpt4vision"]:
-        return "openai/gpt-4-vision-preview"
-    
-    # Default case - if no special mapping and no provider prefix
-    elif not ('/' in model):
-        return f"openai/{model}"
-    
-    return model
+    """Normalize model name to OpenRouter format, resolving aliases from the model catalog"""
+    return model_catalog.table.normalize(model)
+
+def finish_request(timer: RequestTimer, status: str, usage: Optional[Dict[str, Any]] = None) -> None:
+    """Record a finished request in the metrics and the usage ledger, once"""
+    if timer.finished is not None:
+        return
+    if status == "ok" and timer.coalesced:
+        status = "coalesced"
+    timer.finish(status, usage)
+    usage_ledger.record(timer.model, status, timer.stream, usage, timer.finished * 1000)
+
+def overloaded_response(e: Overloaded) -> JSONResponse:
+    """Real 429/503 with Retry-After for a request that was shed"""
+    return JSONResponse(
+        status_code=e.status_code,
+        content={"error": e.reason, "retry_after": e.retry_after},
+        headers={"Retry-After": str(e.retry_after)}
+    )
+
+def upstream_throttled(e: UpstreamError) -> Overloaded:
+    """Pass an upstream 429 on to the client, honouring its Retry-After when usable"""
+    try:
+        retry_after = max(int(float(e.retry_after)), 1)
+    except (TypeError, ValueError):
+        retry_after = admission.retry_after()
+    return Overloaded(429, "Upstream rate limited", retry_after)
+
+def build_usage(model: str, usage_data: Dict[str, Any], cache_hint: Optional[CacheHint] = None) -> Dict[str, Any]:
+    """
+    Build the usage block sent to the frontend, including cost. Prompt
+    caching shows up as a `prompt_cache` block when upstream reported cached
+    tokens or the request carried cache breakpoints (`cache_hint`). A request
+    that shared another's upstream call is marked `coalesced`.
+    """
+    prompt_tokens = usage_data.get("prompt_tokens", 0)
+    completion_tokens = usage_data.get("completion_tokens", 0)
+    cached_tokens, cache_write_tokens = cache_token_counts(usage_data)
+    usage = {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": usage_data.get("total_tokens", 0),
+        "model": model,
+        "cost": calculate_cost(model, prompt_tokens, completion_tokens, cached_tokens, cache_write_tokens)
+    }
+    timer = current_timer.get()
+    coalesced = timer is not None and timer.coalesced
+    # The request that made the call already counted its cache use
+    if cache_hint is not None and not coalesced:
+        prompt_cache.record(prompt_tokens, cached_tokens, cache_write_tokens)
+    if cached_tokens or cache_write_tokens or cache_hint is not None:
+        usage["prompt_cache"] = {
+            "cached_tokens": cached_tokens,
+            "cache_write_tokens": cache_write_tokens,
+            "hit_rate": round(cached_tokens / prompt_tokens, 4) if prompt_tokens else 0.0,
+            "breakpoints": len(cache_hint.breakpoints) if cache_hint is not None else 0
+        }
+    if coalesced:
+        usage["coalesced"] = True
+    return usage
+
+def partial_usage(model: str, payload, content: str, usage_data: Dict[str, Any]) -> Dict[str, Any]:
+    """Usage and cost of an answer that was cut short, estimated unless upstream already reported it"""
+    if usage_data:
+        usage = build_usage(model, usage_data)
+    else:
+        model_id = normalize_model_name(model)
+        prompt_tokens = token_estimator.count_payload(payload, model_id) if payload is not None else 0
+        completion_tokens = token_estimator.count_text(content, model_id)
+        usage = build_usage(model, {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens
+        })
+        usage["estimated"] = True
+    usage["partial"] = True
+    return usage
+
+def context_strategy(request: ChatRequest) -> str:
+    strategy = request.context_overflow or os.getenv("CONTEXT_OVERFLOW", "reject")
+    if strategy not in CONTEXT_STRATEGIES:
+        print(f"Warning: Invalid CONTEXT_OVERFLOW: {strategy}")
+        return "reject"
+    return strategy
+
+def fit_context(request: ChatRequest, conversation: Optional[Conversation] = None, strategy: Optional[str] = None):
+    """
+    Check the request against its model's context window (less
+    CONTEXT_RESERVE_TOKENS for the answer) before anything is sent upstream.
+    Returns (messages to send, estimated prompt tokens, context length,
+    messages dropped); raises ContextOverflow. Models without a known
+    context length are not checked.
+    """
+    model = normalize_model_name(request.model)
+    context_length = model_catalog.table.context_length(model)
+    history_tokens = conversation.tokens if conversation is not None else 0
+    if context_length is None:
+        return request.messages, history_tokens + token_estimator.count_messages(request.messages, model), None, 0
+    # A server-side history can't be trimmed from here, only rejected
+    strategy = "reject" if conversation is not None and conversation.tokens else (strategy or context_strategy(request))
+    limit = context_length - int(os.getenv("CONTEXT_RESERVE_TOKENS", "0"))
+    messages, prompt_tokens, dropped = fit_messages(list(request.messages), model, limit, strategy, history_tokens)
+    return messages, prompt_tokens, context_length, dropped
+
+def context_exceeded(e: ContextOverflow) -> HTTPException:
+    return HTTPException(
+        status_code=413,
+        detail={
+            "error": "context_length_exceeded",
+            "model": e.model,
+            "estimated_prompt_tokens": e.prompt_tokens,
+            "context_length": e.context_length,
+            "message": f"{str(e)}. Shorten the conversation, start a new one, or set context_overflow to drop_oldest or keep_system"
+        }
+    )
+
+def resolve_conversation(request: ChatRequest) -> Tuple[Optional[Conversation], Optional[ConversationTurn]]:
+    """
+    The server-side history of a conversation-mode request and the turn
+    that holds it until released. Raises 409 if the conversation expired or
+    another turn of it is still running.
+    """
+    if not request.conversation_id:
+        return None, None
+    turn = conversation_store.begin_turn(request.conversation_id)
+    if turn is None:
+        raise HTTPException(
+            status_code=409,
+            detail={
+                "error": "conversation_busy",
+                "conversation_id": request.conversation_id,
+                "message": "Another turn of this conversation is still running, send this one once it has finished"
+            }
+        )
+    if request.conversation_reset:
+        # Installed in the store once the turn succeeds
+        return Conversation(request.conversation_id), turn
+    conversation = conversation_store.get(request.conversation_id)
+    if conversation is None:
+        turn.release()
+        raise HTTPException(
+            status_code=409,
+            detail={
+                "error": "conversation_not_found",
+                "conversation_id": request.conversation_id,
+                "message": "Unknown or expired conversation, resend the full history with conversation_reset set to true"
+            }
+        )
+    return conversation, turn
+
+def release_stream(ticket: Optional[Ticket], turn: Optional[ConversationTurn]) -> None:
+    """Free a stream's upstream slot and conversation, also if its generator never ran"""
+    if ticket is not None:
+        ticket.release()
+    if turn is not None:
+        turn.release()
+
+def apply_context_limit(request: ChatRequest, conversation: Optional[Conversation], timer: RequestTimer) -> int:
+    """
+    Reject or trim prompts that can't fit the context window before paying
+    for a round trip. Returns how many messages were dropped; raises 413.
+    """
+    if not request.messages:
+        return 0
+    try:
+        request.messages, _, _, trimmed = fit_context(request, conversation)
+    except ContextOverflow as e:
+        finish_request(timer, "context_exceeded")
+        raise context_exceeded(e)
+    return trimmed
+
+async def lookup_cache(request: ChatRequest, conversation: Optional[Conversation], headers):
+    """
+    Look up repeated prompts in the response cache (opt-in). Returns
+    (key to store the answer under, cached answer, X-Cache status).
+    Conversation turns only carry their new messages, so they are not cached.
+    """
+    cache_key = None
+    cached = None
+    cache_status = None
+    if response_cache.enabled and request.messages and conversation is None:
+        read, write = cache_policy(headers)
+        if read or write:
+            cache_key = make_cache_key(normalize_model_name(request.model), message_dicts(request.messages))
+        if read:
+            cached = await response_cache.get(cache_key)
+            cache_status = "HIT" if cached is not None else "MISS"
+        else:
+            response_cache.bypasses += 1
+            cache_status = "BYPASS"
+        if not write:
+            cache_key = None
+    return cache_key, cached, cache_status
+
+def stream_key(body: bytes) -> str:
+    """Fingerprint of a chat request body, so a stream id only resumes the request it was made for"""
+    return hashlib.sha256(body).hexdigest()
+
+def resume_unavailable(stream_id: str) -> HTTPException:
+    return HTTPException(
+        status_code=410,
+        detail={
+            "error": "resume_unavailable",
+            "stream_id": stream_id,
+            "message": "The stream expired or the requested events are no longer buffered, send the request again without X-Stream-Id"
+        }
+    )
+
+def resume_stream_response(raw_request: Request, stream: BufferedStream, last_event_id: Optional[str]) -> StreamingResponse:
+    """Replay a buffered stream from after `Last-Event-ID` (or the start) and follow it live"""
+    after = -1
+    if last_event_id:
+        try:
+            event_stream_id, after = parse_last_event_id(last_event_id)
+        except ValueError:
+            raise HTTPException(status_code=400, detail=f"Invalid Last-Event-ID: {last_event_id}")
+        if event_stream_id is not None and event_stream_id != stream.id:
+            raise HTTPException(status_code=400, detail="Last-Event-ID belongs to a different stream")
+    if not stream.available(after):
+        resumable_streams.unavailable += 1
+        raise resume_unavailable(stream.id)
+    frames = resumable_streams.resume(stream, after)
+    if not server_watches_disconnects(raw_request.scope):
+        frames = cancel_on_disconnect(raw_request, frames)
+    return StreamingResponse(
+        frames,
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "Connection": "keep-alive",
+            "X-Accel-Buffering": "no",
+            "X-Stream-Id": stream.id
+        }
+    )
+
+async def replay_cached_stream(request: ChatRequest, cached: Dict[str, Any]):
+    """Replay a cached completion as SSE in the same frame format as a live stream"""
+    if cached["content"]:
+        yield f"data: {json.dumps({'type': 'content', 'content': cached['content']})}\n\n"
+    usage = build_usage(request.model, cached["usage"])
+    usage["cached"] = True
+    yield f"data: {json.dumps({'type': 'usage', 'usage': usage})}\n\n"
+    yield f"data: [DONE]\n\n"
+
+def message_dicts(messages: List[Any]) -> List[Dict[str, str]]:
+    """Messages in the format expected by OpenAI"""
+    return [{"role": msg.role, "content": msg.content} for msg in messages]
+
+def build_payload(
+    model: str,
+    messages: List[Any],
+    stream: bool,
+    conversation: Optional[Conversation] = None,
+    cache_hint: Optional[CacheHint] = None
+):
+    """
+    Upstream request body, spliced onto the pre-serialised history in
+    conversation mode and encoded in one pass with FAST_CODEC. Providers
+    that take them get prompt cache breakpoints where `cache_hint` says.
+    """
+    breakpoints = cache_hint.breakpoints if cache_hint is not None and prompt_cache.supports(model) else ()
+    if conversation is None:
+        encoded = chat_codec.payload(model, messages, stream, breakpoints)
+        if encoded is not None:
+            return encoded
+    formatted_messages = message_dicts(messages)
+    for index in breakpoints:
+        formatted_messages[index] = cached_message(formatted_messages[index])
+    if conversation is not None:
+        return conversation.payload(model, formatted_messages, stream)
+    payload = {
+        "model": model,
+        "messages": formatted_messages
+    }
+    if stream:
+        payload["stream"] = True
+    return payload
+
+def plan_upstream(request: ChatRequest, conversation: Optional[Conversation], stream: bool) -> Tuple[str, Optional[CacheHint], Any]:
+    """The normalized model, prompt cache hint and upstream payload of a chat request"""
+    model = normalize_model_name(request.model)
+    # Mark recurring prompt prefixes for the provider's prompt cache
+    cache_hint = prompt_cache.plan(request.messages, model, conversation.tokens if conversation is not None else None)
+    return model, cache_hint, build_payload(model, request.messages, stream, conversation, cache_hint)
+
+def joins_flight(request: ChatRequest, plan: Optional[Tuple[str, Optional[CacheHint], Any]]) -> bool:
+    """
+    Whether the request will share an identical upstream call already in
+    flight. Such requests skip admission, the call they join holds a slot.
+    """
+    return plan is not None and not request.routing and single_flight.in_flight(plan[2])
+
+def routing_candidates(request: ChatRequest) -> List[tuple]:
+    """(name as requested, normalized model) for the primary model and its fallbacks"""
+    candidates = {}
+    for name in [request.model] + list(request.routing.fallbacks if request.routing else []):
+        candidates.setdefault(normalize_model_name(name), name)
+    return [(name, model) for model, name in candidates.items()]
+
+async def hedge_stream(model: str, payload):
+    """
+    Stream a hedged or fallback attempt. Hedges only use spare capacity:
+    if the model has no free slot right now the attempt fails instead of queueing.
+    """
+    ticket = await admission.acquire(model, PRIORITY_INTERACTIVE, timeout=0)
+    upstream_status = None
+    try:
+        async for event in single_flight.stream(payload, upstream.stream_completion, ticket):
+            yield event
+        upstream_status = 200
+    except UpstreamError as e:
+        upstream_status = e.status_code
+        raise
+    finally:
+        ticket.release(upstream_status)
+
+async def hedge_call(model: str, payload):
+    """Non-streaming counterpart of hedge_stream()"""
+    ticket = await admission.acquire(model, PRIORITY_STANDARD, timeout=0)
+    upstream_status = None
+    try:
+        result = await single_flight.call(payload, upstream.fetch_completion, ticket)
+        upstream_status = 200
+        return result
+    except UpstreamError as e:
+        upstream_status = e.status_code
+        raise
+    finally:
+        ticket.release(upstream_status)
+
+async def stream_with_slot(model: str, payload, priority: int):
+    """
+    upstream.stream_completion() for a request that skipped admission to join
+    an identical call, which ended before it could: it takes a slot first
+    """
+    ticket = await admission.acquire(model, priority)
+    upstream_status = None
+    try:
+        async for event in upstream.stream_completion(payload):
+            yield event
+        upstream_status = 200
+    except UpstreamError as e:
+        upstream_status = e.status_code
+        raise
+    finally:
+        ticket.release(upstream_status)
+
+async def fetch_with_slot(model: str, payload, priority: int):
+    """Non-streaming counterpart of stream_with_slot()"""
+    ticket = await admission.acquire(model, priority)
+    upstream_status = None
+    try:
+        result = await upstream.fetch_completion(payload)
+        upstream_status = 200
+        return result
+    except UpstreamError as e:
+        upstream_status = e.status_code
+        raise
+    finally:
+        ticket.release(upstream_status)
 
-async def stream_chat_generator(request: ChatRequest):
-    """Generator function for streaming chat responses"""
+async def stream_chat_generator(request: ChatRequest, cache_key: Optional[str] = None, conversation: Optional[Conversation] = None, ticket: Optional[Ticket] = None, timer: Optional[RequestTimer] = None, deadline: Optional[Deadline] = None, turn: Optional[ConversationTurn] = None, plan: Optional[Tuple[str, Optional[CacheHint], Any]] = None):
+    """
+    Generator function for streaming chat responses. `plan` is the request's
+    plan_upstream() if it was made already. Without a `ticket` the request
+    is joining an identical stream in flight. A request that starts the
+    upstream stream hands its ticket to it, so the slot stays taken while
+    requests that joined are still being served.
+    """
+    upstream_status = None
+    status = "error"
+    usage = None
+    if timer is not None:
+        current_timer.set(timer)
+    if deadline is not None:
+        current_deadline.set(deadline)
+    
+    # Track usage data and the full answer for the response cache
+    payload = None
+    usage_data = {}
+    content_parts = []
+    router = None
     try:
         if not request.messages:
             yield f"data: {json.dumps({'error': 'No messages provided'})}\n\n"
             return
         
-        # Convert messages to the format expected by OpenAI
-        formatted_messages = [{"role": msg.role, "content": msg.content} for msg in request.messages]
-        
-        # Normalize model name
-        model = normalize_model_name(request.model)
-        
-        # Use direct API calls to OpenRouter
-        api_key = os.getenv("OPENROUTER_API_KEY")
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {api_key}",
-            "HTTP-Referer": os.getenv("APP_URL", "https://modellab.com"),
-            "X-Title": os.getenv("APP_TITLE", "Model Lab")
-        }
-        
-        payload = {
-            "model": model,
-            "messages": formatted_messages,
-            "stream": True
-        }
+        model, cache_hint, payload = plan or plan_upstream(request, conversation, True)
+        start = upstream.stream_completion
+        if ticket is None:
+            # Make the call under a slot of its own if that stream ended first
+            start = lambda payload: stream_with_slot(model, payload, PRIORITY_INTERACTIVE)
         
         try:
-            # Make streaming request to OpenRouter
-            api_response = requests.post(
-                "https://openrouter.ai/api/v1/chat/completions",
-                headers=headers,
-                json=payload,
-                stream=True
-            )
+            if request.routing:
+                # Hedge to the fallback models if the primary is slow to start
+                def open_attempt(attempt: Attempt):
+                    if attempt.index == 0:
+                        return single_flight.stream(payload, start, ticket)
+                    return hedge_stream(
+                        attempt.model,
+                        build_payload(attempt.model, request.messages, True, conversation, cache_hint)
+                    )
+                router = HedgedStream(routing_candidates(request), open_attempt, request.routing.ttft_deadline_ms)
+                events = router
+            else:
+                # Stream from OpenRouter over the shared connection pool, joining an
+                # identical in-flight stream if there is one
+                events = single_flight.stream(payload, start, ticket)
+            if deadline is not None:
+                events = with_deadline(events, deadline)
+            if timer is not None:
+                events = timer.watch(events)
+            started = time.perf_counter()
+            first_token = True
+            # Merge token-sized deltas into fewer, larger frames
+            async for event in coalesce_content(events):
+                if event["type"] == "content":
+                    if first_token and router is None:
+                        latency_tracker.record(model, time.perf_counter() - started)
+                    first_token = False
+                    content_parts.append(event["content"])
+                    # Send content chunk, reusing the upstream JSON escaping
+                    yield content_frame(event)
+                elif event["type"] == "usage":
+                    usage_data = event["usage"]
             
-            if api_response.status_code != 200:
-                error_text = api_response.text
-                yield f"data: {json.dumps({'error': f'OpenRouter API returned status code {api_response.status_code}: {error_text}'})}\n\n"
-                return
+            # Report (and price) the model that actually answered
+            answered_by = router.winner.name if router is not None else request.model
             
-            # Track usage data
-            usage_data = {}
+            # Send final usage message if available
+            if usage_data:
+                usage = build_usage(answered_by, usage_data, cache_hint)
+                if router is not None:
+                    usage["routing"] = router.report(request.model)
+                final_usage = {
+                    "type": "usage",
+                    "usage": usage
+                }
+                yield f"data: {json.dumps(final_usage)}\n\n"
+            yield f"data: [DONE]\n\n"
             
-            # Stream the response
-            for line in api_response.iter_lines():
-                if line:
-                    line_text = line.decode('utf-8')
-                    
-                    # Skip non-data lines
-                    if not line_text.startswith('data: '):
-                        continue
-                    
-                    # Extract JSON data
-                    data_str = line_text[6:]  # Remove 'data: ' prefix
-                    
-                    # Check for [DONE] marker
-                    if data_str.strip() == '[DONE]':
-                        # Send final usage message if available
-                        if usage_data:
-                            final_usage = {
-                                "type": "usage",
-                                "usage": {
-                                    "prompt_tokens": usage_data.get("prompt_tokens", 0),
-                                    "completion_tokens": usage_data.get("completion_tokens", 0),
-                                    "total_tokens": usage_data.get("total_tokens", 0),
-                                    "model": request.model,
-                                    "cost": calculate_cost(request.model, usage_data.get("prompt_tokens", 0), usage_data.get("completion_tokens", 0))
-                                }
-                            }
-                            yield f"data: {json.dumps(final_usage)}\n\n"
-                        yield f"data: [DONE]\n\n"
-                        break
-                    
-                    try:
-                        chunk_data = json.loads(data_str)
-                        choices = chunk_data.get("choices", [])
-                        
-                        if choices and len(choices) > 0:
-                            delta = choices[0].get("delta", {})
-                            content_delta = delta.get("content", "")
-                            
-                            if content_delta:
-                                # Send content chunk
-                                yield f"data: {json.dumps({'type': 'content', 'content': content_delta})}\n\n"
-                            
-                            # Check for usage data (usually in final chunk)
-                            if "usage" in chunk_data:
-                                usage_data = chunk_data["usage"]
-                    
-                    except json.JSONDecodeError:
-                        # Skip invalid JSON
-                        continue
+            # A fallback's answer is not the requested model's answer
+            if cache_key is not None and answered_by == request.model:
+                await response_cache.set(cache_key, "".join(content_parts), usage_data)
+            if conversation is not None:
+                conversation_store.commit(
+                    conversation,
+                    message_dicts(request.messages) + [{"role": "assistant", "content": "".join(content_parts)}]
+                )
+        
+            upstream_status = 200
+            status = "ok"
+            if router is not None and router.winner.index != 0:
+                primary = router.attempts[0]
+                # The primary's slot learns from its own outcome, not the fallback's
+                upstream_status = primary.error.status_code if isinstance(primary.error, UpstreamError) else None
+        
+        except UpstreamError as e:
+            upstream_status = e.status_code
+            status = f"upstream_{e.status_code}"
+            yield f"data: {json.dumps({'error': str(e)})}\n\n"
+        
+        except DeadlineExceeded as e:
+            # Out of time: upstream is already closed, account for what was produced
+            status = "deadline_exceeded"
+            usage = partial_usage(
+                router.winner.name if router is not None and router.winner else request.model,
+                payload, "".join(content_parts), usage_data
+            )
+            cancellation_stats.record(normalize_model_name(request.model), status, usage)
+            yield f"data: {json.dumps({'type': 'usage', 'usage': usage})}\n\n"
+            yield f"data: {json.dumps({'error': str(e), 'partial': True})}\n\n"
         
         except Exception as e:
             error_msg = f"Error calling OpenRouter API: {str(e)}"
@@ -410,110 +734,624 @@ async def stream_chat_generator(request: ChatRequest):
         error_msg = f"Error processing request: {str(e)}"
         print(error_msg)
         yield f"data: {json.dumps({'error': error_msg})}\n\n"
+    
+    except (GeneratorExit, asyncio.CancelledError):
+        # The client went away mid-stream. Unwinding closes the upstream
+        # stream (unless other requests share it); record what it cost.
+        status = "cancelled"
+        usage = partial_usage(
+            router.winner.name if router is not None and router.winner else request.model,
+            payload, "".join(content_parts), usage_data
+        )
+        cancellation_stats.record(normalize_model_name(request.model), "client_disconnect", usage)
+        raise
+    
+    finally:
+        if ticket is not None:
+            ticket.release(upstream_status)
+        if timer is not None:
+            finish_request(timer, status, usage)
+        if turn is not None:
+            turn.release()
 
-@app.post("/api/chat")
-async def chat(request: ChatRequest):
-    # Handle streaming requests
-    if request.stream:
-        return StreamingResponse(
-            stream_chat_generator(request),
-            media_type="text/event-stream",
-            headers={
+async def complete_chat(
+    request: ChatRequest,
+    conversation: Optional[Conversation] = None,
+    plan: Optional[Tuple[str, Optional[CacheHint], Any]] = None,
+    slot_priority: Optional[int] = None,
+    ticket: Optional[Ticket] = None,
+    coalesce: bool = True
+) -> Dict[str, Any]:
+    """
+    Run a non-streaming chat completion and return it in the format expected
+    by the frontend. Raises if OpenRouter fails or returns no choices.
+    `plan` is the request's plan_upstream() if it was made already. A request
+    joining an identical call in flight has no admission slot; it passes the
+    `slot_priority` to take one at if that call ends first. Otherwise its
+    `ticket` is held by the upstream call until that call ends. With
+    `coalesce` off the request always makes its own upstream call.
+    """
+    model, cache_hint, payload = plan or plan_upstream(request, conversation, False)
+    fetch_completion = upstream.fetch_completion
+    if slot_priority is not None:
+        fetch_completion = lambda payload: fetch_with_slot(model, payload, slot_priority)
+    
+    async def fetch_primary():
+        if not coalesce:
+            return await fetch_completion(payload)
+        return await single_flight.call(payload, fetch_completion, ticket)
+    
+    router = None
+    if request.routing:
+        # Hedge to the fallback models if the primary is slow to answer
+        async def fetch(attempt: Attempt):
+            if attempt.index == 0:
+                return await fetch_primary()
+            return await hedge_call(
+                attempt.model,
+                build_payload(attempt.model, request.messages, False, conversation, cache_hint)
+            )
+        response_json, router = await hedged_call(routing_candidates(request), fetch, request.routing.ttft_deadline_ms)
+    else:
+        # Use direct API calls to OpenRouter over the shared connection pool,
+        # sharing the result with identical requests already in flight
+        started = time.perf_counter()
+        response_json = await fetch_primary()
+        latency_tracker.record(model, time.perf_counter() - started, "latency")
+    
+    # Extract the response content
+    choices = response_json.get("choices", [])
+    if not choices or len(choices) == 0:
+        raise ValueError("No choices in OpenRouter response")
+        
+    message = choices[0].get("message", {})
+    response_content = message.get("content", "No content received")
+    
+    # Extract usage statistics
+    usage_data = response_json.get("usage", {})
+    
+    if conversation is not None:
+        conversation_store.commit(
+            conversation,
+            message_dicts(request.messages) + [{"role": "assistant", "content": response_content}]
+        )
+    
+    # Report (and price) the model that actually answered
+    usage = build_usage(router.winner.name if router is not None else request.model, usage_data, cache_hint)
+    if router is not None:
+        usage["routing"] = router.report(request.model)
+    
+    # Return in the format expected by the frontend with additional metadata
+    return {
+        "message": {
+            "role": "assistant",
+            "content": response_content
+        },
+        # Cost rates as of 2025, subject to change
+        "usage": usage
+    }
+
+@app.get("/api/chat/streams/{stream_id}")
+async def resume_chat_stream(stream_id: str, raw_request: Request, last_event_id: Optional[str] = None):
+    """
+    Reconnect to a streaming answer: replay the events after `Last-Event-ID`
+    (header, or the `last_event_id` query parameter) and follow the rest live
+    """
+    stream = resumable_streams.get(stream_id)
+    if stream is None:
+        raise HTTPException(status_code=404, detail="Stream not found")
+    return resume_stream_response(raw_request, stream, raw_request.headers.get("last-event-id") or last_event_id)
+
+@app.delete("/api/chat/streams/{stream_id}")
+async def cancel_chat_stream(stream_id: str):
+    """Stop a buffered streaming answer now, for a client that is not coming back"""
+    stream = resumable_streams.get(stream_id)
+    if stream is None:
+        raise HTTPException(status_code=404, detail="Stream not found")
+    return {"stream_id": stream_id, "cancelled": resumable_streams.cancel(stream)}
+
+@app.post("/api/estimate")
+async def estimate(request: ChatRequest, completion_tokens: int = 0):
+    """
+    Estimate the prompt tokens and cost of a chat request without calling
+    upstream, and whether it fits the model's context window.
+    `completion_tokens` is the answer length to price in.
+    """
+    model = normalize_model_name(request.model)
+    conversation = None
+    if request.conversation_id and not request.conversation_reset:
+        conversation = conversation_store.get(request.conversation_id)
+    strategy = context_strategy(request)
+    result = {"model": model, "context_overflow": strategy}
+    try:
+        messages, prompt_tokens, context_length, trimmed = fit_context(request, conversation, strategy)
+        result.update({"fits": True, "trimmed_messages": trimmed, "messages": len(messages)})
+    except ContextOverflow as e:
+        prompt_tokens, context_length = e.prompt_tokens, e.context_length
+        result.update({"fits": False, "trimmed_messages": 0, "messages": len(request.messages)})
+    result.update({
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+        "context_length": context_length,
+        "tokenizer": token_estimator.tokenizer(model),
+        "estimated": True,
+        "cost": calculate_cost(model, prompt_tokens, completion_tokens)
+    })
+    return result
+
+# /api/chat reads its own body, document it as the ChatRequest it is
+CHAT_REQUEST_BODY = {
+    "requestBody": {
+        "required": True,
+        "content": {"application/json": {"schema": {"$ref": "#/components/schemas/ChatRequest"}}}
+    }
+}
+
+@app.post("/api/chat", openapi_extra=CHAT_REQUEST_BODY)
+async def chat(raw_request: Request, response: Response):
+    # Parsed here rather than by FastAPI so FAST_CODEC can skip the model
+    body = await raw_request.body()
+    request = chat_codec.parse(body, raw_request.headers.get("content-type"))
+    result = await serve_chat(request, body, raw_request, response)
+    if isinstance(result, dict) and chat_codec.enabled:
+        # The bytes FastAPI would render, without its jsonable_encoder pass
+        return Response(encode_response(result), media_type="application/json", headers=dict(response.headers))
+    return result
+
+async def serve_chat(request: ChatRequest, body: bytes, raw_request: Request, response: Response):
+    # A retried stream with a known X-Stream-Id joins the running or
+    # buffered answer instead of calling upstream again. Streams without
+    # one are not buffered, so they stop upstream as soon as the client leaves.
+    stream_id = raw_request.headers.get("x-stream-id") if request.stream and resumable_streams.enabled else None
+    resume_key = None
+    if stream_id is not None:
+        # Fingerprint the request as the client sent it, before any trimming
+        resume_key = stream_key(body)
+        if not STREAM_ID_PATTERN.match(stream_id):
+            raise HTTPException(status_code=400, detail="X-Stream-Id must be 8-128 letters, digits, '-' or '_'")
+        existing = resumable_streams.get(stream_id)
+        if existing is not None:
+            if existing.key != resume_key:
+                raise HTTPException(
+                    status_code=409,
+                    detail={
+                        "error": "stream_id_conflict",
+                        "stream_id": stream_id,
+                        "message": "X-Stream-Id is already used by a different request"
+                    }
+                )
+            return resume_stream_response(raw_request, existing, raw_request.headers.get("last-event-id"))
+        if raw_request.headers.get("last-event-id"):
+            # The client already has part of an answer we no longer have
+            raise resume_unavailable(stream_id)
+    
+    timer = RequestTimer(normalize_model_name(request.model), request.stream)
+    deadline = parse_deadline(raw_request.headers)
+    if deadline is not None and deadline.expired():
+        finish_request(timer, "deadline_exceeded")
+        return JSONResponse(status_code=504, content={"error": "Deadline exceeded"})
+    conversation, turn = resolve_conversation(request)
+    # Streams release the turn themselves once their generator ends
+    stream_owns_turn = False
+    try:
+        trimmed = apply_context_limit(request, conversation, timer)
+        cache_key, cached, cache_status = await lookup_cache(request, conversation, raw_request.headers)
+        
+        # Wait for an upstream slot, or shed the request with a real 429/503.
+        # A request joining an identical call in flight needs no slot.
+        ticket = None
+        plan = plan_upstream(request, conversation, bool(request.stream)) if cached is None and request.messages else None
+        joining = joins_flight(request, plan)
+        if cached is None and not joining:
+            try:
+                ticket = await admission.acquire(
+                    normalize_model_name(request.model),
+                    PRIORITY_INTERACTIVE if request.stream else PRIORITY_STANDARD,
+                    # Don't queue longer than the caller is willing to wait
+                    timeout=deadline.clamp(admission.queue_timeout) if deadline is not None else -1.0
+                )
+            except Overloaded as e:
+                finish_request(timer, "shed")
+                overloaded = overloaded_response(e)
+                overloaded.headers["Server-Timing"] = timer.server_timing()
+                return overloaded
+            timer.mark_queued(timer.elapsed())
+        
+        # Handle streaming requests
+        if request.stream:
+            headers = {
                 "Cache-Control": "no-cache",
                 "Connection": "keep-alive",
                 "X-Accel-Buffering": "no"
             }
-        )
+            if cache_status:
+                headers["X-Cache"] = cache_status
+            if trimmed:
+                headers["X-Context-Trimmed"] = str(trimmed)
+            if cached is not None:
+                finish_request(timer, "cached", build_usage(request.model, cached["usage"]))
+            # Frees the slot and the conversation even if the client left before the stream started
+            background = BackgroundTask(release_stream, ticket, turn) if cached is None else None
+            if cached is not None:
+                frames = replay_cached_stream(request, cached)
+            else:
+                frames = stream_chat_generator(request, cache_key, conversation, ticket, timer, deadline, turn, plan)
+                stream_owns_turn = True
+                if stream_id is not None:
+                    # Generate in the background so the answer outlives a dropped
+                    # connection; the slot is freed when generation ends instead
+                    stream = resumable_streams.open(frames, resume_key, stream_id, lambda: release_stream(ticket, turn))
+                    headers["X-Stream-Id"] = stream.id
+                    frames = resumable_streams.attach(stream)
+                    background = None
+                if not server_watches_disconnects(raw_request.scope):
+                    frames = cancel_on_disconnect(raw_request, frames)
+            return StreamingResponse(
+                frames,
+                media_type="text/event-stream",
+                headers=headers,
+                background=background
+            )
+        
+        if cache_status:
+            response.headers["X-Cache"] = cache_status
+        if trimmed:
+            response.headers["X-Context-Trimmed"] = str(trimmed)
+        if cached is not None:
+            usage = build_usage(request.model, cached["usage"])
+            finish_request(timer, "cached", usage)
+            response.headers["Server-Timing"] = timer.server_timing()
+            usage["cached"] = True
+            return {
+                "message": {
+                    "role": "assistant",
+                    "content": cached["content"]
+                },
+                "usage": usage
+            }
+        
+        # Non-streaming request (original logic)
+        upstream_status = None
+        status = "error"
+        usage = None
+        current_timer.set(timer)
+        current_deadline.set(deadline)
+        try:
+            if not request.messages:
+                raise HTTPException(status_code=400, detail="No messages provided")
+            
+            # Stop the upstream call if the client leaves or the deadline passes
+            result = await run_until_disconnected(
+                raw_request,
+                complete_chat(request, conversation, plan, PRIORITY_STANDARD if joining else None, ticket),
+                deadline
+            )
+            upstream_status = 200
+            status = "ok"
+            usage = result["usage"]
+            
+            # A fallback's answer is not the requested model's answer
+            if cache_key is not None and result["usage"]["model"] == request.model:
+                await response_cache.set(cache_key, result["message"]["content"], result["usage"])
+            
+            return result
+        except UpstreamError as e:
+            upstream_status = e.status_code
+            status = f"upstream_{e.status_code}"
+            if e.status_code == 429:
+                throttled = overloaded_response(upstream_throttled(e))
+                finish_request(timer, status)
+                throttled.headers["Server-Timing"] = timer.server_timing()
+                return throttled
+            return upstream_failure_response(request, e, timer, status)
+        except Overloaded as e:
+            # The call it meant to join ended, and its own was shed
+            status = "shed"
+            shed = overloaded_response(e)
+            finish_request(timer, status)
+            shed.headers["Server-Timing"] = timer.server_timing()
+            return shed
+        except HTTPException:
+            raise
+        except (ClientDisconnected, DeadlineExceeded) as e:
+            status = "cancelled" if isinstance(e, ClientDisconnected) else "deadline_exceeded"
+            model = normalize_model_name(request.model)
+            usage = partial_usage(
+                request.model,
+                build_payload(model, request.messages, False, conversation),
+                "", {}
+            )
+            cancellation_stats.record(model, "client_disconnect" if status == "cancelled" else status, usage)
+            finish_request(timer, status, usage)
+            if status == "cancelled":
+                # Nobody is listening any more
+                return Response(status_code=499)
+            timed_out = JSONResponse(status_code=504, content={"error": str(e), "usage": usage})
+            timed_out.headers["Server-Timing"] = timer.server_timing()
+            return timed_out
+        except Exception as e:
+            return upstream_failure_response(request, e, timer, status)
+        finally:
+            if ticket is not None:
+                ticket.release(upstream_status)
+            finish_request(timer, status, usage)
+            response.headers["Server-Timing"] = timer.server_timing()
+    finally:
+        if turn is not None and not stream_owns_turn:
+            turn.release()
+
+async def socket_chat_stream(message: Dict[str, Any], websocket: WebSocket):
+    """
+    One /ws/chat stream. Goes through the same conversation, context, cache
+    and admission steps as a streaming POST /api/chat, yields the headers
+    that would have been sent, then the SSE frames. Raises HTTPException
+    where /api/chat would have answered with an error status.
+    """
+    try:
+        request = chat_codec.validate(message.get("request"))
+    except RequestValidationError as e:
+        raise HTTPException(status_code=422, detail=jsonable_encoder(e.errors()))
+    request.stream = True
+    deadline = None
+    timeout_ms = message.get("timeout_ms")
+    if timeout_ms is not None:
+        if isinstance(timeout_ms, bool) or not isinstance(timeout_ms, (int, float)):
+            raise HTTPException(status_code=400, detail="timeout_ms must be a number")
+        deadline = Deadline(timeout_ms / 1000)
     
-    # Non-streaming request (original logic)
+    timer = RequestTimer(normalize_model_name(request.model), True)
+    if deadline is not None and deadline.expired():
+        finish_request(timer, "deadline_exceeded")
+        raise HTTPException(status_code=504, detail="Deadline exceeded")
+    conversation, turn = resolve_conversation(request)
     try:
-        if not request.messages:
-            raise HTTPException(status_code=400, detail="No messages provided")
+        trimmed = apply_context_limit(request, conversation, timer)
+        cache_key, cached, cache_status = await lookup_cache(request, conversation, websocket.headers)
         
-        # Convert messages to the format expected by OpenAI
-        formatted_messages = [{"role": msg.role, "content": msg.content} for msg in request.messages]
+        headers = {}
+        if cache_status:
+            headers["X-Cache"] = cache_status
+        if trimmed:
+            headers["X-Context-Trimmed"] = str(trimmed)
+        yield headers
         
-        # Normalize model name
-        model = normalize_model_name(request.model)
-                
-        # Use direct API calls to OpenRouter instead of OpenAI SDK
-        api_key = os.getenv("OPENROUTER_API_KEY")
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {api_key}",
-            "HTTP-Referer": os.getenv("APP_URL", "https://modellab.com"),
-            "X-Title": os.getenv("APP_TITLE", "Model Lab")
+        if cached is not None:
+            finish_request(timer, "cached", build_usage(request.model, cached["usage"]))
+            frames = replay_cached_stream(request, cached)
+        else:
+            ticket = None
+            plan = plan_upstream(request, conversation, True) if request.messages else None
+            if not joins_flight(request, plan):
+                try:
+                    ticket = await admission.acquire(
+                        timer.model,
+                        PRIORITY_INTERACTIVE,
+                        timeout=deadline.clamp(admission.queue_timeout) if deadline is not None else -1.0
+                    )
+                except Overloaded as e:
+                    finish_request(timer, "shed")
+                    raise HTTPException(status_code=e.status_code, detail={"error": e.reason, "retry_after": e.retry_after})
+                timer.mark_queued(timer.elapsed())
+            # Releases the ticket once started, which the loop below does without yielding first
+            frames = stream_chat_generator(request, cache_key, conversation, ticket, timer, deadline, turn, plan)
+        try:
+            async for frame in frames:
+                yield frame
+        finally:
+            await frames.aclose()
+    finally:
+        if turn is not None:
+            turn.release()
+
+@app.websocket("/ws/chat")
+async def chat_socket(websocket: WebSocket):
+    """Many concurrent chat streams over one connection, see ChatSockets for the protocol"""
+    await websocket.accept()
+    await chat_sockets.serve(websocket, socket_chat_stream)
+
+def chat_error_response(request: ChatRequest, e: Exception) -> Dict[str, Any]:
+    """Fallback reply shown in the chat when the upstream call fails"""
+    # If OpenRouter API fails, provide a fallback response
+    print(f"Error calling OpenRouter API: {str(e)}")
+    print(f"Response type: {type(e).__name__}")
+    print(f"Response: {str(e)}")
+    return {
+        "message": {
+            "role": "assistant",
+            "content": f"Sorry, there was an error processing your request: {str(e)}"
+        },
+        "usage": {
+            "prompt_tokens": 0,
+            "completion_tokens": 0,
+            "total_tokens": 0,
+            "model": request.model,
+            "cost": {
+                "input_cost_usd": 0,
+                "output_cost_usd": 0,
+                "total_cost_usd": 0,
+                "pricing_rate": {"input": 0, "output": 0}
+            },
+            "error": str(e)
         }
-        
+    }
+
+def upstream_failure_response(request: ChatRequest, e: Exception, timer: RequestTimer, status: str) -> JSONResponse:
+    """
+    A failed non-streaming chat as a gateway error: 504 when upstream timed
+    out, upstream's own 4xx when it rejected the request (sending it again
+    gets the same answer), 502 when it failed or answered with something
+    unusable, 500 for anything else. The body still carries the reply shown
+    in the chat.
+    """
+    if isinstance(e, httpx.TimeoutException) or (isinstance(e, UpstreamError) and e.status_code in (408, 504)):
+        status_code = 504
+    elif isinstance(e, UpstreamError) and 400 <= e.status_code < 500:
+        status_code = e.status_code
+    elif isinstance(e, (UpstreamError, httpx.HTTPError, ValueError)):
+        status_code = 502
+    else:
+        status_code = 500
+    failed = JSONResponse(status_code=status_code, content=chat_error_response(request, e))
+    finish_request(timer, status)
+    failed.headers["Server-Timing"] = timer.server_timing()
+    return failed
+
+async def complete_batch_chat(request: ChatRequest) -> Dict[str, Any]:
+    """
+    complete_chat() behind the admission controller at batch priority. Each
+    line makes its own upstream call, identical lines are not coalesced.
+    """
+    timer = RequestTimer(normalize_model_name(request.model), False)
+    current_timer.set(timer)
+    # Batch work waits for capacity rather than being shed
+    ticket = await admission.acquire(timer.model, PRIORITY_BATCH, timeout=None)
+    timer.mark_queued(timer.elapsed())
+    upstream_status = None
+    status = "error"
+    usage = None
+    try:
+        result = await complete_chat(request, None, None, None, ticket, coalesce=False)
+        upstream_status = 200
+        status = "ok"
+        usage = result["usage"]
+        return result
+    except UpstreamError as e:
+        upstream_status = e.status_code
+        status = f"upstream_{e.status_code}"
+        raise
+    finally:
+        ticket.release(upstream_status)
+        finish_request(timer, status, usage)
+
+async def stream_batch_generator(lines, concurrency: Optional[int], rate_limits: Optional[Dict[str, float]]):
+    """Encode batch results as NDJSON lines"""
+    async for result in run_batch(lines, complete_batch_chat, concurrency, rate_limits):
+        yield json.dumps(result) + "\n"
+
+@app.post("/api/chat/batch")
+async def chat_batch(raw_request: Request, concurrency: Optional[int] = None, rate_limits: Optional[str] = None):
+    """
+    Run a JSONL body of ChatRequest objects with bounded concurrency and stream
+    one NDJSON result per request in completion order, then a summary line.
+    `rate_limits` is "model=rps,..." and overrides BATCH_RATE_LIMITS.
+    """
+    body = await spool_body(raw_request.stream())
+    return StreamingResponse(
+        stream_batch_generator(
+            iter_lines(body),
+            concurrency,
+            parse_rate_limits(rate_limits) if rate_limits else None
+        ),
+        media_type="application/x-ndjson"
+    )
+
+async def stream_compare_generator(request: CompareRequest):
+    """
+    Stream several models' answers to the same messages at once.
+    
+    Every content/usage/error frame carries the requested model id, and a final
+    summary frame reports per-model time-to-first-token, latency and cost.
+    """
+    if not request.messages or not request.models:
+        yield f"data: {json.dumps({'error': 'Messages and at least one model are required'})}\n\n"
+        return
+    
+    formatted_messages = message_dicts(request.messages)
+    # Dedupe while keeping the requested order
+    models = list(dict.fromkeys(request.models))
+    queue: asyncio.Queue = asyncio.Queue()
+    started = time.perf_counter()
+    
+    async def run_model(model_id: str):
         payload = {
-            "model": model,
-            "messages": formatted_messages
+            "model": normalize_model_name(model_id),
+            "messages": formatted_messages,
+            "stream": True
         }
+        result = {"ttft_ms": None, "latency_ms": None, "usage": None, "error": None}
+        ticket = None
+        upstream_status = None
+        timer = RequestTimer(payload["model"], True)
+        current_timer.set(timer)
+        status = "error"
+        try:
+            ticket = await admission.acquire(payload["model"], PRIORITY_INTERACTIVE)
+            timer.mark_queued(timer.elapsed())
+            async for event in timer.watch(upstream.stream_completion(payload)):
+                if event["type"] == "content":
+                    if result["ttft_ms"] is None:
+                        result["ttft_ms"] = round((time.perf_counter() - started) * 1000, 1)
+                    await queue.put({"type": "content", "model": model_id, "content": event["content"]})
+                elif event["type"] == "usage":
+                    result["usage"] = build_usage(model_id, event["usage"])
+            upstream_status = 200
+            status = "ok"
+        except Overloaded as e:
+            status = "shed"
+            result["error"] = e.reason
+        except UpstreamError as e:
+            upstream_status = e.status_code
+            status = f"upstream_{e.status_code}"
+            result["error"] = str(e)
+        except asyncio.CancelledError:
+            status = "cancelled"
+            raise
+        except Exception as e:
+            result["error"] = str(e)
+        finally:
+            if ticket is not None:
+                ticket.release(upstream_status)
+            finish_request(timer, status, result["usage"])
+        result["latency_ms"] = round((time.perf_counter() - started) * 1000, 1)
         
-        api_response = requests.post(
-            "https://openrouter.ai/api/v1/chat/completions",
-            headers=headers,
-            data=json.dumps(payload)
-        )
-        
-        if api_response.status_code != 200:
-            raise ValueError(f"OpenRouter API returned status code {api_response.status_code}: {api_response.text}")
-        
-        # Parse the JSON response
-        response_json = api_response.json()
-        
-        # Extract the response content
-        choices = response_json.get("choices", [])
-        if not choices or len(choices) == 0:
-            raise ValueError("No choices in OpenRouter response")
-            
-        message = choices[0].get("message", {})
-        response_content = message.get("content", "No content received")
-        
-        # Extract usage statistics
-        usage_data = response_json.get("usage", {})
-        prompt_tokens = usage_data.get("prompt_tokens", 0)
-        completion_tokens = usage_data.get("completion_tokens", 0)
-        total_tokens = usage_data.get("total_tokens", 0)
-        
-        # Calculate cost (rates as of 2025, subject to change)
-        cost_info = calculate_cost(request.model, prompt_tokens, completion_tokens)
+        if result["error"]:
+            await queue.put({"type": "error", "model": model_id, "error": result["error"]})
+        else:
+            usage = result["usage"] or build_usage(model_id, {})
+            usage["ttft_ms"] = result["ttft_ms"]
+            usage["latency_ms"] = result["latency_ms"]
+            await queue.put({"type": "usage", "model": model_id, "usage": usage})
+        await queue.put({"type": "finished", "model": model_id, "result": result})
+    
+    tasks = [asyncio.create_task(run_model(model_id)) for model_id in models]
+    results = {}
+    try:
+        while len(results) < len(tasks):
+            frame = await queue.get()
+            if frame["type"] == "finished":
+                results[frame["model"]] = frame["result"]
+                continue
+            yield f"data: {json.dumps(frame)}\n\n"
         
-        # Return in the format expected by the frontend with additional metadata
-        return {
-            "message": {
-                "role": "assistant",
-                "content": response_content
-            },
-            "usage": {
-                "prompt_tokens": prompt_tokens,
-                "completion_tokens": completion_tokens,
-                "total_tokens": total_tokens,
-                "model": request.model,
-                "cost": cost_info
+        summary = {
+            "type": "summary",
+            "wall_ms": round((time.perf_counter() - started) * 1000, 1),
+            "results": {
+                model_id: {
+                    "ttft_ms": result["ttft_ms"],
+                    "latency_ms": result["latency_ms"],
+                    "cost": result["usage"]["cost"] if result["usage"] else None,
+                    "error": result["error"]
+                }
+                for model_id, result in results.items()
             }
         }
-    except Exception as e:
-        # If OpenRouter API fails, provide a fallback response
-        print(f"Error calling OpenRouter API: {str(e)}")
-        print(f"Response type: {type(e).__name__}")
-        print(f"Response: {str(e)}")
-        return {
-            "message": {
-                "role": "assistant",
-                "content": f"Sorry, there was an error processing your request: {str(e)}"
-            },
-            "usage": {
-                "prompt_tokens": 0,
-                "completion_tokens": 0,
-                "total_tokens": 0,
-                "model": request.model,
-                "cost": {
-                    "input_cost_usd": 0,
-                    "output_cost_usd": 0,
-                    "total_cost_usd": 0,
-                    "pricing_rate": {"input": 0, "output": 0}
-                },
-                "error": str(e)
-            }
+        yield f"data: {json.dumps(summary)}\n\n"
+        yield f"data: [DONE]\n\n"
+    finally:
+        # Stop any upstream streams still running if the client went away
+        for task in tasks:
+            task.cancel()
+
+@app.post("/api/compare")
+async def compare(request: CompareRequest):
+    return StreamingResponse(
+        stream_compare_generator(request),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "Connection": "keep-alive",
+            "X-Accel-Buffering": "no"
         }
+    )
@@ -0,0 +1,239 @@
+import bisect
+import contextvars
+import time
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Sequence, Tuple
+
+from .catalog import model_catalog
+
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0)
+INTER_TOKEN_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+TOKENS_PER_SECOND_BUCKETS = (1, 5, 10, 25, 50, 75, 100, 150, 200, 300, 500, 1000)
+COST_BUCKETS = (0.00001, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0)
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [
+        f'{name}="{str(value).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"'
+        for name, value in zip(names, values)
+    ]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = ()) -> None:
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *label_values: str, amount: float = 1.0) -> None:
+        self._values[label_values] = self._values.get(label_values, 0.0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        for label_values, value in self._values.items():
+            lines.append(f"{self.name}{_format_labels(self.labels, label_values)} {_format_value(value)}")
+        return lines
+
+
+class Gauge:
+    """Gauge whose value is read from a callback at scrape time"""
+
+    def __init__(self, name: str, help_text: str, read: Callable[[], Dict[Tuple[str, ...], float]], labels: Sequence[str] = ()) -> None:
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self.read = read
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} gauge"]
+        for label_values, value in self.read().items():
+            lines.append(f"{self.name}{_format_labels(self.labels, label_values)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, buckets: Sequence[float], labels: Sequence[str] = ()) -> None:
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        # label values -> [per-bucket counts..., +Inf count], sum
+        self._series: Dict[Tuple[str, ...], Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, *label_values: str) -> None:
+        series = self._series.get(label_values)
+        if series is None:
+            series = ([0] * (len(self.buckets) + 1), [0.0])
+            self._series[label_values] = series
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1][0] += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for label_values, (counts, total) in self._series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, label_values, le)} {cumulative}")
+            labels = _format_labels(self.labels, label_values)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total[0])}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self) -> None:
+        self._metrics: List[Any] = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+upstream_connect_seconds = registry.register(Histogram(
+    "modellab_upstream_connect_seconds", "Time to open a new upstream TCP+TLS connection",
+    LATENCY_BUCKETS, ("model",)))
+upstream_ttfb_seconds = registry.register(Histogram(
+    "modellab_upstream_ttfb_seconds", "Time from sending the upstream request to its response headers",
+    LATENCY_BUCKETS, ("model", "status")))
+ttft_seconds = registry.register(Histogram(
+    "modellab_ttft_seconds", "Time from request start to the first content token",
+    LATENCY_BUCKETS, ("model", "status")))
+inter_token_seconds = registry.register(Histogram(
+    "modellab_inter_token_seconds", "Gap between consecutive upstream content deltas",
+    INTER_TOKEN_BUCKETS, ("model",)))
+request_duration_seconds = registry.register(Histogram(
+    "modellab_request_duration_seconds", "Total chat request duration",
+    LATENCY_BUCKETS, ("model", "status", "stream")))
+tokens_per_second = registry.register(Histogram(
+    "modellab_tokens_per_second", "Completion tokens per second of generation",
+    TOKENS_PER_SECOND_BUCKETS, ("model",)))
+request_cost_usd = registry.register(Histogram(
+    "modellab_request_cost_usd", "Cost of a chat request in USD",
+    COST_BUCKETS, ("model",)))
+requests_total = registry.register(Counter(
+    "modellab_requests_total", "Chat requests by outcome", ("model", "status", "stream")))
+tokens_total = registry.register(Counter(
+    "modellab_tokens_total", "Tokens billed", ("model", "kind")))
+cost_usd_total = registry.register(Counter(
+    "modellab_cost_usd_total", "Total cost in USD", ("model",)))
+
+
+# Timer of the request being served, so the upstream client can attach
+# connection tracing without threading it through every call
+current_timer: contextvars.ContextVar[Optional["RequestTimer"]] = contextvars.ContextVar("current_timer", default=None)
+
+
+class RequestTimer:
+    """
+    Collects the timing of one chat request and records it on finish().
+
+    All marks are seconds since the timer was created. Metrics are labelled
+    with `label`, so models outside the catalog share one "other" series.
+    `coalesced` is set when the request shared an identical request's
+    upstream call instead of making its own.
+    """
+
+    def __init__(self, model: str, stream: bool) -> None:
+        self.model = model
+        self.label = model_catalog.table.label(model)
+        self.stream = stream
+        self.started = time.perf_counter()
+        self.coalesced = False
+        self.queue = None
+        self.connect = None
+        self.ttfb = None
+        self.ttft = None
+        self.finished = None
+        self._last_token = None
+        self._connect_started = None
+        self._request_sent = None
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    def mark_queued(self, waited: float) -> None:
+        self.queue = waited
+
+    async def trace(self, event_name: str, info: Dict[str, Any]) -> None:
+        """httpx/httpcore trace extension hook"""
+        if event_name == "connection.connect_tcp.started":
+            self._connect_started = time.perf_counter()
+        elif event_name in ("connection.connect_tcp.complete", "connection.start_tls.complete") and self._connect_started:
+            self.connect = time.perf_counter() - self._connect_started
+        elif event_name.endswith(".send_request_headers.started"):
+            self._request_sent = time.perf_counter()
+        elif event_name.endswith(".receive_response_headers.complete") and self._request_sent:
+            self.ttfb = time.perf_counter() - self._request_sent
+
+    def mark_token(self) -> None:
+        now = time.perf_counter()
+        if self.ttft is None:
+            self.ttft = now - self.started
+        elif self._last_token is not None:
+            inter_token_seconds.observe(now - self._last_token, self.label)
+        self._last_token = now
+
+    async def watch(self, events: AsyncIterator[Dict[str, Any]]) -> AsyncIterator[Dict[str, Any]]:
+        """Pass events through, timing the content deltas"""
+        async for event in events:
+            if event["type"] == "content":
+                self.mark_token()
+            yield event
+
+    def finish(self, status: str, usage: Optional[Dict[str, Any]] = None) -> None:
+        if self.finished is not None:
+            return
+        self.finished = self.elapsed()
+        stream = "true" if self.stream else "false"
+        requests_total.inc(self.label, status, stream)
+        request_duration_seconds.observe(self.finished, self.label, status, stream)
+        if self.connect is not None:
+            upstream_connect_seconds.observe(self.connect, self.label)
+        if self.ttfb is not None:
+            upstream_ttfb_seconds.observe(self.ttfb, self.label, status)
+        if self.ttft is not None:
+            ttft_seconds.observe(self.ttft, self.label, status)
+
+        # Cached answers were billed when they were first generated, and
+        # coalesced ones are billed to the request that made the call
+        if usage and status != "cached" and not usage.get("coalesced"):
+            prompt_tokens = usage.get("prompt_tokens", 0)
+            completion_tokens = usage.get("completion_tokens", 0)
+            tokens_total.inc(self.label, "prompt", amount=prompt_tokens)
+            tokens_total.inc(self.label, "completion", amount=completion_tokens)
+            cost = usage.get("cost", {}).get("total_cost_usd", 0)
+            request_cost_usd.observe(cost, self.label)
+            cost_usd_total.inc(self.label, amount=cost)
+
+            generation = self.finished - (self.ttft if self.ttft is not None else 0)
+            if completion_tokens and generation > 0:
+                tokens_per_second.observe(completion_tokens / generation, self.label)
+
+    def server_timing(self) -> str:
+        """Server-Timing header value, durations in milliseconds"""
+        parts = []
+        for name, value in (("queue", self.queue), ("connect", self.connect), ("ttfb", self.ttfb),
+                            ("ttft", self.ttft), ("total", self.finished if self.finished is not None else self.elapsed())):
+            if value is not None:
+                parts.append(f"{name};dur={value * 1000:.1f}")
+        return ", ".join(parts)
@@ -0,0 +1,314 @@
+import asyncio
+import json
+import os
+import re
+import time
+from typing import Any, AsyncIterator, Callable, Dict, Optional, Set, Union
+
+from fastapi import HTTPException
+from starlette.websockets import WebSocket, WebSocketDisconnect
+
+
+# Stream ids are chosen by the client and only need to be unique per connection
+SOCKET_STREAM_ID_PATTERN = re.compile(r"^[A-Za-z0-9_.:-]{1,128}$")
+
+_encode_string = json.encoder.encode_basestring
+
+# Runs one chat stream from a "chat" message: yields a dict of headers, then
+# SSE frames. Raises HTTPException if the request is rejected.
+StreamOpener = Callable[[Dict[str, Any], WebSocket], AsyncIterator[Union[str, bytes, Dict[str, str]]]]
+
+
+def socket_message(stream_id: str, frame: Union[str, bytes]) -> Optional[str]:
+    """
+    An SSE frame as a WebSocket message for `stream_id`, carrying the
+    frame's JSON unchanged. None for the `[DONE]` frame.
+    """
+    if isinstance(frame, bytes):
+        frame = frame.decode("utf-8")
+    data = frame[len("data: "):].rstrip("\n")
+    if data == "[DONE]":
+        return None
+    return '{"id":' + _encode_string(stream_id) + ',"data":' + data + "}"
+
+
+def _env_float(name: str, default: str) -> float:
+    value = os.getenv(name, default)
+    try:
+        return float(value)
+    except ValueError:
+        print(f"Warning: Invalid number for {name}: {value}")
+        return float(default)
+
+
+class _Stream:
+    """
+    One chat stream on a connection. With a window, at most that many bytes
+    are sent until the client grants more, as in HTTP/2 flow control.
+    """
+
+    __slots__ = ("id", "task", "window", "cancelled", "_credit")
+
+    def __init__(self, stream_id: str, window: Optional[int]) -> None:
+        self.id = stream_id
+        self.task: Optional[asyncio.Task] = None
+        self.window = window
+        self.cancelled = False
+        self._credit = asyncio.Event()
+        self._credit.set()
+
+    @property
+    def paused(self) -> bool:
+        return not self._credit.is_set()
+
+    async def spend(self, size: int) -> None:
+        if self.window is None:
+            return
+        while self.window <= 0:
+            self._credit.clear()
+            await self._credit.wait()
+        self.window -= size
+
+    def grant(self, size: int) -> None:
+        if self.window is None:
+            return
+        self.window += size
+        if self.window > 0:
+            self._credit.set()
+
+
+class _Session:
+    """One /ws/chat connection and the streams multiplexed over it"""
+
+    def __init__(self, sockets: "ChatSockets", websocket: WebSocket, open_stream: StreamOpener) -> None:
+        self.sockets = sockets
+        self.websocket = websocket
+        self.open_stream = open_stream
+        self.streams: Dict[str, _Stream] = {}
+        # Everything goes out through one bounded queue, so producers wait
+        # for a slow client instead of buffering without limit
+        self.outbox: asyncio.Queue = asyncio.Queue(maxsize=sockets.send_queue)
+        self.last_received = time.monotonic()
+        self.last_sent = time.monotonic()
+        self.receiver: Optional[asyncio.Task] = None
+        self.finished = asyncio.Event()
+
+    async def send(self, message: Dict[str, Any]) -> None:
+        await self.outbox.put(json.dumps(message, separators=(",", ":")))
+
+    async def _writer(self) -> None:
+        while True:
+            message = await self.outbox.get()
+            await self.websocket.send_text(message)
+            self.last_sent = time.monotonic()
+
+    async def _heartbeat(self) -> None:
+        """Ping an idle connection, and give up on one whose client stopped answering"""
+        interval = self.sockets.heartbeat_interval
+        timeout = self.sockets.heartbeat_timeout
+        if interval <= 0:
+            await asyncio.Event().wait()
+        while True:
+            await asyncio.sleep(interval)
+            now = time.monotonic()
+            if timeout > 0 and now - self.last_received > timeout:
+                self.sockets.heartbeat_timeouts += 1
+                return
+            if now - self.last_sent >= interval and self.outbox.empty():
+                self.outbox.put_nowait('{"type":"ping"}')
+
+    async def _receive(self) -> None:
+        while True:
+            message = await self.websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                return
+            self.last_received = time.monotonic()
+            text = message.get("text")
+            if text is None:
+                text = (message.get("bytes") or b"").decode("utf-8", errors="replace")
+            try:
+                data = json.loads(text)
+            except ValueError:
+                data = None
+            if not isinstance(data, dict):
+                await self.send({"id": None, "done": True, "status": 400, "error": "Messages must be JSON objects"})
+                continue
+            await self._handle(data)
+
+    async def _handle(self, data: Dict[str, Any]) -> None:
+        kind = data.get("type")
+        stream_id = data.get("id")
+        if kind == "ping":
+            await self.send({"type": "pong"})
+            return
+        if kind == "pong":
+            return
+        if kind not in ("chat", "cancel", "window"):
+            await self.send({"id": stream_id, "done": True, "status": 400, "error": f"Unknown message type: {kind}"})
+            return
+        if not isinstance(stream_id, str) or not SOCKET_STREAM_ID_PATTERN.match(stream_id):
+            await self.send({"id": None, "done": True, "status": 400, "error": "id must be 1-128 letters, digits, '-', '_', '.' or ':'"})
+            return
+
+        stream = self.streams.get(stream_id)
+        if kind == "cancel":
+            if stream is not None and not stream.cancelled:
+                stream.cancelled = True
+                stream.task.cancel()
+            return
+        if kind == "window":
+            size = data.get("bytes")
+            if stream is not None and isinstance(size, int) and size > 0:
+                stream.grant(size)
+            return
+
+        if stream is not None:
+            await self.send({"id": stream_id, "done": True, "status": 409, "error": "A stream with this id is already running"})
+            return
+        if len(self.streams) >= self.sockets.max_streams:
+            self.sockets.rejected += 1
+            await self.send({"id": stream_id, "done": True, "status": 429, "error": "Too many concurrent streams on this connection"})
+            return
+        window = data.get("window")
+        if window is not None and (not isinstance(window, int) or window <= 0):
+            await self.send({"id": stream_id, "done": True, "status": 400, "error": "window must be a positive number of bytes"})
+            return
+        stream = _Stream(stream_id, window)
+        self.streams[stream_id] = stream
+        self.sockets.streams += 1
+        stream.task = asyncio.create_task(self._run_stream(stream, data))
+
+    async def _run_stream(self, stream: _Stream, data: Dict[str, Any]) -> None:
+        frames = self.open_stream(data, self.websocket)
+        try:
+            async for frame in frames:
+                if isinstance(frame, dict):
+                    if frame:
+                        await self.send({"id": stream.id, "headers": frame})
+                    continue
+                message = socket_message(stream.id, frame)
+                if message is None:
+                    continue
+                await stream.spend(len(message))
+                await self.outbox.put(message)
+            await self.send({"id": stream.id, "done": True})
+        except HTTPException as e:
+            self.sockets.rejected += 1
+            await self.send({"id": stream.id, "done": True, "status": e.status_code, "error": e.detail})
+        except asyncio.CancelledError:
+            if not stream.cancelled:
+                # The connection is going away, nobody to tell
+                raise
+            self.sockets.cancelled += 1
+            await self.send({"id": stream.id, "done": True, "cancelled": True})
+        except Exception as e:
+            print(f"Error in WebSocket stream {stream.id}: {str(e)}")
+            await self.send({"id": stream.id, "done": True, "status": 500, "error": str(e)})
+        finally:
+            # A stream paused on a full window or outbox still has to unwind
+            await frames.aclose()
+            self.streams.pop(stream.id, None)
+
+    async def run(self) -> None:
+        writer = asyncio.create_task(self._writer())
+        heartbeat = asyncio.create_task(self._heartbeat())
+        self.receiver = asyncio.create_task(self._receive())
+        tasks = [writer, heartbeat, self.receiver]
+        try:
+            await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            streams = [stream.task for stream in self.streams.values()]
+            for task in streams + tasks:
+                task.cancel()
+            await asyncio.gather(*streams, *tasks, return_exceptions=True)
+            if heartbeat.done() and not heartbeat.cancelled() and heartbeat.exception() is None:
+                try:
+                    await self.websocket.close(code=1001, reason="Heartbeat timeout")
+                except (RuntimeError, WebSocketDisconnect):
+                    pass
+            elif writer.done() and not writer.cancelled() and writer.exception() is not None and not isinstance(writer.exception(), WebSocketDisconnect):
+                print(f"Warning: WebSocket send failed: {str(writer.exception())}")
+            self.finished.set()
+
+
+class ChatSockets:
+    """
+    Chat streams multiplexed over WebSocket connections (`/ws/chat`).
+
+    Every message is JSON. The client starts streams with
+    {"type": "chat", "id", "request": <ChatRequest>, "window"?}, stops one
+    with {"type": "cancel", "id"} and, for streams started with a window,
+    grants more with {"type": "window", "id", "bytes"}. The server sends
+    {"id", "data": <frame>} with the frames /api/chat streams as SSE, an
+    optional {"id", "headers"} first, and ends every stream with
+    {"id", "done": true} (plus "status" and "error" if it was rejected, or
+    "cancelled"). Configured with:
+      WS_MAX_STREAMS          concurrent streams per connection (default 16)
+      WS_SEND_QUEUE           messages queued for a slow client before
+                              streams wait for it (default 256)
+      WS_HEARTBEAT_INTERVAL   seconds of silence before a ping (default 20)
+      WS_HEARTBEAT_TIMEOUT    seconds without hearing from the client before
+                              the connection is closed (default 60, 0 never)
+    """
+
+    def __init__(self) -> None:
+        self._sessions: Set[_Session] = set()
+        self.connections = 0
+        self.streams = 0
+        self.cancelled = 0
+        self.rejected = 0
+        self.heartbeat_timeouts = 0
+
+    @property
+    def max_streams(self) -> int:
+        return int(os.getenv("WS_MAX_STREAMS", "16"))
+
+    @property
+    def send_queue(self) -> int:
+        return int(os.getenv("WS_SEND_QUEUE", "256"))
+
+    @property
+    def heartbeat_interval(self) -> float:
+        return _env_float("WS_HEARTBEAT_INTERVAL", "20")
+
+    @property
+    def heartbeat_timeout(self) -> float:
+        return _env_float("WS_HEARTBEAT_TIMEOUT", "60")
+
+    async def serve(self, websocket: WebSocket, open_stream: StreamOpener) -> None:
+        """Run one accepted connection until the client leaves"""
+        session = _Session(self, websocket, open_stream)
+        self._sessions.add(session)
+        self.connections += 1
+        try:
+            await session.run()
+        finally:
+            self._sessions.discard(session)
+
+    async def close(self) -> None:
+        """End every connection, cancelling their streams so they are accounted for"""
+        sessions = list(self._sessions)
+        for session in sessions:
+            if session.receiver is not None:
+                session.receiver.cancel()
+        for session in sessions:
+            if session.receiver is not None:
+                await session.finished.wait()
+
+    def stats(self) -> Dict[str, Any]:
+        sessions = list(self._sessions)
+        return {
+            "connections": len(sessions),
+            "active_streams": sum(len(session.streams) for session in sessions),
+            "paused_streams": sum(stream.paused for session in sessions for stream in session.streams.values()),
+            "queued_messages": sum(session.outbox.qsize() for session in sessions),
+            "connections_total": self.connections,
+            "streams_total": self.streams,
+            "cancelled": self.cancelled,
+            "rejected": self.rejected,
+            "heartbeat_timeouts": self.heartbeat_timeouts,
+            "max_streams": self.max_streams,
+        }
+
+
+chat_sockets = ChatSockets()
@@ -0,0 +1,53 @@
+from typing import Any, Dict
+
+from .catalog import model_catalog
+
+
+def calculate_cost(
+    model: str,
+    prompt_tokens: int,
+    completion_tokens: int,
+    cache_read_tokens: int = 0,
+    cache_write_tokens: int = 0,
+) -> Dict[str, Any]:
+    """
+    Calculate the cost of an API call based on token usage.
+    Rates are as of 2025 and subject to change. Check OpenRouter's pricing page for updates.
+
+    `cache_read_tokens` and `cache_write_tokens` are the part of the prompt
+    read from or written to the provider's prompt cache, priced at the
+    model's cache rates; they are included in `prompt_tokens`.
+
+    Returns a dictionary with cost information.
+    """
+    pricing = model_catalog.table.get(model)
+
+    cached_tokens = cache_read_tokens + cache_write_tokens
+    input_cost = (max(prompt_tokens - cached_tokens, 0) / 1000) * pricing["input"]
+    output_cost = (completion_tokens / 1000) * pricing["output"]
+    if not cached_tokens:
+        total_cost = input_cost + output_cost
+        return {
+            "input_cost_usd": round(input_cost, 6),
+            "output_cost_usd": round(output_cost, 6),
+            "total_cost_usd": round(total_cost, 6),
+            "pricing_rate": dict(pricing)
+        }
+
+    cache_rates = model_catalog.table.cache_rates(model)
+    cache_read_cost = (cache_read_tokens / 1000) * cache_rates["cache_read"]
+    cache_write_cost = (cache_write_tokens / 1000) * cache_rates["cache_write"]
+    input_cost += cache_read_cost + cache_write_cost
+    total_cost = input_cost + output_cost
+    # Against paying the full input rate for the same tokens; negative while writes outweigh reads
+    savings = (cached_tokens / 1000) * pricing["input"] - cache_read_cost - cache_write_cost
+
+    return {
+        "input_cost_usd": round(input_cost, 6),
+        "output_cost_usd": round(output_cost, 6),
+        "total_cost_usd": round(total_cost, 6),
+        "cache_read_cost_usd": round(cache_read_cost, 6),
+        "cache_write_cost_usd": round(cache_write_cost, 6),
+        "cache_savings_usd": round(savings, 6),
+        "pricing_rate": {**pricing, **cache_rates}
+    }
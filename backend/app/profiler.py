@@ -0,0 +1,99 @@
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Any, Dict, Optional
+
+
+class SamplingProfiler:
+    """
+    Statistical profiler for the event loop thread, switched on at runtime.
+
+    A background thread snapshots the loop thread's Python stack every
+    `interval` seconds and counts identical stacks, so the cost is one stack
+    walk per sample and nothing on the request path itself. Reports are in
+    the collapsed-stack format read by flamegraph.pl and speedscope.
+    Disabled unless PROFILER_ENABLED is set; runs stop by themselves after
+    PROFILER_MAX_SECONDS (default 60).
+    """
+
+    def __init__(self) -> None:
+        self._stacks: Counter = Counter()
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._target: Optional[int] = None
+        self.interval = 0.005
+        self.samples = 0
+        self.started: Optional[float] = None
+        self.stopped: Optional[float] = None
+
+    @property
+    def enabled(self) -> bool:
+        return os.getenv("PROFILER_ENABLED", "").lower() in ("1", "true", "yes")
+
+    @property
+    def max_seconds(self) -> float:
+        return float(os.getenv("PROFILER_MAX_SECONDS", "60"))
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, interval: float = 0.005, duration: Optional[float] = None) -> None:
+        """Start sampling the calling thread, discarding any previous report"""
+        if self.running:
+            return
+        self._stacks = Counter()
+        self.samples = 0
+        self.interval = max(interval, 0.001)
+        self._target = threading.get_ident()
+        self._stop.clear()
+        self.started = time.time()
+        self.stopped = None
+        deadline = min(duration or self.max_seconds, self.max_seconds)
+        self._thread = threading.Thread(target=self._run, args=(deadline,), name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+
+    def _run(self, deadline: float) -> None:
+        ends = time.monotonic() + deadline
+        while not self._stop.wait(self.interval) and time.monotonic() < ends:
+            frame = sys._current_frames().get(self._target)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                frame = frame.f_back
+            self._stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+        self.stopped = time.time()
+
+    def collapsed(self) -> str:
+        """One "frame;frame;frame count" line per distinct stack, hottest first"""
+        return "".join(f"{stack} {count}\n" for stack, count in self._stacks.most_common())
+
+    def status(self) -> Dict[str, Any]:
+        # Frames sampled most often at the top of the stack
+        leaves: Counter = Counter()
+        for stack, count in self._stacks.items():
+            leaves[stack.rsplit(";", 1)[-1]] += count
+        return {
+            "enabled": self.enabled,
+            "running": self.running,
+            "interval_ms": round(self.interval * 1000, 1),
+            "samples": self.samples,
+            "started": self.started,
+            "stopped": self.stopped,
+            "top": [{"frame": frame, "samples": count} for frame, count in leaves.most_common(20)],
+        }
+
+
+profiler = SamplingProfiler()
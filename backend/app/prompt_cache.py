@@ -0,0 +1,192 @@
+import hashlib
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from .tokens import token_estimator
+
+
+# The block form of a message content that asks the provider to cache the
+# prompt up to and including it, as OpenRouter passes it on to Anthropic
+CACHE_CONTROL = {"type": "ephemeral"}
+
+
+def cached_message(message: Dict[str, Any]) -> Dict[str, Any]:
+    """`message` with its content as a text block carrying a cache breakpoint"""
+    return {
+        "role": message["role"],
+        "content": [{"type": "text", "text": message["content"], "cache_control": CACHE_CONTROL}],
+    }
+
+
+def cache_token_counts(usage_data: Dict[str, Any]) -> Tuple[int, int]:
+    """
+    (prompt tokens read from the cache, prompt tokens written to it) as
+    reported by upstream, in OpenRouter's prompt_tokens_details or with
+    Anthropic's field names. Both are part of prompt_tokens.
+    """
+    details = usage_data.get("prompt_tokens_details") or {}
+    read = details.get("cached_tokens") or usage_data.get("cache_read_input_tokens") or 0
+    write = details.get("cache_write_tokens") or usage_data.get("cache_creation_input_tokens") or 0
+    return int(read), int(write)
+
+
+class CacheHint:
+    """Where one request's payload gets cache breakpoints"""
+
+    __slots__ = ("breakpoints", "prefix_tokens")
+
+    def __init__(self, breakpoints: Tuple[int, ...], prefix_tokens: int) -> None:
+        # Indexes into the messages being sent
+        self.breakpoints = breakpoints
+        self.prefix_tokens = prefix_tokens
+
+
+class PromptCacheTracker:
+    """
+    Finds prompt prefixes worth caching and marks them for providers that
+    need explicit cache breakpoints.
+
+    Every request to a supported model hashes its messages cumulatively, so
+    each message boundary past PROMPT_CACHE_MIN_TOKENS has a prefix hash.
+    The hashes are remembered with how often they were seen. A prefix seen
+    PROMPT_CACHE_MIN_REPEATS times within PROMPT_CACHE_TTL seconds counts as
+    recurring. The longest recurring prefix gets a breakpoint, so a
+    conversation reuses its own history. The most frequent one also gets
+    one, so a shared system prompt is reused across conversations. In
+    conversation mode the history is resent every turn, so the newest
+    message gets the breakpoint once the prompt is long enough.
+
+    Configured with:
+      PROMPT_CACHE_ENABLED       "0" disables the hints (default on)
+      PROMPT_CACHE_PROVIDERS     model prefixes that take cache_control
+                                 breakpoints (default "anthropic/")
+      PROMPT_CACHE_MIN_TOKENS    smallest prefix worth caching (default 1024)
+      PROMPT_CACHE_MIN_REPEATS   sightings before a prefix is marked (default 2)
+      PROMPT_CACHE_TTL           seconds a sighting counts (default 300, the
+                                 providers' cache lifetime)
+      PROMPT_CACHE_BREAKPOINTS   breakpoints per request (default 2, at most 4)
+      PROMPT_CACHE_MAX_PREFIXES  prefix hashes remembered (default 50000)
+    """
+
+    def __init__(self) -> None:
+        # prefix hash -> (sightings, last seen)
+        self._prefixes: "OrderedDict[bytes, Tuple[int, float]]" = OrderedDict()
+        self.requests = 0
+        self.hinted = 0
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+        self.cache_write_tokens = 0
+
+    @property
+    def enabled(self) -> bool:
+        return os.getenv("PROMPT_CACHE_ENABLED", "1").lower() in ("1", "true", "yes")
+
+    @property
+    def providers(self) -> Tuple[str, ...]:
+        value = os.getenv("PROMPT_CACHE_PROVIDERS", "anthropic/")
+        return tuple(prefix.strip() for prefix in value.split(",") if prefix.strip())
+
+    @property
+    def min_tokens(self) -> int:
+        return int(os.getenv("PROMPT_CACHE_MIN_TOKENS", "1024"))
+
+    @property
+    def min_repeats(self) -> int:
+        return int(os.getenv("PROMPT_CACHE_MIN_REPEATS", "2"))
+
+    @property
+    def ttl(self) -> float:
+        return float(os.getenv("PROMPT_CACHE_TTL", "300"))
+
+    @property
+    def max_breakpoints(self) -> int:
+        # Anthropic accepts at most four per request
+        return max(min(int(os.getenv("PROMPT_CACHE_BREAKPOINTS", "2")), 4), 1)
+
+    @property
+    def max_prefixes(self) -> int:
+        return int(os.getenv("PROMPT_CACHE_MAX_PREFIXES", "50000"))
+
+    def supports(self, model: str) -> bool:
+        return self.enabled and model.startswith(self.providers)
+
+    def _sighting(self, key: bytes, now: float) -> int:
+        seen = self._prefixes.get(key)
+        count = seen[0] + 1 if seen is not None and now - seen[1] <= self.ttl else 1
+        self._prefixes[key] = (count, now)
+        self._prefixes.move_to_end(key)
+        return count
+
+    def plan(self, messages: Sequence[Any], model: str, history_tokens: Optional[int] = None) -> Optional[CacheHint]:
+        """
+        Record the prefixes of `messages` for `model` and return where to put
+        breakpoints, or None. `history_tokens` is the size of a server-side
+        conversation history the messages are appended to.
+        """
+        if not messages or not self.supports(model):
+            return None
+        self.requests += 1
+        min_tokens = self.min_tokens
+
+        if history_tokens is not None:
+            tokens = history_tokens + sum(token_estimator.count_message(m.role, m.content, model) for m in messages)
+            if not history_tokens or tokens < min_tokens:
+                return None
+            self.hinted += 1
+            return CacheHint((len(messages) - 1,), tokens)
+
+        now = time.monotonic()
+        min_repeats = self.min_repeats
+        # Caches are per model, so are the prefixes
+        digest = hashlib.blake2b(model.encode("utf-8"), digest_size=16)
+        tokens = 0
+        recurring: List[Tuple[int, int, int]] = []  # (index, tokens, sightings)
+        for index, message in enumerate(messages):
+            digest.update(f"\0{message.role}\0{len(message.content)}\0".encode("utf-8"))
+            digest.update(message.content.encode("utf-8", errors="surrogatepass"))
+            tokens += token_estimator.count_message(message.role, message.content, model)
+            if tokens < min_tokens:
+                continue
+            count = self._sighting(digest.digest(), now)
+            if count >= min_repeats:
+                recurring.append((index, tokens, count))
+
+        max_prefixes = self.max_prefixes
+        while len(self._prefixes) > max_prefixes:
+            self._prefixes.popitem(last=False)
+
+        if not recurring:
+            return None
+        longest = recurring[-1]
+        chosen = {longest[0]}
+        # Most-seen first, the shortest of equals, e.g. a shared system prompt
+        for index, _, _ in sorted(recurring, key=lambda item: (-item[2], item[0])):
+            if len(chosen) >= self.max_breakpoints:
+                break
+            chosen.add(index)
+        self.hinted += 1
+        return CacheHint(tuple(sorted(chosen)), longest[1])
+
+    def record(self, prompt_tokens: int, cached_tokens: int, cache_write_tokens: int) -> None:
+        """Count what upstream reported for a request that was planned"""
+        self.prompt_tokens += prompt_tokens
+        self.cached_tokens += cached_tokens
+        self.cache_write_tokens += cache_write_tokens
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "providers": list(self.providers),
+            "tracked_prefixes": len(self._prefixes),
+            "requests": self.requests,
+            "hinted": self.hinted,
+            "prompt_tokens": self.prompt_tokens,
+            "cached_tokens": self.cached_tokens,
+            "cache_write_tokens": self.cache_write_tokens,
+            "hit_rate": round(self.cached_tokens / self.prompt_tokens, 4) if self.prompt_tokens else 0.0,
+        }
+
+
+prompt_cache = PromptCacheTracker()
@@ -0,0 +1,288 @@
+import asyncio
+import json
+import os
+import re
+import time
+import uuid
+from collections import OrderedDict, deque
+from typing import Any, AsyncIterator, Callable, Deque, Dict, Optional, Tuple, Union
+
+
+STREAM_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]{8,128}$")
+
+
+class ResumeUnavailable(Exception):
+    """The events a reconnect asked for are no longer buffered"""
+
+
+def parse_last_event_id(value: str) -> Tuple[Optional[str], int]:
+    """Split a `Last-Event-ID` of the form "<stream id>:<n>" (or just "<n>")"""
+    stream_id, _, seq = value.strip().rpartition(":")
+    return stream_id or None, int(seq)
+
+
+class BufferedStream:
+    """
+    One chat stream's recent SSE events, numbered from 0, each stored with
+    its `id:` line so a replay is a plain copy. Older events fall out once
+    the stream holds more than its byte budget.
+    """
+
+    __slots__ = (
+        "id", "key", "events", "bytes", "next_seq", "done", "finished_at",
+        "listeners", "task", "_changed", "_abandon",
+    )
+
+    def __init__(self, stream_id: str, key: str) -> None:
+        self.id = stream_id
+        self.key = key  # identifies the request, so a retry can only join its own stream
+        self.events: Deque[Tuple[int, bytes]] = deque()
+        self.bytes = 0
+        self.next_seq = 0
+        self.done = False
+        self.finished_at: Optional[float] = None
+        self.listeners = 0
+        self.task: Optional[asyncio.Task] = None
+        self._changed = asyncio.Event()
+        self._abandon: Optional[asyncio.TimerHandle] = None
+
+    @property
+    def first_seq(self) -> int:
+        """Number of the oldest event still buffered"""
+        return self.events[0][0] if self.events else self.next_seq
+
+    def available(self, after: int) -> bool:
+        """Whether every event after `after` can still be replayed"""
+        return after + 1 >= self.first_seq
+
+    def append(self, frame: bytes) -> int:
+        seq = self.next_seq
+        event = b"id: %s:%d\n%s" % (self.id.encode("ascii"), seq, frame)
+        self.events.append((seq, event))
+        self.next_seq += 1
+        self.bytes += len(event)
+        self._notify()
+        return len(event)
+
+    def trim(self, max_bytes: int) -> int:
+        """Drop the oldest events until at most `max_bytes` remain; return the bytes freed"""
+        freed = 0
+        while self.events and self.bytes > max_bytes:
+            _, event = self.events.popleft()
+            self.bytes -= len(event)
+            freed += len(event)
+        return freed
+
+    def finish(self) -> None:
+        self.done = True
+        self.finished_at = time.monotonic()
+        self._notify()
+
+    def _notify(self) -> None:
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def follow(self, after: int = -1) -> AsyncIterator[bytes]:
+        """Yield the events after `after`, then new ones as they arrive, until the stream ends"""
+        position = after + 1
+        while True:
+            while position < self.next_seq:
+                if position < self.first_seq:
+                    raise ResumeUnavailable(f"Events of stream {self.id} before {self.first_seq} are gone")
+                yield self.events[position - self.first_seq][1]
+                position += 1
+            if self.done:
+                return
+            await self._changed.wait()
+
+
+class ResumableStreams:
+    """
+    Keeps streaming chat answers alive and replayable across reconnects.
+
+    Only streams whose client asked for it with `X-Stream-Id` are buffered;
+    the others stop upstream as soon as their client leaves. Each buffered
+    stream is produced by a background task into a BufferedStream, and
+    clients read from the buffer, so a client that reconnects with the
+    stream id and `Last-Event-ID` picks up where it left off, or joins the
+    still-running upstream stream, without a new upstream call. A client
+    that is gone for good stops its stream with cancel(). Configured with:
+      STREAM_RESUME_ENABLED      accept X-Stream-Id and buffer those streams (default on)
+      STREAM_RESUME_GRACE        seconds a stream keeps generating with no
+                                 client attached before it is cancelled (default 10)
+      STREAM_RESUME_TTL          seconds a finished stream stays replayable (default 300)
+      STREAM_RESUME_STREAM_BYTES buffered bytes per stream (default 1 MiB)
+      STREAM_RESUME_MAX_BYTES    buffered bytes across streams (default 64 MiB)
+    """
+
+    def __init__(self) -> None:
+        self._streams: "OrderedDict[str, BufferedStream]" = OrderedDict()
+        self._bytes = 0
+        self.started = 0
+        self.resumed = 0
+        self.abandoned = 0
+        self.cancelled = 0
+        self.evictions = 0
+        self.unavailable = 0
+
+    @property
+    def enabled(self) -> bool:
+        return os.getenv("STREAM_RESUME_ENABLED", "1").lower() not in ("0", "false", "no", "off")
+
+    @property
+    def grace(self) -> float:
+        return float(os.getenv("STREAM_RESUME_GRACE", "10"))
+
+    @property
+    def ttl(self) -> float:
+        return float(os.getenv("STREAM_RESUME_TTL", "300"))
+
+    @property
+    def stream_bytes(self) -> int:
+        return int(os.getenv("STREAM_RESUME_STREAM_BYTES", str(1024 * 1024)))
+
+    @property
+    def max_bytes(self) -> int:
+        return int(os.getenv("STREAM_RESUME_MAX_BYTES", str(64 * 1024 * 1024)))
+
+    def open(
+        self,
+        frames: AsyncIterator[Union[str, bytes]],
+        key: str,
+        stream_id: Optional[str] = None,
+        on_close: Optional[Callable[[], Any]] = None,
+    ) -> BufferedStream:
+        """Start producing `frames` into a new buffered stream"""
+        self._evict_expired()
+        stream = BufferedStream(stream_id or uuid.uuid4().hex, key)
+        if stream.id in self._streams:
+            self._remove(stream.id)
+        self._streams[stream.id] = stream
+        stream.task = asyncio.ensure_future(self._produce(stream, frames, on_close))
+        self.started += 1
+        return stream
+
+    async def _produce(self, stream: BufferedStream, frames, on_close) -> None:
+        try:
+            async for frame in frames:
+                added = stream.append(frame.encode("utf-8") if isinstance(frame, str) else frame)
+                freed = stream.trim(self.stream_bytes)
+                if self._streams.get(stream.id) is stream:
+                    self._bytes += added - freed
+                    self._enforce_limit()
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            print(f"Warning: Stream {stream.id} failed: {str(e)}")
+        finally:
+            if hasattr(frames, "aclose"):
+                await frames.aclose()
+            if on_close is not None:
+                # Covers a stream cancelled before its generator got going
+                on_close()
+            stream.finish()
+
+    async def attach(self, stream: BufferedStream, after: int = -1) -> AsyncIterator[bytes]:
+        """
+        Read a stream from after event `after`. When the last reader leaves
+        before the answer is complete, the stream keeps going for the grace
+        period and is cancelled (closing upstream) if nobody comes back.
+        """
+        stream.listeners += 1
+        if stream._abandon is not None:
+            stream._abandon.cancel()
+            stream._abandon = None
+        try:
+            async for event in stream.follow(after):
+                yield event
+        except ResumeUnavailable as e:
+            self.unavailable += 1
+            yield f"data: {json.dumps({'error': str(e), 'resume': 'unavailable'})}\n\n".encode("utf-8")
+        finally:
+            stream.listeners -= 1
+            if stream.listeners == 0 and not stream.done:
+                stream._abandon = asyncio.get_running_loop().call_later(self.grace, self._abandon, stream)
+
+    def resume(self, stream: BufferedStream, after: int = -1) -> AsyncIterator[bytes]:
+        """attach() for a reconnecting client"""
+        self.resumed += 1
+        return self.attach(stream, after)
+
+    def _abandon(self, stream: BufferedStream) -> None:
+        stream._abandon = None
+        if stream.listeners == 0 and not stream.done and stream.task is not None:
+            # Unwinds the chat generator, which closes upstream and records the cancellation
+            stream.task.cancel()
+            self.abandoned += 1
+
+    def cancel(self, stream: BufferedStream) -> bool:
+        """Stop generating a stream now instead of after the grace period; False if it already ended"""
+        if stream._abandon is not None:
+            stream._abandon.cancel()
+            stream._abandon = None
+        if stream.done or stream.task is None or stream.task.done():
+            return False
+        stream.task.cancel()
+        self.cancelled += 1
+        return True
+
+    def get(self, stream_id: str) -> Optional[BufferedStream]:
+        self._evict_expired()
+        return self._streams.get(stream_id)
+
+    def _remove(self, stream_id: str) -> None:
+        stream = self._streams.pop(stream_id)
+        # Readers still replaying it keep their reference until they finish
+        self._bytes -= stream.bytes
+
+    def _evict_expired(self) -> None:
+        cutoff = time.monotonic() - self.ttl
+        expired = [
+            stream.id for stream in self._streams.values()
+            if stream.done and stream.finished_at < cutoff
+        ]
+        for stream_id in expired:
+            self._remove(stream_id)
+            self.evictions += 1
+
+    def _enforce_limit(self) -> None:
+        max_bytes = self.max_bytes
+        if self._bytes <= max_bytes:
+            return
+        # Finished streams go first, oldest first
+        for stream in [stream for stream in self._streams.values() if stream.done]:
+            if self._bytes <= max_bytes:
+                return
+            self._remove(stream.id)
+            self.evictions += 1
+        # Then running streams lose their history; readers that are caught up are unaffected
+        for stream in self._streams.values():
+            if self._bytes <= max_bytes:
+                return
+            self._bytes -= stream.trim(0)
+
+    async def close(self) -> None:
+        tasks = [stream.task for stream in self._streams.values() if stream.task is not None and not stream.task.done()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._streams.clear()
+        self._bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        self._evict_expired()
+        return {
+            "streams": len(self._streams),
+            "running": sum(1 for stream in self._streams.values() if not stream.done),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "started": self.started,
+            "resumed": self.resumed,
+            "abandoned": self.abandoned,
+            "cancelled": self.cancelled,
+            "evictions": self.evictions,
+            "unavailable": self.unavailable,
+        }
+
+
+resumable_streams = ResumableStreams()
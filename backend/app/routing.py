@@ -0,0 +1,262 @@
+import asyncio
+import os
+import time
+from collections import deque
+from typing import Any, AsyncIterator, Awaitable, Callable, Deque, Dict, List, Optional, Tuple
+
+from .catalog import model_catalog
+
+
+class LatencyTracker:
+    """
+    Rolling per-model latency samples, used to pick hedging deadlines.
+
+    The deadline for a model is ROUTING_DEADLINE_FACTOR (default 1.5) times
+    its recent ROUTING_DEADLINE_PERCENTILE (default 0.95) latency, clamped
+    to ROUTING_MIN_DEADLINE_MS..ROUTING_MAX_DEADLINE_MS (default 1000..20000).
+    Until a model has ROUTING_MIN_SAMPLES (default 20) samples out of the
+    last ROUTING_WINDOW (default 200), ROUTING_DEFAULT_DEADLINE_MS (default
+    8000) is used. "ttft" samples time the first token of streams and
+    "latency" samples whole non-streaming answers. Models outside the
+    catalog share the samples of "other".
+    """
+
+    def __init__(self) -> None:
+        self._samples: Dict[Tuple[str, str], Deque[float]] = {}
+        self._failures: Dict[str, int] = {}
+
+    @property
+    def window(self) -> int:
+        return int(os.getenv("ROUTING_WINDOW", "200"))
+
+    def record(self, model: str, seconds: float, kind: str = "ttft") -> None:
+        model = model_catalog.table.label(model)
+        samples = self._samples.get((model, kind))
+        if samples is None:
+            samples = self._samples[(model, kind)] = deque(maxlen=self.window)
+        samples.append(seconds)
+
+    def record_failure(self, model: str) -> None:
+        model = model_catalog.table.label(model)
+        self._failures[model] = self._failures.get(model, 0) + 1
+
+    def _percentile(self, model: str, kind: str, fraction: float) -> Optional[float]:
+        samples = self._samples.get((model, kind))
+        if not samples:
+            return None
+        ordered = sorted(samples)
+        return ordered[min(int(round(fraction * (len(ordered) - 1))), len(ordered) - 1)]
+
+    def deadline(self, model: str, kind: str = "ttft") -> float:
+        """Seconds to wait for `model` before hedging"""
+        minimum = float(os.getenv("ROUTING_MIN_DEADLINE_MS", "1000")) / 1000
+        maximum = float(os.getenv("ROUTING_MAX_DEADLINE_MS", "20000")) / 1000
+        samples = self._samples.get((model_catalog.table.label(model), kind))
+        if samples is None or len(samples) < int(os.getenv("ROUTING_MIN_SAMPLES", "20")):
+            return min(max(float(os.getenv("ROUTING_DEFAULT_DEADLINE_MS", "8000")) / 1000, minimum), maximum)
+        fraction = float(os.getenv("ROUTING_DEADLINE_PERCENTILE", "0.95"))
+        factor = float(os.getenv("ROUTING_DEADLINE_FACTOR", "1.5"))
+        return min(max(self._percentile(model, kind, fraction) * factor, minimum), maximum)
+
+    def stats(self) -> Dict[str, Any]:
+        models: Dict[str, Dict[str, Any]] = {}
+        for (model, kind), samples in self._samples.items():
+            entry = models.setdefault(model, {"failures": self._failures.get(model, 0)})
+            entry[kind] = {
+                "samples": len(samples),
+                "p50_ms": round(self._percentile(model, kind, 0.5) * 1000, 1),
+                "p95_ms": round(self._percentile(model, kind, 0.95) * 1000, 1),
+                "deadline_ms": round(self.deadline(model, kind) * 1000, 1),
+            }
+        for model, failures in self._failures.items():
+            models.setdefault(model, {"failures": failures})
+        return {"models": models}
+
+
+latency_tracker = LatencyTracker()
+
+
+class Attempt:
+    """One model tried for a routed request"""
+
+    def __init__(self, index: int, name: str, model: str) -> None:
+        self.index = index
+        self.name = name      # as written in the request
+        self.model = model    # normalized
+        self.started = time.perf_counter()
+        self.first_token: Optional[float] = None
+        self.outcome: Optional[str] = None  # "won", "failed" or "cancelled"
+        self.error: Optional[BaseException] = None
+        self.future: Optional[asyncio.Future] = None
+
+    def report(self) -> Dict[str, Any]:
+        return {
+            "model": self.name,
+            "outcome": self.outcome or "cancelled",
+            "ttft_ms": round(self.first_token * 1000, 1) if self.first_token is not None else None,
+            "error": str(self.error) if self.error is not None else None,
+        }
+
+
+async def _cancel(futures: List[asyncio.Future]) -> None:
+    for future in futures:
+        future.cancel()
+    # Let the cancelled attempts run their cleanup (closing upstream streams)
+    await asyncio.gather(*futures, return_exceptions=True)
+
+
+class _Router:
+    """
+    Shared hedging loop: start the first candidate, start the next one when
+    the newest attempt misses its deadline or every running attempt failed,
+    and settle on whichever attempt produces something first.
+    """
+
+    kind = "ttft"
+
+    def __init__(self, candidates: List[Tuple[str, str]], deadline_ms: Optional[float], tracker: LatencyTracker) -> None:
+        self._candidates = deque(enumerate(candidates))
+        self.deadline_ms = deadline_ms
+        self.tracker = tracker
+        self.attempts: List[Attempt] = []
+        self.winner: Optional[Attempt] = None
+
+    def _deadline(self, attempt: Attempt) -> float:
+        if self.deadline_ms is not None:
+            return self.deadline_ms / 1000
+        return self.tracker.deadline(attempt.model, self.kind)
+
+    def _launch(self) -> Attempt:
+        index, (name, model) = self._candidates.popleft()
+        attempt = Attempt(index, name, model)
+        attempt.future = self._start(attempt)
+        self.attempts.append(attempt)
+        return attempt
+
+    def _start(self, attempt: Attempt) -> asyncio.Future:
+        raise NotImplementedError
+
+    async def _race(self) -> Tuple[Attempt, Any]:
+        """Run attempts until one completes its future; return it with the result"""
+        self._launch()
+        last_error: Optional[BaseException] = None
+        while True:
+            running = [attempt for attempt in self.attempts if attempt.outcome is None]
+            if not running:
+                if self._candidates:
+                    # Everything in flight failed, fall back straight away
+                    self._launch()
+                    continue
+                raise last_error
+
+            timeout = None
+            if self._candidates:
+                newest = self.attempts[-1]
+                timeout = max(newest.started + self._deadline(newest) - time.perf_counter(), 0)
+            done, _ = await asyncio.wait(
+                [attempt.future for attempt in running], timeout=timeout, return_when=asyncio.FIRST_COMPLETED
+            )
+            if not done:
+                # Newest attempt is slow to start: hedge with the next model
+                self._launch()
+                continue
+
+            for attempt in running:
+                if attempt.future not in done:
+                    continue
+                try:
+                    result = attempt.future.result()
+                except StopAsyncIteration:
+                    result = None
+                except Exception as e:
+                    attempt.outcome = "failed"
+                    attempt.error = e
+                    last_error = e
+                    self.tracker.record_failure(attempt.model)
+                    continue
+                attempt.outcome = "won"
+                attempt.first_token = time.perf_counter() - attempt.started
+                self.tracker.record(attempt.model, attempt.first_token, self.kind)
+                self.winner = attempt
+                await _cancel([other.future for other in self.attempts if other.outcome is None])
+                return attempt, result
+
+    def report(self, requested: str) -> Dict[str, Any]:
+        return {
+            "requested_model": requested,
+            "answered_by": self.winner.name if self.winner else None,
+            "hedged": len(self.attempts) > 1,
+            "attempts": [attempt.report() for attempt in self.attempts],
+        }
+
+    async def _cleanup(self) -> None:
+        await _cancel([attempt.future for attempt in self.attempts if attempt.future is not None and not attempt.future.done()])
+
+
+class HedgedStream(_Router):
+    """
+    Stream events from the first of `candidates` ((name, normalized model)
+    pairs, primary first) to produce an event. `open_stream(attempt)` opens
+    the event stream for an attempt. Losing attempts are cancelled as soon
+    as a winner is known; once tokens flow there is no switching models.
+    """
+
+    kind = "ttft"
+
+    def __init__(
+        self,
+        candidates: List[Tuple[str, str]],
+        open_stream: Callable[[Attempt], AsyncIterator[Dict[str, Any]]],
+        deadline_ms: Optional[float] = None,
+        tracker: LatencyTracker = latency_tracker,
+    ) -> None:
+        super().__init__(candidates, deadline_ms, tracker)
+        self._open_stream = open_stream
+        self._iterators: Dict[int, AsyncIterator[Dict[str, Any]]] = {}
+
+    def _start(self, attempt: Attempt) -> asyncio.Future:
+        iterator = self._open_stream(attempt).__aiter__()
+        self._iterators[attempt.index] = iterator
+        return asyncio.ensure_future(iterator.__anext__())
+
+    async def __aiter__(self) -> AsyncIterator[Dict[str, Any]]:
+        try:
+            winner, first = await self._race()
+            if first is None:
+                return
+            yield first
+            async for event in self._iterators[winner.index]:
+                yield event
+        finally:
+            await self._cleanup()
+            # Losers that produced something in the same instant as the
+            # winner are parked at a yield and still need closing
+            for iterator in self._iterators.values():
+                if hasattr(iterator, "aclose"):
+                    await iterator.aclose()
+
+
+async def hedged_call(
+    candidates: List[Tuple[str, str]],
+    call: Callable[[Attempt], Awaitable[Any]],
+    deadline_ms: Optional[float] = None,
+    tracker: LatencyTracker = latency_tracker,
+) -> Tuple[Any, "_CallRouter"]:
+    """Non-streaming counterpart of HedgedStream: the whole answer counts as the first token"""
+    router = _CallRouter(candidates, call, deadline_ms, tracker)
+    try:
+        _, result = await router._race()
+    finally:
+        await router._cleanup()
+    return result, router
+
+
+class _CallRouter(_Router):
+    kind = "latency"
+
+    def __init__(self, candidates, call, deadline_ms, tracker) -> None:
+        super().__init__(candidates, deadline_ms, tracker)
+        self._call = call
+
+    def _start(self, attempt: Attempt) -> asyncio.Future:
+        return asyncio.ensure_future(self._call(attempt))
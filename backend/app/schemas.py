@@ -0,0 +1,35 @@
+from pydantic import BaseModel, Field
+from typing import List, Literal, Optional
+
+
+class ChatMessage(BaseModel):
+    role: str
+    content: str
+
+class RoutingPolicy(BaseModel):
+    # Models to try, in order, when `model` is slow to start or fails
+    fallbacks: List[str] = []
+    # Hedge to the next model if no token arrived by then; picked from
+    # recent latency when unset
+    ttft_deadline_ms: Optional[float] = None
+
+class ChatRequest(BaseModel):
+    messages: List[ChatMessage]
+    model: str = Field("openai/gpt-4o-mini", min_length=1)
+    stream: Optional[bool] = False
+    # Conversation mode: send only new messages for a server-side history.
+    # conversation_reset replaces the history with `messages`.
+    conversation_id: Optional[str] = None
+    conversation_reset: Optional[bool] = False
+    routing: Optional[RoutingPolicy] = None
+    # What to do when the prompt exceeds the model's context window:
+    # "reject", "drop_oldest" or "keep_system" (default from CONTEXT_OVERFLOW)
+    context_overflow: Optional[Literal["reject", "drop_oldest", "keep_system"]] = None
+
+class CompareRequest(BaseModel):
+    messages: List[ChatMessage]
+    models: List[str]
+
+class ChatResponse(BaseModel):
+    role: str
+    content: str
@@ -0,0 +1,204 @@
+import asyncio
+import hashlib
+import json
+import os
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Union
+
+from .metrics import current_timer
+
+
+def payload_key(payload: Union[Dict[str, Any], bytes]) -> str:
+    """Identical upstream payloads (same normalized model and messages) share a key"""
+    if isinstance(payload, bytes):
+        # Pre-serialised bodies are already in a canonical compact encoding
+        return hashlib.sha256(payload).hexdigest()
+    canonical = json.dumps(payload, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class _StreamFlight:
+    """One in-flight upstream stream and everything it has produced so far"""
+
+    def __init__(self) -> None:
+        self.events: List[Dict[str, Any]] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.subscribers = 0
+        self.task: Optional[asyncio.Task] = None
+        self._changed = asyncio.Event()
+
+    def notify(self) -> None:
+        # Wake everyone waiting on the current event and start a fresh one
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    async def wait(self) -> None:
+        await self._changed.wait()
+
+
+class _CallFlight:
+    """One in-flight non-streaming upstream call"""
+
+    def __init__(self, task: asyncio.Task) -> None:
+        self.task = task
+        self.subscribers = 0
+
+
+class SingleFlight:
+    """
+    Coalesces identical upstream requests that overlap in time.
+
+    The first request for a key (the leader) starts the upstream call as an
+    independent task; identical requests arriving before it finishes attach
+    to it as followers. Streaming followers replay the events produced so
+    far and then follow the live tail. The upstream call is cancelled only
+    once every subscriber has gone away. A follower's request timer is
+    marked `coalesced`, since its leader pays for the call. The leader's
+    admission `slot` is held until the call itself ends, so a call that
+    outlives its leader still counts against the limits. Disable with
+    SINGLE_FLIGHT_ENABLED=0.
+    """
+
+    def __init__(self) -> None:
+        self._streams: Dict[str, _StreamFlight] = {}
+        self._calls: Dict[str, _CallFlight] = {}
+        self.leaders = 0
+        self.followers = 0
+
+    @property
+    def enabled(self) -> bool:
+        return os.getenv("SINGLE_FLIGHT_ENABLED", "1").lower() not in ("0", "false", "no")
+
+    def in_flight(self, payload: Union[Dict[str, Any], bytes]) -> bool:
+        """Whether a request for `payload` would join a call that is running now"""
+        if not self.enabled:
+            return False
+        key = payload_key(payload)
+        return key in self._streams or key in self._calls
+
+    @staticmethod
+    def _hold(flight: Union[_StreamFlight, _CallFlight], slot: Optional[Any]) -> None:
+        # Keep the leader's slot taken until the task ends, even if it never got to run
+        if slot is not None:
+            slot.hold()
+            flight.task.add_done_callback(lambda _: slot.unhold())
+
+    def _follow(self) -> None:
+        self.followers += 1
+        timer = current_timer.get()
+        if timer is not None:
+            timer.coalesced = True
+
+    async def _pump(self, key: str, flight: _StreamFlight, source: AsyncIterator[Dict[str, Any]]) -> None:
+        try:
+            async for event in source:
+                flight.events.append(event)
+                flight.notify()
+        except asyncio.CancelledError:
+            flight.error = asyncio.CancelledError()
+            raise
+        except Exception as e:
+            flight.error = e
+        finally:
+            # Release the upstream connection even when cancelled mid-stream
+            await source.aclose()
+            flight.done = True
+            if self._streams.get(key) is flight:
+                del self._streams[key]
+            flight.notify()
+
+    async def stream(
+        self,
+        payload: Union[Dict[str, Any], bytes],
+        start: Callable[[Any], AsyncIterator[Dict[str, Any]]],
+        slot: Optional[Any] = None,
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Iterate the events of start(payload), shared with identical concurrent
+        callers. `slot` is the caller's admission ticket, held by the upstream
+        call if this caller starts it.
+        """
+        if not self.enabled:
+            async for event in start(payload):
+                yield event
+            return
+
+        key = payload_key(payload)
+        flight = self._streams.get(key)
+        if flight is None:
+            flight = _StreamFlight()
+            self._streams[key] = flight
+            flight.task = asyncio.create_task(self._pump(key, flight, start(payload)))
+            self._hold(flight, slot)
+            self.leaders += 1
+        else:
+            self._follow()
+
+        flight.subscribers += 1
+        position = 0
+        try:
+            while True:
+                if position < len(flight.events):
+                    event = flight.events[position]
+                    position += 1
+                    yield event
+                elif flight.done:
+                    if flight.error is not None:
+                        raise flight.error
+                    return
+                else:
+                    await flight.wait()
+        finally:
+            flight.subscribers -= 1
+            if flight.subscribers == 0 and not flight.done:
+                # Nobody is listening any more, stop paying for tokens
+                flight.task.cancel()
+                if self._streams.get(key) is flight:
+                    del self._streams[key]
+
+    def _forget_call(self, key: str, flight: _CallFlight) -> None:
+        if self._calls.get(key) is flight:
+            del self._calls[key]
+
+    async def call(
+        self,
+        payload: Union[Dict[str, Any], bytes],
+        start: Callable[[Any], Awaitable[Any]],
+        slot: Optional[Any] = None,
+    ) -> Any:
+        """Await start(payload), sharing the result with identical concurrent callers (see stream())"""
+        if not self.enabled:
+            return await start(payload)
+
+        key = payload_key(payload)
+        flight = self._calls.get(key)
+        if flight is None:
+            flight = _CallFlight(asyncio.create_task(start(payload)))
+            self._calls[key] = flight
+            flight.task.add_done_callback(lambda _: self._forget_call(key, flight))
+            self._hold(flight, slot)
+            self.leaders += 1
+        else:
+            self._follow()
+
+        flight.subscribers += 1
+        try:
+            # Shield so one caller cancelling does not cancel the shared call
+            return await asyncio.shield(flight.task)
+        finally:
+            flight.subscribers -= 1
+            if flight.subscribers == 0 and not flight.task.done():
+                flight.task.cancel()
+
+    def stats(self) -> Dict[str, Any]:
+        requests = self.leaders + self.followers
+        return {
+            "enabled": self.enabled,
+            "in_flight": len(self._streams) + len(self._calls),
+            "upstream_calls": self.leaders,
+            "coalesced": self.followers,
+            "dedup_ratio": round(self.followers / requests, 4) if requests else 0.0,
+        }
+
+
+single_flight = SingleFlight()
@@ -0,0 +1,230 @@
+import asyncio
+import json
+import os
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+
+class SSEParser:
+    """
+    Incremental byte-level parser for a server-sent event stream.
+
+    Feed it raw chunks as they arrive; it returns the `data:` payload of
+    every event completed so far, as bytes. Comments and other fields
+    (`event:`, `id:`, `retry:`) are skipped without being decoded.
+    """
+
+    def __init__(self) -> None:
+        self._buffer = bytearray()
+        self._data: List[bytes] = []
+
+    def _dispatch(self, events: List[bytes]) -> None:
+        if self._data:
+            events.append(self._data[0] if len(self._data) == 1 else b"\n".join(self._data))
+            self._data = []
+
+    def feed(self, chunk: bytes) -> List[bytes]:
+        buffer = self._buffer
+        buffer += chunk
+        events: List[bytes] = []
+        start = 0
+        while True:
+            end = buffer.find(b"\n", start)
+            if end == -1:
+                break
+            line_end = end - 1 if end > start and buffer[end - 1] == 0x0D else end  # drop \r
+            if line_end == start:
+                # A blank line terminates the event
+                self._dispatch(events)
+            elif buffer.startswith(b"data:", start):
+                value_start = start + 5
+                if value_start < line_end and buffer[value_start] == 0x20:
+                    value_start += 1
+                self._data.append(bytes(buffer[value_start:line_end]))
+            start = end + 1
+        del buffer[:start]
+        return events
+
+    def close(self) -> List[bytes]:
+        """Flush an event left unterminated when the stream ends"""
+        events: List[bytes] = []
+        if self._buffer:
+            events = self.feed(b"\n")
+        self._dispatch(events)
+        return events
+
+
+def _string_end(data: bytes, start: int) -> int:
+    """Index of the closing quote of the JSON string starting at `start`"""
+    while True:
+        end = data.index(b'"', start)
+        backslashes = 0
+        while data[end - 1 - backslashes] == 0x5C:
+            backslashes += 1
+        if backslashes % 2 == 0:
+            return end
+        start = end + 1
+
+
+def _fast_content(data: bytes) -> Optional[bytes]:
+    """
+    Pull the still-escaped content of choices[0].delta.content straight out of
+    the bytes of a typical streaming chunk, or None when the chunk needs a
+    full decode (usage, errors, several choices, ...). Returns b"" for chunks
+    without content.
+    """
+    if b'"usage"' in data or b'"error"' in data or b'"delta"' not in data:
+        return None
+    key = data.find(b'"content"')
+    if key == -1:
+        return b""
+    if data.find(b'"content"', key + 9) != -1:
+        return None
+
+    i = key + 9
+    length = len(data)
+    while i < length and data[i] in b" \t\r\n:":
+        i += 1
+    if data.startswith(b"null", i):
+        return b""
+    if i >= length or data[i] != 0x22:
+        return None
+    try:
+        return data[i + 1:_string_end(data, i + 1)]
+    except (ValueError, IndexError):
+        # Unterminated string, let the full decode reject it
+        return None
+
+
+def decode_chunk(data: bytes) -> List[Dict[str, Any]]:
+    """
+    Turn one upstream chunk payload into content/usage events.
+
+    Content events carry the text plus `raw`, its JSON-escaped form as
+    received, so it can be written back out without re-serialising.
+    """
+    raw = _fast_content(data)
+    if raw is not None:
+        if not raw:
+            return []
+        content = json.loads(b'"' + raw + b'"') if b"\\" in raw else raw.decode("utf-8")
+        return [{"type": "content", "content": content, "raw": raw}]
+
+    try:
+        chunk_data = json.loads(data)
+    except json.JSONDecodeError:
+        # Skip invalid JSON
+        return []
+    if not isinstance(chunk_data, dict):
+        return []
+
+    events: List[Dict[str, Any]] = []
+    choices = chunk_data.get("choices") or []
+    if choices:
+        content_delta = (choices[0].get("delta") or {}).get("content") or ""
+        if content_delta:
+            events.append({
+                "type": "content",
+                "content": content_delta,
+                "raw": json.dumps(content_delta)[1:-1].encode("utf-8"),
+            })
+
+    # Usage data usually arrives in the final chunk
+    if chunk_data.get("usage"):
+        events.append({"type": "usage", "usage": chunk_data["usage"]})
+    return events
+
+
+def content_frame(event: Dict[str, Any]) -> bytes:
+    """Encode a content event as the frontend's SSE frame, reusing its escaped bytes"""
+    raw = event.get("raw")
+    if raw is None:
+        raw = json.dumps(event["content"])[1:-1].encode("utf-8")
+    return b'data: {"type": "content", "content": "' + raw + b'"}\n\n'
+
+
+def _merge(pending: List[Dict[str, Any]]) -> Dict[str, Any]:
+    if len(pending) == 1:
+        return pending[0]
+    return {
+        "type": "content",
+        "content": "".join(event["content"] for event in pending),
+        "raw": b"".join(event["raw"] for event in pending),
+    }
+
+
+async def coalesce_content(
+    events: AsyncIterator[Dict[str, Any]],
+    max_bytes: Optional[int] = None,
+    max_delay_ms: Optional[float] = None,
+) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Merge runs of consecutive content events into one.
+
+    The first content event goes out immediately so time-to-first-token is
+    unaffected; after that, deltas are held until SSE_COALESCE_BYTES
+    (default 512) bytes are pending or SSE_COALESCE_MS (default 20) ms have
+    passed, whichever comes first. Any other event flushes pending content
+    ahead of itself. SSE_COALESCE_MS=0 turns merging off.
+    """
+    if max_bytes is None:
+        max_bytes = int(os.getenv("SSE_COALESCE_BYTES", "512"))
+    if max_delay_ms is None:
+        max_delay_ms = float(os.getenv("SSE_COALESCE_MS", "20"))
+    if max_delay_ms <= 0:
+        async for event in events:
+            yield event
+        return
+
+    loop = asyncio.get_running_loop()
+    max_delay = max_delay_ms / 1000
+    iterator = events.__aiter__()
+    pending: List[Dict[str, Any]] = []
+    pending_bytes = 0
+    deadline = 0.0
+    first = True
+    next_event: Optional[asyncio.Future] = None
+    try:
+        while True:
+            if next_event is None:
+                next_event = asyncio.ensure_future(iterator.__anext__())
+            if pending:
+                done, _ = await asyncio.wait({next_event}, timeout=max(deadline - loop.time(), 0))
+                if not done:
+                    # Window expired while upstream was quiet
+                    yield _merge(pending)
+                    pending, pending_bytes = [], 0
+                    continue
+            try:
+                event = await next_event
+            except StopAsyncIteration:
+                break
+            finally:
+                next_event = None
+
+            if event["type"] != "content":
+                if pending:
+                    yield _merge(pending)
+                    pending, pending_bytes = [], 0
+                yield event
+                continue
+
+            if first:
+                first = False
+                yield event
+                continue
+
+            if "raw" not in event:
+                event = dict(event, raw=json.dumps(event["content"])[1:-1].encode("utf-8"))
+            if not pending:
+                deadline = loop.time() + max_delay
+            pending.append(event)
+            pending_bytes += len(event["raw"])
+            if pending_bytes >= max_bytes:
+                yield _merge(pending)
+                pending, pending_bytes = [], 0
+
+        if pending:
+            yield _merge(pending)
+    finally:
+        if next_event is not None:
+            next_event.cancel()
@@ -0,0 +1,214 @@
+import asyncio
+import hashlib
+import json
+import math
+import os
+import re
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
+
+
+# Pieces the heuristic counts separately; BPE vocabularies mostly split along them
+_WORD = re.compile(r"[A-Za-z]+")
+_NUMBER = re.compile(r"[0-9]+")
+_SYMBOL = re.compile(r"[^\sA-Za-z0-9]")
+_BREAK = re.compile(r"\s{2,}|[\n\t]")
+
+# Chat formatting around each message and the reply, as in OpenAI's counting guide
+MESSAGE_OVERHEAD = 4
+REPLY_OVERHEAD = 3
+
+# o200k_base covers the newer OpenAI families, cl100k_base the older ones
+_O200K_PREFIXES = ("openai/gpt-4o", "openai/gpt-4.1", "openai/gpt-5", "openai/o1", "openai/o3", "openai/o4", "openai/gpt-oss")
+
+
+def _heuristic_count(text: str) -> float:
+    """
+    Token count from character classes: a word is one token plus one per
+    further seven letters, digits go in groups of three, and every symbol,
+    non-ASCII character and line break or run of spaces is one token.
+    An approximation of BPE tokenizers, TOKEN_ESTIMATE_FACTOR calibrates it.
+    """
+    words = _WORD.findall(text)
+    letters = sum(map(len, words))
+    numbers = _NUMBER.findall(text)
+    return (
+        len(words) + (letters - len(words)) / 7
+        + sum((len(number) + 2) // 3 for number in numbers)
+        + len(_SYMBOL.findall(text))
+        + len(_BREAK.findall(text))
+    )
+
+
+class TokenEstimator:
+    """
+    Counts prompt tokens locally, before anything is sent upstream.
+
+    By default a calibrated heuristic is used for every model. With
+    TOKENIZER=tiktoken and the tiktoken package installed, OpenAI models are
+    counted with their real encoding (loaded at startup, which downloads the
+    tables once if they are not cached). Per-message counts are memoised by
+    a hash of the message, so a conversation resent turn after turn is only
+    counted once. Configured with:
+      TOKENIZER              "estimate" (default) or "tiktoken"
+      TOKEN_ESTIMATE_FACTOR  multiplier applied to the heuristic (default 1.0)
+      TOKEN_CACHE_SIZE       memoised message counts (default 10000)
+    """
+
+    def __init__(self) -> None:
+        self._cache: "OrderedDict[bytes, int]" = OrderedDict()
+        self._encodings: Dict[str, Any] = {}
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def factor(self) -> float:
+        return float(os.getenv("TOKEN_ESTIMATE_FACTOR", "1.0"))
+
+    @property
+    def cache_size(self) -> int:
+        return int(os.getenv("TOKEN_CACHE_SIZE", "10000"))
+
+    async def start(self) -> None:
+        if os.getenv("TOKENIZER", "estimate").lower() != "tiktoken":
+            return
+        try:
+            import tiktoken
+        except ImportError:
+            print("Warning: TOKENIZER=tiktoken but the tiktoken package is not installed, estimating tokens")
+            return
+        for name in ("o200k_base", "cl100k_base"):
+            try:
+                # May download the tables, keep it off the event loop
+                self._encodings[name] = await asyncio.to_thread(tiktoken.get_encoding, name)
+            except Exception as e:
+                print(f"Warning: Could not load the {name} encoding, estimating tokens instead: {str(e)}")
+
+    def tokenizer(self, model: Optional[str]) -> str:
+        """The encoding that counts tokens for `model`, or "estimate" for the heuristic"""
+        if not self._encodings or not model or not model.startswith("openai/"):
+            return "estimate"
+        name = "o200k_base" if model.startswith(_O200K_PREFIXES) else "cl100k_base"
+        return name if name in self._encodings else "estimate"
+
+    def count_text(self, text: str, model: Optional[str] = None) -> int:
+        tokenizer = self.tokenizer(model)
+        if tokenizer != "estimate":
+            return len(self._encodings[tokenizer].encode(text, disallowed_special=()))
+        return math.ceil(_heuristic_count(text) * self.factor)
+
+    def count_message(self, role: str, content: str, model: Optional[str] = None) -> int:
+        """Tokens for one chat message including its formatting, memoised"""
+        tokenizer = self.tokenizer(model)
+        key = hashlib.blake2b(
+            f"{tokenizer}\0{role}\0{content}".encode("utf-8", errors="surrogatepass"), digest_size=16
+        ).digest()
+        count = self._cache.get(key)
+        if count is not None:
+            self.hits += 1
+            self._cache.move_to_end(key)
+            return count
+        self.misses += 1
+        count = MESSAGE_OVERHEAD + self.count_text(role, model) + self.count_text(content, model)
+        self._cache[key] = count
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return count
+
+    def count_messages(self, messages: Sequence[Any], model: Optional[str] = None) -> int:
+        """Prompt tokens for ChatMessage objects or {"role", "content"} dicts, reply priming included"""
+        return REPLY_OVERHEAD + sum(self.count_message(*_role_content(message), model) for message in messages)
+
+    def count_payload(self, payload: Union[Dict[str, Any], bytes], model: Optional[str] = None) -> int:
+        """Prompt tokens of an upstream request body (pre-serialised in conversation mode)"""
+        if isinstance(payload, bytes):
+            payload = json.loads(payload)
+        return self.count_messages(payload.get("messages", []), model)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "tokenizers": sorted(self._encodings) or ["estimate"],
+            "cached_messages": len(self._cache),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+def _role_content(message: Any) -> Tuple[str, str]:
+    if isinstance(message, dict):
+        content = message.get("content", "")
+        if isinstance(content, list):
+            # Content blocks, e.g. text marked with a cache breakpoint
+            content = "".join(block.get("text", "") for block in content if isinstance(block, dict))
+        return message.get("role", ""), str(content)
+    return message.role, message.content
+
+
+token_estimator = TokenEstimator()
+
+
+CONTEXT_STRATEGIES = ("reject", "drop_oldest", "keep_system")
+
+
+class ContextOverflow(Exception):
+    """The prompt does not fit the model's context window"""
+
+    def __init__(self, model: str, prompt_tokens: int, context_length: int) -> None:
+        super().__init__(f"About {prompt_tokens} prompt tokens do not fit the {context_length} token context of {model}")
+        self.model = model
+        self.prompt_tokens = prompt_tokens
+        self.context_length = context_length
+
+
+def fit_messages(
+    messages: List[Any],
+    model: str,
+    context_length: int,
+    strategy: str = "reject",
+    history_tokens: int = 0,
+    estimator: TokenEstimator = token_estimator,
+) -> Tuple[List[Any], int, int]:
+    """
+    Make `messages` (after `history_tokens` of earlier conversation) fit in
+    `context_length` tokens. Returns the messages to send, their estimated
+    prompt tokens and how many were dropped.
+
+    "reject" raises ContextOverflow. "drop_oldest" drops the oldest turns,
+    "keep_system" does the same but never drops system messages. The last
+    message is always kept, and the remaining history never starts with an
+    assistant reply. ContextOverflow is raised if that is still too long.
+    """
+    counts = [estimator.count_message(*_role_content(message), model) for message in messages]
+    total = history_tokens + sum(counts) + REPLY_OVERHEAD
+    if total <= context_length:
+        return messages, total, 0
+    if strategy == "reject":
+        raise ContextOverflow(model, total, context_length)
+
+    roles = [_role_content(message)[0] for message in messages]
+    keep = [True] * len(messages)
+
+    def droppable(index: int) -> bool:
+        if index == len(messages) - 1:
+            return False
+        return not (strategy == "keep_system" and roles[index] == "system")
+
+    for index in range(len(messages)):
+        if total <= context_length:
+            break
+        if not keep[index] or not droppable(index):
+            continue
+        keep[index] = False
+        total -= counts[index]
+        # Drop the reply that answered a dropped question along with it
+        following = next((i for i in range(index + 1, len(messages)) if keep[i] and roles[i] != "system"), None)
+        if following is not None and roles[following] == "assistant" and droppable(following):
+            keep[following] = False
+            total -= counts[following]
+
+    if total > context_length:
+        raise ContextOverflow(model, total, context_length)
+    kept = [message for message, kept in zip(messages, keep) if kept]
+    return kept, total, len(messages) - len(kept)
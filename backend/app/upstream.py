@@ -0,0 +1,208 @@
+import os
+from typing import Any, AsyncIterator, Dict, Optional, Union
+
+import httpx
+
+from .codec import chat_codec, loads
+from .lifecycle import current_deadline
+from .metrics import current_timer
+from .sse import SSEParser, decode_chunk
+
+
+OPENROUTER_BASE_URL = "https://openrouter.ai/api/v1"
+
+
+class UpstreamError(Exception):
+    """OpenRouter answered with a non-200 status"""
+
+    def __init__(self, status_code: int, text: str, retry_after: Optional[str] = None) -> None:
+        super().__init__(f"OpenRouter API returned status code {status_code}: {text}")
+        self.status_code = status_code
+        self.text = text
+        self.retry_after = retry_after
+
+
+def _env_int(name: str, default: int) -> int:
+    value = os.getenv(name)
+    if not value:
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        print(f"Warning: Invalid integer for {name}: {value}")
+        return default
+
+
+def _env_float(name: str, default: Optional[float]) -> Optional[float]:
+    value = os.getenv(name)
+    if not value:
+        return default
+    try:
+        return float(value)
+    except ValueError:
+        print(f"Warning: Invalid number for {name}: {value}")
+        return default
+
+
+def _http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+class UpstreamClient:
+    """
+    Shared async client for OpenRouter with a keep-alive connection pool.
+
+    Created at app startup and closed at shutdown. Configured with:
+      UPSTREAM_MAX_CONNECTIONS   (default 200)
+      UPSTREAM_MAX_KEEPALIVE     (default 50)
+      UPSTREAM_KEEPALIVE_EXPIRY  seconds (default 30)
+      UPSTREAM_CONNECT_TIMEOUT   seconds (default 10)
+      UPSTREAM_READ_TIMEOUT      seconds between bytes (default 120)
+      UPSTREAM_HTTP2             "1" to negotiate HTTP/2 (needs the h2 package)
+      OPENROUTER_BASE_URL        API root (default https://openrouter.ai/api/v1),
+                                 e.g. a local mock for benchmarks
+    """
+
+    def __init__(self) -> None:
+        self._client: Optional[httpx.AsyncClient] = None
+        self._chat_url: Optional[str] = None
+
+    @property
+    def base_url(self) -> str:
+        # Read lazily, environment variables are loaded after import
+        return os.getenv("OPENROUTER_BASE_URL", OPENROUTER_BASE_URL).rstrip("/")
+
+    @property
+    def chat_url(self) -> str:
+        if self._chat_url is None:
+            self._chat_url = self.base_url + "/chat/completions"
+        return self._chat_url
+
+    @property
+    def models_url(self) -> str:
+        return self.base_url + "/models"
+
+    def _build_headers(self) -> Dict[str, str]:
+        api_key = os.getenv("OPENROUTER_API_KEY")
+        return {
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {api_key}",
+            "HTTP-Referer": os.getenv("APP_URL", "https://modellab.com"),
+            "X-Title": os.getenv("APP_TITLE", "Model Lab"),
+        }
+
+    def _build_client(self) -> httpx.AsyncClient:
+        limits = httpx.Limits(
+            max_connections=_env_int("UPSTREAM_MAX_CONNECTIONS", 200),
+            max_keepalive_connections=_env_int("UPSTREAM_MAX_KEEPALIVE", 50),
+            keepalive_expiry=_env_float("UPSTREAM_KEEPALIVE_EXPIRY", 30.0),
+        )
+        timeout = httpx.Timeout(
+            connect=_env_float("UPSTREAM_CONNECT_TIMEOUT", 10.0),
+            read=_env_float("UPSTREAM_READ_TIMEOUT", 120.0),
+            write=_env_float("UPSTREAM_WRITE_TIMEOUT", 30.0),
+            pool=_env_float("UPSTREAM_POOL_TIMEOUT", 30.0),
+        )
+
+        http2 = os.getenv("UPSTREAM_HTTP2", "").lower() in ("1", "true", "yes")
+        if http2 and not _http2_available():
+            print("Warning: UPSTREAM_HTTP2 is set but the h2 package is not installed, using HTTP/1.1")
+            http2 = False
+
+        return httpx.AsyncClient(
+            headers=self._build_headers(),
+            limits=limits,
+            timeout=timeout,
+            http2=http2,
+        )
+
+    async def start(self) -> None:
+        if self._client is None:
+            self._client = self._build_client()
+
+    async def close(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+        self._chat_url = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        # Lazily create the client so scripts that skip the app lifespan still work
+        if self._client is None:
+            self._client = self._build_client()
+        return self._client
+
+    def _extensions(self) -> Optional[Dict[str, Any]]:
+        # Let the request being served time connection setup and response headers
+        timer = current_timer.get()
+        return {"trace": timer.trace} if timer is not None else None
+
+    def _timeout(self):
+        # Never wait on upstream past the time the request has left
+        deadline = current_deadline.get()
+        if deadline is None:
+            return httpx.USE_CLIENT_DEFAULT
+        configured = self.client.timeout
+        return httpx.Timeout(
+            connect=deadline.clamp(configured.connect),
+            read=deadline.clamp(configured.read),
+            write=deadline.clamp(configured.write),
+            pool=deadline.clamp(configured.pool),
+        )
+
+    async def post(self, payload: Union[Dict[str, Any], bytes]) -> httpx.Response:
+        """Send a non-streaming chat completion request (payload may be pre-serialised JSON)"""
+        if isinstance(payload, bytes):
+            return await self.client.post(self.chat_url, content=payload, extensions=self._extensions(), timeout=self._timeout())
+        return await self.client.post(self.chat_url, json=payload, extensions=self._extensions(), timeout=self._timeout())
+
+    async def fetch_completion(self, payload: Union[Dict[str, Any], bytes]) -> Dict[str, Any]:
+        """
+        Send a non-streaming chat completion request and return the parsed JSON.
+        Raises UpstreamError if OpenRouter does not answer with 200.
+        """
+        api_response = await self.post(payload)
+        if api_response.status_code != 200:
+            raise UpstreamError(api_response.status_code, api_response.text, api_response.headers.get("retry-after"))
+        if chat_codec.enabled:
+            return loads(api_response.content)
+        return api_response.json()
+
+    def stream(self, payload: Union[Dict[str, Any], bytes]):
+        """Open a streaming chat completion request, use as `async with`"""
+        if isinstance(payload, bytes):
+            return self.client.stream("POST", self.chat_url, content=payload, extensions=self._extensions(), timeout=self._timeout())
+        return self.client.stream("POST", self.chat_url, json=payload, extensions=self._extensions(), timeout=self._timeout())
+
+    async def stream_completion(self, payload: Union[Dict[str, Any], bytes]) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Stream a chat completion as events until upstream sends [DONE]:
+          {"type": "content", "content": str, "raw": bytes}  (raw is JSON-escaped)
+          {"type": "usage", "usage": dict}   (raw upstream token counts)
+        Raises UpstreamError if OpenRouter does not answer with 200.
+        """
+        async with self.stream(payload) as api_response:
+            if api_response.status_code != 200:
+                error_text = (await api_response.aread()).decode("utf-8", errors="replace")
+                raise UpstreamError(api_response.status_code, error_text, api_response.headers.get("retry-after"))
+
+            parser = SSEParser()
+            async for chunk in api_response.aiter_bytes():
+                for data in parser.feed(chunk):
+                    if data.strip() == b"[DONE]":
+                        return
+                    for event in decode_chunk(data):
+                        yield event
+            for data in parser.close():
+                if data.strip() == b"[DONE]":
+                    return
+                for event in decode_chunk(data):
+                    yield event
+
+
+upstream = UpstreamClient()
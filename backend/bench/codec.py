@@ -0,0 +1,197 @@
+"""
+Micro-benchmark of the per-request JSON work in /api/chat, with and
+without FAST_CODEC.
+
+Times parsing a chat request body, encoding the upstream payload and
+rendering the JSON response on their own. Then it times whole non-streaming
+/api/chat round trips in-process, against an upstream answered by
+httpx.MockTransport, so network and event-loop noise stay out of the
+numbers. The bytes produced by both modes are checked to be identical
+before anything is timed:
+
+    python -m bench.codec --messages 20 --message-chars 400
+    python -m bench.codec --requests 5000 -o bench-codec.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from typing import Any, Callable, Dict, List
+
+import httpx
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+from app.codec import chat_codec, encode_payload, encode_response
+from app.schemas import ChatRequest
+
+
+def _body(messages: int, message_chars: int, model: str) -> bytes:
+    text = ("The quick brown fox jumps over the lazy dog, naïvely. " * (message_chars // 55 + 1))[:message_chars]
+    return json.dumps({
+        "model": model,
+        "messages": [
+            {"role": "system" if i == 0 else ("user" if i % 2 else "assistant"), "content": f"{i}: {text}"}
+            for i in range(messages)
+        ],
+    }).encode("utf-8")
+
+
+def _result(model: str) -> Dict[str, Any]:
+    # The shape of a non-streaming /api/chat answer
+    return {
+        "message": {"role": "assistant", "content": "Sure, here is a short answer. " * 20},
+        "usage": {
+            "prompt_tokens": 1200,
+            "completion_tokens": 140,
+            "total_tokens": 1340,
+            "model": model,
+            "cost": {"input_cost_usd": 0.00018, "output_cost_usd": 8.4e-05, "total_cost_usd": 0.000264, "pricing_rate": {"input": 0.00015, "output": 0.0006}},
+        },
+    }
+
+
+def _standard_parse(body: bytes) -> ChatRequest:
+    # What FastAPI does for a ChatRequest parameter
+    return ChatRequest.model_validate(json.loads(body), from_attributes=True)
+
+
+def _standard_payload(request: Any) -> bytes:
+    # The dict build_payload makes, encoded the way httpx encodes json=
+    payload = {"model": request.model, "messages": [{"role": m.role, "content": m.content} for m in request.messages]}
+    return json.dumps(payload, ensure_ascii=False, separators=(",", ":"), allow_nan=False).encode("utf-8")
+
+
+def _standard_response(result: Dict[str, Any]) -> bytes:
+    return JSONResponse(jsonable_encoder(result)).body
+
+
+def _per_call_us(function: Callable[[], Any], seconds: float) -> float:
+    """Best of five timings, in microseconds per call"""
+    calls = 1
+    while True:
+        started = time.perf_counter()
+        for _ in range(calls):
+            function()
+        elapsed = time.perf_counter() - started
+        if elapsed >= seconds / 5:
+            break
+        calls *= 2
+    best = elapsed
+    for _ in range(4):
+        started = time.perf_counter()
+        for _ in range(calls):
+            function()
+        best = min(best, time.perf_counter() - started)
+    return best / calls * 1e6
+
+
+def _set_fast(enabled: bool) -> None:
+    os.environ["FAST_CODEC"] = "1" if enabled else "0"
+
+
+def bench_steps(body: bytes, model: str, seconds: float) -> Dict[str, Dict[str, float]]:
+    _set_fast(True)
+    request = chat_codec.parse(body, "application/json")
+    standard_request = _standard_parse(body)
+    result = _result(model)
+    assert encode_payload(model, request.messages, False) == _standard_payload(standard_request)
+    assert encode_response(result) == _standard_response(result)
+
+    steps = {
+        "parse": (lambda: _standard_parse(body), lambda: chat_codec.parse(body, "application/json")),
+        "payload": (lambda: _standard_payload(standard_request), lambda: encode_payload(model, request.messages, False)),
+        "response": (lambda: _standard_response(result), lambda: encode_response(result)),
+    }
+    timings = {}
+    for name, (standard, fast) in steps.items():
+        timings[name] = {"standard_us": round(_per_call_us(standard, seconds), 2), "fast_us": round(_per_call_us(fast, seconds), 2)}
+    return timings
+
+
+async def bench_requests(body: bytes, requests: int) -> Dict[str, Any]:
+    # Measure the app, not the bookkeeping around it
+    os.environ.setdefault("USAGE_LEDGER_ENABLED", "0")
+    os.environ.setdefault("SINGLE_FLIGHT_ENABLED", "0")
+    from app.main import app
+    from app.upstream import upstream
+
+    upstream_bodies: List[bytes] = []
+    answer = json.dumps({
+        "choices": [{"message": {"role": "assistant", "content": "Sure, here is a short answer. " * 20}}],
+        "usage": {"prompt_tokens": 1200, "completion_tokens": 140, "total_tokens": 1340},
+    }).encode("utf-8")
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        upstream_bodies.append(request.content)
+        return httpx.Response(200, content=answer, headers={"content-type": "application/json"})
+
+    headers = {"content-type": "application/json"}
+    results: Dict[str, Any] = {}
+    async with app.router.lifespan_context(app):
+        await upstream.close()
+        upstream._client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            replies = {}
+            for fast in (False, True):
+                _set_fast(fast)
+                upstream_bodies.clear()
+                reply = await client.post("/api/chat", content=body, headers=headers)
+                replies[fast] = (reply.status_code, reply.content, upstream_bodies[0])
+            assert replies[False] == replies[True], "FAST_CODEC changed the bytes on the wire"
+
+            for fast in (False, True):
+                _set_fast(fast)
+                # Warm up, then time sequential requests
+                for _ in range(min(requests // 10, 200)):
+                    await client.post("/api/chat", content=body, headers=headers)
+                started = time.perf_counter()
+                for _ in range(requests):
+                    await client.post("/api/chat", content=body, headers=headers)
+                elapsed = time.perf_counter() - started
+                results["fast_us" if fast else "standard_us"] = round(elapsed / requests * 1e6, 1)
+        await upstream.close()
+    return results
+
+
+def _print_row(name: str, timing: Dict[str, float]) -> None:
+    standard, fast = timing["standard_us"], timing["fast_us"]
+    print(f"{name:<10} {standard:>12.1f} {fast:>12.1f} {standard / fast:>8.2f}x", file=sys.stderr)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Time /api/chat's JSON handling with and without FAST_CODEC")
+    parser.add_argument("--messages", type=int, default=20, help="messages per request")
+    parser.add_argument("--message-chars", type=int, default=400, help="characters per message")
+    parser.add_argument("--model", default="openai/gpt-4o-mini")
+    parser.add_argument("--seconds", type=float, default=1.0, help="time spent on each step and mode")
+    parser.add_argument("--requests", type=int, default=2000, help="round trips per mode, 0 skips them")
+    parser.add_argument("-o", "--output", help="write results as JSON to this file")
+    args = parser.parse_args()
+
+    body = _body(args.messages, args.message_chars, args.model)
+    results: Dict[str, Any] = {
+        "config": {"messages": args.messages, "message_chars": args.message_chars, "body_bytes": len(body), "json": chat_codec.stats()["json"]},
+        "steps": bench_steps(body, args.model, args.seconds),
+    }
+    if args.requests:
+        results["request"] = asyncio.run(bench_requests(body, args.requests))
+
+    print(f"{'':<10} {'standard µs':>12} {'fast µs':>12} {'speedup':>9}", file=sys.stderr)
+    for name, timing in results["steps"].items():
+        _print_row(name, timing)
+    if "request" in results:
+        _print_row("request", results["request"])
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as handle:
+            json.dump(results, handle, indent=2)
+    else:
+        print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+"""
+Local stand-in for OpenRouter's chat completions endpoint, for benchmarks.
+
+Answers POST /api/v1/chat/completions with JSON or SSE (when the request
+sets "stream": true) after a configurable delay, streaming tokens at a
+configurable rate and failing a configurable fraction of requests:
+
+    python -m bench.mock_openrouter --port 8081 --latency-ms 200 --token-rate 80 --tokens 120
+
+Then point the backend at it with OPENROUTER_BASE_URL=http://127.0.0.1:8081/api/v1.
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+from typing import Any, Dict, List
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+
+class MockSettings:
+    def __init__(
+        self,
+        latency_ms: float = 100.0,
+        token_rate: float = 100.0,
+        tokens: int = 64,
+        error_rate: float = 0.0,
+        error_status: int = 500,
+        usage: bool = True,
+        chunk_tokens: int = 1,
+    ) -> None:
+        self.latency_ms = latency_ms
+        self.token_rate = token_rate
+        self.tokens = tokens
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.usage = usage
+        self.chunk_tokens = max(chunk_tokens, 1)
+
+
+def _prompt_tokens(messages: List[Dict[str, Any]]) -> int:
+    # Close enough to a real tokenizer for load testing
+    return sum(len(str(message.get("content", ""))) for message in messages) // 4 + 4 * len(messages)
+
+
+def _usage(prompt_tokens: int, completion_tokens: int) -> Dict[str, int]:
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+    }
+
+
+def create_app(settings: MockSettings) -> FastAPI:
+    app = FastAPI()
+    app.state.settings = settings
+    app.state.requests = 0
+
+    @app.post("/api/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        app.state.requests += 1
+        model = body.get("model", "mock/model")
+        prompt_tokens = _prompt_tokens(body.get("messages", []))
+        completion_id = f"gen-{app.state.requests}"
+
+        await asyncio.sleep(settings.latency_ms / 1000)
+        if settings.error_rate and random.random() < settings.error_rate:
+            headers = {"Retry-After": "1"} if settings.error_status == 429 else None
+            return JSONResponse(
+                status_code=settings.error_status,
+                content={"error": {"code": settings.error_status, "message": "Mock upstream error"}},
+                headers=headers,
+            )
+
+        if not body.get("stream"):
+            # Generation time is spent before a non-streaming answer is sent
+            if settings.token_rate > 0:
+                await asyncio.sleep(settings.tokens / settings.token_rate)
+            content = "".join(f"tok{i} " for i in range(settings.tokens))
+            response = {
+                "id": completion_id,
+                "model": model,
+                "created": int(time.time()),
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            }
+            if settings.usage:
+                response["usage"] = _usage(prompt_tokens, settings.tokens)
+            return response
+
+        async def events():
+            interval = settings.chunk_tokens / settings.token_rate if settings.token_rate > 0 else 0
+            # Pace against a schedule so sleep overshoot does not add up
+            started = time.perf_counter()
+            for index, first in enumerate(range(0, settings.tokens, settings.chunk_tokens)):
+                delay = started + index * interval - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                content = "".join(f"tok{i} " for i in range(first, min(first + settings.chunk_tokens, settings.tokens)))
+                chunk = {"id": completion_id, "model": model, "choices": [{"index": 0, "delta": {"content": content}}]}
+                yield f"data: {json.dumps(chunk)}\n\n"
+            final = {"id": completion_id, "model": model, "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}
+            if settings.usage:
+                final["usage"] = _usage(prompt_tokens, settings.tokens)
+            yield f"data: {json.dumps(final)}\n\n"
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    @app.get("/stats")
+    async def stats():
+        return {"requests": app.state.requests}
+
+    return app
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--latency-ms", type=float, default=100.0, help="delay before the first byte (default 100)")
+    parser.add_argument("--token-rate", type=float, default=100.0, help="tokens per second, 0 for no pacing (default 100)")
+    parser.add_argument("--tokens", type=int, default=64, help="completion tokens per answer (default 64)")
+    parser.add_argument("--chunk-tokens", type=int, default=1, help="tokens per SSE chunk (default 1)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests that fail (default 0)")
+    parser.add_argument("--error-status", type=int, default=500, help="status of failed requests (default 500)")
+    parser.add_argument("--no-usage", action="store_true", help="omit usage from responses")
+
+
+def settings_from_args(args: argparse.Namespace) -> MockSettings:
+    return MockSettings(
+        latency_ms=args.latency_ms,
+        token_rate=args.token_rate,
+        tokens=args.tokens,
+        error_rate=args.error_rate,
+        error_status=args.error_status,
+        usage=not args.no_usage,
+        chunk_tokens=args.chunk_tokens,
+    )
+
+
+def main() -> None:
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Mock OpenRouter chat completions server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    add_arguments(parser)
+    args = parser.parse_args()
+    uvicorn.run(create_app(settings_from_args(args)), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,383 @@
+"""
+Load benchmark for the chat API against a local mock of OpenRouter.
+
+Starts the mock upstream and the backend (uvicorn, N workers), drives
+/api/chat in streaming and non-streaming mode at rising concurrency, and
+reports requests/sec, TTFT and latency percentiles and per-worker CPU and
+RSS. Results are written as JSON so runs can be compared:
+
+    python -m bench.run --levels 1,8,32,128 --workers 2 -o bench-results.json
+    python -m bench.run --baseline bench-results.json -o bench-new.json
+
+Every request has a unique prompt, so the response cache and request
+coalescing never kick in and each request costs one upstream call.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+
+from .mock_openrouter import add_arguments
+
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _percentile(sorted_values: List[float], fraction: float) -> Optional[float]:
+    if not sorted_values:
+        return None
+    index = min(int(round(fraction * (len(sorted_values) - 1))), len(sorted_values) - 1)
+    return round(sorted_values[index], 1)
+
+
+def _distribution(values: List[float]) -> Dict[str, Optional[float]]:
+    values = sorted(values)
+    return {
+        "p50": _percentile(values, 0.50),
+        "p95": _percentile(values, 0.95),
+        "p99": _percentile(values, 0.99),
+        "max": round(values[-1], 1) if values else None,
+    }
+
+
+class ProcessSampler:
+    """CPU time and RSS of a process tree, via psutil when installed or /proc on Linux"""
+
+    def __init__(self, root_pid: int) -> None:
+        self.root_pid = root_pid
+        try:
+            import psutil
+        except ImportError:
+            psutil = None
+        self._psutil = psutil
+        self._clock_ticks = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+        self._page_size = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+    def workers(self) -> List[int]:
+        """The processes serving requests: the uvicorn workers, or the root if it has none"""
+        if self._psutil is not None:
+            try:
+                children = [child.pid for child in self._psutil.Process(self.root_pid).children()]
+            except self._psutil.Error:
+                children = []
+        else:
+            children = []
+            for entry in os.listdir("/proc"):
+                if not entry.isdigit():
+                    continue
+                try:
+                    with open(f"/proc/{entry}/stat") as handle:
+                        fields = handle.read().rsplit(")", 1)[1].split()
+                except OSError:
+                    continue
+                if int(fields[1]) == self.root_pid:
+                    children.append(int(entry))
+        # The multiprocessing resource tracker shows up as a child but serves nothing
+        children = [pid for pid in children if "resource_tracker" not in self._cmdline(pid)]
+        return sorted(children) or [self.root_pid]
+
+    def _cmdline(self, pid: int) -> str:
+        try:
+            with open(f"/proc/{pid}/cmdline", "rb") as handle:
+                return handle.read().replace(b"\0", b" ").decode("utf-8", errors="replace")
+        except OSError:
+            return ""
+
+    def sample(self, pid: int) -> Tuple[float, int]:
+        """(CPU seconds used so far, RSS in bytes)"""
+        if self._psutil is not None:
+            process = self._psutil.Process(pid)
+            times = process.cpu_times()
+            return times.user + times.system, process.memory_info().rss
+        with open(f"/proc/{pid}/stat") as handle:
+            fields = handle.read().rsplit(")", 1)[1].split()
+        # utime and stime are fields 14 and 15 of stat, rss (pages) is field 24
+        cpu = (int(fields[11]) + int(fields[12])) / self._clock_ticks
+        return cpu, int(fields[21]) * self._page_size
+
+    def snapshot(self) -> Dict[int, Tuple[float, int]]:
+        result = {}
+        for pid in self.workers():
+            try:
+                result[pid] = self.sample(pid)
+            except (OSError, ValueError, IndexError):
+                continue
+        return result
+
+
+async def _one_request(client: httpx.AsyncClient, body: Dict[str, Any]) -> Tuple[Optional[str], Optional[float], float]:
+    """
+    Send one chat request and return (error, ttft_ms, latency_ms). `error` is
+    None on success, the HTTP status for a failed response (429 or 503 when
+    shed, 502 or 504 when upstream failed) or "stream" for an error frame
+    in a streamed answer.
+    """
+    started = time.perf_counter()
+    ttft = None
+    error = None
+    if body["stream"]:
+        async with client.stream("POST", "/api/chat", json=body) as response:
+            if response.status_code != 200:
+                error = str(response.status_code)
+            async for line in response.aiter_lines():
+                if ttft is None and line.startswith('data: {"type": "content"'):
+                    ttft = (time.perf_counter() - started) * 1000
+                elif line.startswith('data: {"error"'):
+                    error = error or "stream"
+    else:
+        response = await client.post("/api/chat", json=body)
+        if response.status_code != 200:
+            error = str(response.status_code)
+    return error, ttft, (time.perf_counter() - started) * 1000
+
+
+async def run_level(
+    client: httpx.AsyncClient,
+    sampler: Optional[ProcessSampler],
+    mode: str,
+    concurrency: int,
+    requests: int,
+    model: str,
+    prompt_chars: int,
+) -> Dict[str, Any]:
+    """Closed-loop load: `concurrency` clients send `requests` requests in total"""
+    ttfts: List[float] = []
+    latencies: List[float] = []
+    errors = 0
+    # Failures by HTTP status ("stream" for error frames, "connection" for transport errors)
+    errors_by_status: Dict[str, int] = {}
+    sent = 0
+    filler = "x" * max(prompt_chars - 40, 0)
+
+    async def client_loop() -> None:
+        nonlocal sent, errors
+        while sent < requests:
+            index = sent
+            sent += 1
+            body = {
+                "model": model,
+                "stream": mode == "stream",
+                "messages": [{"role": "user", "content": f"bench {mode} c{concurrency} #{index} {time.time_ns()} {filler}"}],
+            }
+            try:
+                error, ttft, latency = await _one_request(client, body)
+            except httpx.HTTPError:
+                error, ttft, latency = "connection", None, 0.0
+            if error is not None:
+                errors += 1
+                errors_by_status[error] = errors_by_status.get(error, 0) + 1
+                continue
+            latencies.append(latency)
+            if ttft is not None:
+                ttfts.append(ttft)
+
+    before = sampler.snapshot() if sampler else {}
+    started = time.perf_counter()
+    await asyncio.gather(*(client_loop() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    after = sampler.snapshot() if sampler else {}
+
+    workers = []
+    for pid, (cpu, rss) in sorted(after.items()):
+        cpu_before = before.get(pid, (cpu, rss))[0]
+        workers.append({
+            "pid": pid,
+            "cpu_percent": round((cpu - cpu_before) / elapsed * 100, 1),
+            "rss_mb": round(rss / (1024 * 1024), 1),
+        })
+
+    return {
+        "mode": mode,
+        "concurrency": concurrency,
+        "requests": requests,
+        "succeeded": len(latencies),
+        "errors": errors,
+        "errors_by_status": dict(sorted(errors_by_status.items())),
+        "elapsed_s": round(elapsed, 3),
+        "rps": round(len(latencies) / elapsed, 1) if elapsed else None,
+        "ttft_ms": _distribution(ttfts) if mode == "stream" else None,
+        "latency_ms": _distribution(latencies),
+        "workers": workers,
+    }
+
+
+def _start(command: List[str], env: Dict[str, str]) -> subprocess.Popen:
+    return subprocess.Popen(command, cwd=BACKEND_DIR, env=env)
+
+
+async def _wait_ready(url: str, process: Optional[subprocess.Popen], timeout: float = 30.0) -> None:
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            if process is not None and process.poll() is not None:
+                raise RuntimeError(f"Process exited with code {process.returncode} before {url} was ready")
+            try:
+                await client.get(url, timeout=1.0)
+                return
+            except httpx.HTTPError:
+                await asyncio.sleep(0.1)
+    raise RuntimeError(f"Timed out waiting for {url}")
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _print_result(result: Dict[str, Any], baseline: Optional[Dict[str, Any]]) -> None:
+    ttft = result["ttft_ms"] or {}
+    latency = result["latency_ms"]
+    cpu = sum(worker["cpu_percent"] for worker in result["workers"])
+    rss = sum(worker["rss_mb"] for worker in result["workers"])
+    by_status = " ".join(f"{status}:{count}" for status, count in result.get("errors_by_status", {}).items())
+    line = (
+        f"{result['mode']:>6} c={result['concurrency']:<4} rps={result['rps']:<8} "
+        f"ttft p50/p95/p99={ttft.get('p50')}/{ttft.get('p95')}/{ttft.get('p99')} "
+        f"latency p50/p95/p99={latency['p50']}/{latency['p95']}/{latency['p99']} "
+        f"errors={result['errors']}{f' ({by_status})' if by_status else ''} cpu={cpu:.0f}% rss={rss:.0f}MB"
+    )
+    if baseline and baseline.get("rps") and result["rps"] is not None:
+        line += f"  rps {(result['rps'] / baseline['rps'] - 1) * 100:+.1f}%"
+        if baseline["latency_ms"].get("p95") and latency["p95"]:
+            line += f" p95 {(latency['p95'] / baseline['latency_ms']['p95'] - 1) * 100:+.1f}%"
+    print(line, file=sys.stderr)
+
+
+async def _run(args: argparse.Namespace) -> Dict[str, Any]:
+    levels = [int(level) for level in args.levels.split(",") if level.strip()]
+    modes = [mode.strip() for mode in args.modes.split(",") if mode.strip()]
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as handle:
+            baseline = {(r["mode"], r["concurrency"]): r for r in json.load(handle)["results"]}
+
+    processes: List[subprocess.Popen] = []
+    workdir = tempfile.mkdtemp(prefix="modellab-bench-")
+    env = dict(os.environ)
+    try:
+        mock_url = args.mock_url
+        if args.backend_url is None and mock_url is None:
+            port = _free_port()
+            mock = _start([
+                sys.executable, "-m", "bench.mock_openrouter", "--port", str(port),
+                "--latency-ms", str(args.latency_ms), "--token-rate", str(args.token_rate),
+                "--tokens", str(args.tokens), "--chunk-tokens", str(args.chunk_tokens),
+                "--error-rate", str(args.error_rate), "--error-status", str(args.error_status),
+            ] + (["--no-usage"] if args.no_usage else []), env)
+            processes.append(mock)
+            mock_url = f"http://127.0.0.1:{port}/api/v1"
+            await _wait_ready(f"http://127.0.0.1:{port}/stats", mock)
+
+        sampler = None
+        backend_url = args.backend_url
+        if backend_url is None:
+            port = _free_port()
+            backend_env = dict(env)
+            backend_env.update({
+                "OPENROUTER_BASE_URL": mock_url,
+                "OPENROUTER_API_KEY": env.get("OPENROUTER_API_KEY", "bench"),
+                "USAGE_LEDGER_PATH": os.path.join(workdir, "usage.db"),
+                # Measure the serving path, not the admission queue
+                "ADMISSION_MAX_CONCURRENCY": env.get("ADMISSION_MAX_CONCURRENCY", str(max(levels) * 2)),
+                "ADMISSION_MODEL_CONCURRENCY": env.get("ADMISSION_MODEL_CONCURRENCY", str(max(levels) * 2)),
+                "UPSTREAM_MAX_CONNECTIONS": env.get("UPSTREAM_MAX_CONNECTIONS", str(max(levels) * 2)),
+            })
+            backend = _start([
+                sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(port),
+                "--workers", str(args.workers), "--log-level", "warning",
+            ], backend_env)
+            processes.append(backend)
+            backend_url = f"http://127.0.0.1:{port}"
+            await _wait_ready(backend_url + "/", backend)
+            sampler = ProcessSampler(backend.pid)
+
+        limits = httpx.Limits(max_connections=max(levels), max_keepalive_connections=max(levels))
+        async with httpx.AsyncClient(base_url=backend_url, limits=limits, timeout=args.timeout) as client:
+            # Warm up connections and imports before measuring
+            for mode in modes:
+                await run_level(client, None, mode, min(4, max(levels)), 8, args.model, args.prompt_chars)
+
+            results = []
+            for mode in modes:
+                for concurrency in levels:
+                    requests = max(concurrency * args.requests_per_client, args.min_requests)
+                    result = await run_level(client, sampler, mode, concurrency, requests, args.model, args.prompt_chars)
+                    _print_result(result, baseline.get((mode, concurrency)))
+                    results.append(result)
+    finally:
+        for process in reversed(processes):
+            process.terminate()
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+    return {
+        "meta": {
+            "started": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "backend_url": args.backend_url,
+            "workers": args.workers if args.backend_url is None else None,
+            "model": args.model,
+            "mock": None if args.backend_url or args.mock_url else {
+                "latency_ms": args.latency_ms,
+                "token_rate": args.token_rate,
+                "tokens": args.tokens,
+                "chunk_tokens": args.chunk_tokens,
+                "error_rate": args.error_rate,
+                "usage": not args.no_usage,
+            },
+        },
+        "results": results,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark /api/chat against a local mock of OpenRouter")
+    parser.add_argument("--levels", default="1,8,32,128", help="comma-separated concurrency levels")
+    parser.add_argument("--modes", default="stream,json", help="stream, json or both")
+    parser.add_argument("--requests-per-client", type=int, default=10, help="requests per concurrent client at each level")
+    parser.add_argument("--min-requests", type=int, default=50, help="at least this many requests per level")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn worker processes")
+    parser.add_argument("--model", default="openai/gpt-4o-mini")
+    parser.add_argument("--prompt-chars", type=int, default=200, help="approximate prompt size")
+    parser.add_argument("--timeout", type=float, default=60.0, help="per-request timeout in seconds")
+    parser.add_argument("--backend-url", help="benchmark an already running backend instead of starting one")
+    parser.add_argument("--mock-url", help="upstream base URL for the started backend instead of starting the mock")
+    parser.add_argument("-o", "--output", help="write results as JSON to this file")
+    parser.add_argument("--baseline", help="results file of an earlier run to compare against")
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    results = asyncio.run(_run(args))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as handle:
+            json.dump(results, handle, indent=2)
+    else:
+        print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
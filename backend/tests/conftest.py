@@ -0,0 +1,72 @@
+import asyncio
+import json
+from typing import Any, Dict, List
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+
+
+class FakeUpstream:
+    """
+    Stands in for OpenRouter behind httpx.MockTransport. Answers every chat
+    request with `words`, streamed one chunk per word (`delay` seconds apart)
+    or as one message (after the same time), and keeps the request bodies.
+    """
+
+    def __init__(self) -> None:
+        self.requests: List[Dict[str, Any]] = []
+        self.words = ["Hello", " world"]
+        self.usage = {"prompt_tokens": 5, "completion_tokens": 2, "total_tokens": 7}
+        self.delay = 0.0
+        self.status_code = 200
+        self.completed = 0
+        self.closed_early = 0
+
+    async def __call__(self, request: httpx.Request) -> httpx.Response:
+        body = json.loads(request.content)
+        self.requests.append(body)
+        if self.status_code != 200:
+            return httpx.Response(self.status_code, text="upstream failed")
+        if body.get("stream"):
+            return httpx.Response(200, content=self._stream(), headers={"content-type": "text/event-stream"})
+        if self.delay:
+            await asyncio.sleep(self.delay * len(self.words))
+        return httpx.Response(200, json={
+            "choices": [{"message": {"role": "assistant", "content": "".join(self.words)}}],
+            "usage": self.usage,
+        })
+
+    async def _stream(self):
+        finished = False
+        try:
+            for word in self.words:
+                yield f"data: {json.dumps({'choices': [{'delta': {'content': word}}]})}\n\n".encode("utf-8")
+                if self.delay:
+                    await asyncio.sleep(self.delay)
+            yield f"data: {json.dumps({'choices': [{'delta': {}}], 'usage': self.usage})}\n\n".encode("utf-8")
+            yield b"data: [DONE]\n\n"
+            finished = True
+        finally:
+            if finished:
+                self.completed += 1
+            else:
+                self.closed_early += 1
+
+
+@pytest.fixture
+def upstream() -> FakeUpstream:
+    return FakeUpstream()
+
+
+@pytest.fixture
+def client(monkeypatch, upstream):
+    """The app in-process, with its upstream calls answered by `upstream`"""
+    monkeypatch.setenv("USAGE_LEDGER_ENABLED", "0")
+    from app.main import app
+    from app.upstream import upstream as upstream_client
+
+    with TestClient(app) as test_client:
+        test_client.portal.call(upstream_client.close)
+        upstream_client._client = httpx.AsyncClient(transport=httpx.MockTransport(upstream))
+        yield test_client
@@ -0,0 +1,58 @@
+import asyncio
+import json
+
+from app.batch import run_batch
+
+
+async def lines(items):
+    for item in items:
+        yield json.dumps(item) + "\n"
+
+
+def run(items, rate_limits):
+    calls = []
+
+    async def complete(request):
+        calls.append((request.model, asyncio.get_running_loop().time()))
+        usage = {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2, "cost": {"total_cost_usd": 0.0}}
+        return {"message": {"role": "assistant", "content": "ok"}, "usage": usage}
+
+    async def collect():
+        return [result async for result in run_batch(lines(items), complete, concurrency=4, rate_limits=rate_limits)]
+
+    return asyncio.run(collect()), calls
+
+
+def test_rate_limit_applies_to_aliases():
+    messages = [{"role": "user", "content": "hi"}]
+    items = [{"model": model, "messages": messages} for model in ("gpt-4o", "openai/gpt-4o", "OpenAI/GPT-4o")]
+    # Two requests per second with a burst of two: the third waits for the bucket
+    results, calls = run(items, {"gpt-4o": 2.0})
+    assert results[-1]["succeeded"] == 3
+    times = sorted(time for _, time in calls)
+    assert times[2] - times[0] >= 0.4
+
+
+def test_conversations_and_routing_fail_per_line():
+    messages = [{"role": "user", "content": "hi"}]
+    items = [
+        {"model": "openai/gpt-4o", "messages": messages, "conversation_id": "c1"},
+        {"model": "openai/gpt-4o", "messages": messages, "routing": {"fallbacks": ["openai/gpt-4o-mini"]}},
+        {"model": "openai/gpt-4o", "messages": messages},
+    ]
+    results, calls = run(items, {})
+    errors = {result["index"]: result.get("error") for result in results if result["type"] == "result"}
+    assert "conversation_id is not supported" in errors[0]
+    assert "routing is not supported" in errors[1]
+    assert errors[2] is None
+    assert len(calls) == 1
+    assert results[-1]["failed"] == 2
+
+
+def test_identical_lines_each_call_upstream(client, upstream):
+    upstream.delay = 0.05
+    line = json.dumps({"model": "openai/gpt-4o-mini", "messages": [{"role": "user", "content": "sample me"}]})
+    response = client.post("/api/chat/batch?concurrency=3", content="\n".join([line] * 3))
+    summary = json.loads(response.text.splitlines()[-1])
+    assert summary["succeeded"] == 3
+    assert len(upstream.requests) == 3
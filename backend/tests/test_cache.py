@@ -0,0 +1,36 @@
+import sqlite3
+import time
+
+from app import cache
+from app.cache import _DiskTier
+
+
+def rows(path):
+    conn = sqlite3.connect(path)
+    try:
+        return [key for (key,) in conn.execute("SELECT key FROM responses ORDER BY stored_at")]
+    finally:
+        conn.close()
+
+
+def test_disk_tier_drops_expired_rows_on_start(tmp_path):
+    path = str(tmp_path / "cache.db")
+    disk = _DiskTier(path, ttl=60, max_entries=100)
+    disk.set("old", "{}", time.time() - 120)
+    disk.set("fresh", "{}", time.time())
+    disk.close()
+
+    _DiskTier(path, ttl=60, max_entries=100).close()
+    assert rows(path) == ["fresh"]
+
+
+def test_disk_tier_keeps_the_newest_rows(tmp_path, monkeypatch):
+    monkeypatch.setattr(cache, "_DISK_SWEEP_EVERY", 5)
+    path = str(tmp_path / "cache.db")
+    disk = _DiskTier(path, ttl=3600, max_entries=3)
+    now = time.time()
+    for i in range(5):
+        disk.set(f"k{i}", "{}", now + i)
+    disk.close()
+
+    assert rows(path) == ["k2", "k3", "k4"]
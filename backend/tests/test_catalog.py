@@ -0,0 +1,80 @@
+import asyncio
+import json
+import shutil
+
+import pytest
+
+from app.catalog import DEFAULT_CATALOG_FILE, CatalogError, ModelCatalogRegistry
+
+
+@pytest.fixture
+def catalog_file(tmp_path, monkeypatch):
+    path = tmp_path / "models.json"
+    shutil.copy(DEFAULT_CATALOG_FILE, path)
+    monkeypatch.setenv("MODEL_CATALOG_FILE", str(path))
+    monkeypatch.setenv("PRICING_RELOAD_INTERVAL", "0")
+    monkeypatch.delenv("MODEL_CATALOG_SNAPSHOT", raising=False)
+    monkeypatch.delenv("MODEL_PRICING_FILE", raising=False)
+    monkeypatch.delenv("MODEL_CATALOG_STRICT", raising=False)
+    return path
+
+
+def started(registry):
+    async def run():
+        await registry.start()
+        await registry.close()
+
+    asyncio.run(run())
+    return registry.table
+
+
+def edit(path, change):
+    data = json.loads(path.read_text())
+    change(data)
+    path.write_text(json.dumps(data))
+
+
+@pytest.mark.parametrize("content", ["{not json", "[]", '{"models": []}', '{"models": {}}'])
+def test_broken_reload_keeps_current_catalog(catalog_file, content):
+    registry = ModelCatalogRegistry()
+    table = started(registry)
+    opus = table.normalize("claude-3-opus")
+
+    catalog_file.write_text(content)
+    assert registry.reload() is False
+    assert registry.table is table
+    assert registry.table.normalize("claude-3-opus") == opus
+    assert registry.table.context_length(opus)
+
+
+def test_valid_reload_is_taken(catalog_file):
+    registry = ModelCatalogRegistry()
+    started(registry)
+
+    edit(catalog_file, lambda data: data["models"]["openai/gpt-4o"].update(input=0.5))
+    assert registry.reload() is True
+    assert registry.table.get("gpt-4o")["input"] == 0.5
+
+
+def test_strict_reload_rejects_problems(catalog_file, monkeypatch):
+    registry = ModelCatalogRegistry()
+    table = started(registry)
+    edit(catalog_file, lambda data: data.setdefault("aliases", {}).update({"ghost": "openai/no-such-model"}))
+
+    monkeypatch.setenv("MODEL_CATALOG_STRICT", "1")
+    assert registry.reload() is False
+    assert registry.table is table
+
+    monkeypatch.setenv("MODEL_CATALOG_STRICT", "0")
+    assert registry.reload() is True
+    assert registry.table.problems == ["alias ghost points at unpriced model openai/no-such-model"]
+
+
+def test_strict_start_refuses_unreadable_catalog(catalog_file, monkeypatch):
+    catalog_file.write_text("{not json")
+    monkeypatch.setenv("MODEL_CATALOG_STRICT", "1")
+    with pytest.raises(CatalogError):
+        started(ModelCatalogRegistry())
+
+    monkeypatch.setenv("MODEL_CATALOG_STRICT", "0")
+    assert started(ModelCatalogRegistry()).rates == {}
@@ -0,0 +1,40 @@
+import httpx
+import pytest
+
+from app.upstream import upstream as upstream_client
+
+MESSAGES = [{"role": "user", "content": "hi"}]
+
+
+@pytest.mark.parametrize("model", [None, ""])
+def test_missing_model_is_rejected(client, upstream, model):
+    response = client.post("/api/chat", json={"model": model, "messages": MESSAGES, "stream": False})
+    assert response.status_code == 422
+    assert upstream.requests == []
+
+
+def test_no_messages_is_a_bad_request(client, upstream):
+    response = client.post("/api/chat", json={"model": "openai/gpt-4o-mini", "messages": [], "stream": False})
+    assert response.status_code == 400
+    assert response.json()["detail"] == "No messages provided"
+    assert upstream.requests == []
+
+
+@pytest.mark.parametrize("upstream_status, status", [(500, 502), (503, 502), (504, 504), (400, 400), (402, 402)])
+def test_upstream_failure_is_a_gateway_error(client, upstream, upstream_status, status):
+    upstream.status_code = upstream_status
+    response = client.post("/api/chat", json={"model": "openai/gpt-4o-mini", "messages": MESSAGES, "stream": False})
+    assert response.status_code == status
+    assert response.json()["usage"]["error"]
+    assert "server-timing" in response.headers
+
+
+def test_upstream_timeout_is_a_gateway_timeout(client):
+    def timeout(request):
+        raise httpx.ReadTimeout("upstream too slow", request=request)
+
+    client.portal.call(upstream_client.close)
+    upstream_client._client = httpx.AsyncClient(transport=httpx.MockTransport(timeout))
+    response = client.post("/api/chat", json={"model": "openai/gpt-4o-mini", "messages": MESSAGES, "stream": False})
+    assert response.status_code == 504
+    assert response.json()["message"]["role"] == "assistant"
@@ -0,0 +1,85 @@
+import pytest
+
+from app.schemas import ChatMessage
+from app.tokens import REPLY_OVERHEAD, ContextOverflow, fit_messages, token_estimator
+
+
+class WordCounter:
+    """One token per word, so the arithmetic in the tests is easy to follow"""
+
+    def count_message(self, role, content, model=None):
+        return len(content.split())
+
+
+def conversation(*pairs):
+    return [ChatMessage(role=role, content=content) for role, content in pairs]
+
+
+MESSAGES = conversation(
+    ("system", "be brief"),
+    ("user", "one two three four"),
+    ("assistant", "five six seven eight"),
+    ("user", "nine ten"),
+)
+TOTAL = 2 + 4 + 4 + 2 + REPLY_OVERHEAD
+
+
+def fit(limit, strategy, history_tokens=0):
+    kept, tokens, dropped = fit_messages(MESSAGES, "m", limit, strategy, history_tokens, WordCounter())
+    return [message.content for message in kept], tokens, dropped
+
+
+def test_fitting_messages_are_untouched():
+    assert fit(TOTAL, "reject") == ([message.content for message in MESSAGES], TOTAL, 0)
+
+
+def test_reject_raises():
+    with pytest.raises(ContextOverflow) as overflow:
+        fit(TOTAL - 1, "reject")
+    assert overflow.value.prompt_tokens == TOTAL
+    assert overflow.value.context_length == TOTAL - 1
+
+
+def test_drop_oldest_drops_system_first():
+    assert fit(TOTAL - 1, "drop_oldest") == (["one two three four", "five six seven eight", "nine ten"], TOTAL - 2, 1)
+
+
+def test_keep_system_drops_a_turn_with_its_reply():
+    # Dropping the question alone would leave the history starting with its answer
+    assert fit(TOTAL - 1, "keep_system") == (["be brief", "nine ten"], TOTAL - 8, 2)
+
+
+def test_last_message_is_always_kept():
+    with pytest.raises(ContextOverflow):
+        fit(2 + REPLY_OVERHEAD - 1, "drop_oldest")
+    assert fit(2 + REPLY_OVERHEAD, "drop_oldest") == (["nine ten"], 2 + REPLY_OVERHEAD, 3)
+
+
+def test_history_counts_against_the_limit():
+    assert fit(TOTAL, "drop_oldest", history_tokens=2) == (
+        ["one two three four", "five six seven eight", "nine ten"], TOTAL, 1
+    )
+
+
+def test_chat_is_trimmed_or_rejected(client, upstream, monkeypatch):
+    messages = [
+        {"role": "user", "content": "an old question " * 20},
+        {"role": "assistant", "content": "an old answer " * 20},
+        {"role": "user", "content": "the new question"},
+    ]
+    needed = token_estimator.count_messages(
+        [ChatMessage(**message) for message in messages[2:]], "openai/gpt-4"
+    )
+    # Leave room for the last message only
+    monkeypatch.setenv("CONTEXT_RESERVE_TOKENS", str(8191 - needed))
+    body = {"model": "openai/gpt-4", "messages": messages, "stream": False}
+
+    rejected = client.post("/api/chat", json=body)
+    assert rejected.status_code == 413
+    assert rejected.json()["detail"]["error"] == "context_length_exceeded"
+    assert upstream.requests == []
+
+    trimmed = client.post("/api/chat", json={**body, "context_overflow": "drop_oldest"})
+    assert trimmed.status_code == 200
+    assert trimmed.headers["x-context-trimmed"] == "2"
+    assert upstream.requests[-1]["messages"] == [{"role": "user", "content": "the new question"}]
@@ -0,0 +1,64 @@
+import asyncio
+
+import httpx
+import pytest
+
+
+def turn(content, conversation_id, reset=False, stream=False):
+    return {
+        "model": "openai/gpt-4o-mini",
+        "messages": [{"role": "user", "content": content}],
+        "conversation_id": conversation_id,
+        "conversation_reset": reset,
+        "stream": stream,
+    }
+
+
+def concurrently(client, *bodies):
+    """POST the bodies to /api/chat at the same time, on the app's own event loop"""
+    from app.main import app
+
+    async def run():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as http:
+            return await asyncio.gather(*(http.post("/api/chat", json=body) for body in bodies))
+
+    return client.portal.call(run)
+
+
+@pytest.mark.parametrize("stream", [False, True])
+def test_concurrent_turns_are_serialized(client, upstream, stream):
+    conversation_id = f"serialized-{stream}"
+    assert client.post("/api/chat", json=turn("q1", conversation_id, reset=True)).status_code == 200
+
+    upstream.delay = 0.05
+    first, second = concurrently(client, turn("q2", conversation_id, stream=stream), turn("q3", conversation_id, stream=stream))
+    assert first.status_code == 200
+    assert second.status_code == 409
+    assert second.json()["detail"]["error"] == "conversation_busy"
+
+    # The next turn sees every turn that ran before it, in order
+    upstream.delay = 0
+    assert client.post("/api/chat", json=turn("q4", conversation_id)).status_code == 200
+    history = [message["content"] for message in upstream.requests[-1]["messages"]]
+    assert history == ["q1", "Hello world", "q2", "Hello world", "q4"]
+    assert client.get("/api/conversations/stats").json()["running_turns"] == 0
+
+
+def test_failed_turn_releases_conversation(client, upstream):
+    conversation_id = "released-after-error"
+    assert client.post("/api/chat", json=turn("q1", conversation_id, reset=True)).status_code == 200
+
+    upstream.status_code = 500
+    client.post("/api/chat", json=turn("q2", conversation_id))
+    client.post("/api/chat", json=turn("q2", conversation_id, stream=True))
+
+    upstream.status_code = 200
+    assert client.post("/api/chat", json=turn("q3", conversation_id)).status_code == 200
+    history = [message["content"] for message in upstream.requests[-1]["messages"]]
+    assert history == ["q1", "Hello world", "q3"]
+
+
+def test_unknown_conversation_is_not_held(client):
+    body = turn("q1", "never-started")
+    assert client.post("/api/chat", json=body).json()["detail"]["error"] == "conversation_not_found"
+    assert client.post("/api/chat", json=body).json()["detail"]["error"] == "conversation_not_found"
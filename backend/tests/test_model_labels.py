@@ -0,0 +1,45 @@
+import asyncio
+
+from app.admission import AdmissionController
+from app.catalog import OTHER_MODEL
+from app.routing import LatencyTracker
+
+MESSAGES = [{"role": "user", "content": "hi"}]
+
+
+def test_unknown_models_share_one_metric_series(client):
+    for n in range(5):
+        response = client.post("/api/chat", json={"model": f"made-up/model-{n}", "messages": MESSAGES})
+        assert response.status_code == 200
+    client.post("/api/chat", json={"model": "gpt-4o-mini", "messages": MESSAGES})
+
+    metrics = client.get("/metrics").text
+    assert "made-up" not in metrics
+    assert 'modellab_requests_total{model="other",status="ok",stream="false"}' in metrics
+    assert 'model="openai/gpt-4o-mini"' in metrics
+    assert "made-up" not in str(client.get("/api/routing/stats").json())
+
+
+def test_unknown_models_share_one_admission_limit():
+    async def run():
+        admission = AdmissionController()
+        admission.model_concurrency = 2
+        tickets = [await admission.acquire(model, timeout=0) for model in ("openai/gpt-4o", "made-up/a", "made-up/b")]
+        stats = admission.stats()["models"]
+        for ticket in tickets:
+            ticket.release()
+        return stats
+
+    assert asyncio.run(run()) == {
+        "openai/gpt-4o": {"in_flight": 1, "limit": 2},
+        OTHER_MODEL: {"in_flight": 2, "limit": 2},
+    }
+
+
+def test_unknown_models_share_latency_samples():
+    tracker = LatencyTracker()
+    for n in range(3):
+        tracker.record(f"made-up/model-{n}", 0.5)
+    tracker.record_failure("made-up/model-9")
+    assert tracker.stats()["models"][OTHER_MODEL]["ttft"]["samples"] == 3
+    assert list(tracker.stats()["models"]) == [OTHER_MODEL]
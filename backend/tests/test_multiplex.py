@@ -0,0 +1,93 @@
+import time
+
+from app.multiplex import socket_message
+
+
+def chat(stream_id, content, **extra):
+    request = {"model": "openai/gpt-4o-mini", "messages": [{"role": "user", "content": content}]}
+    return {"type": "chat", "id": stream_id, "request": request, **extra}
+
+
+def until_done(ws, stream_ids, messages=None):
+    """Messages per stream until each of `stream_ids` has ended"""
+    messages = {} if messages is None else messages
+    open_streams = set(stream_ids)
+    while open_streams:
+        message = ws.receive_json()
+        if message.get("type") == "ping":
+            continue
+        messages.setdefault(message["id"], []).append(message)
+        if message.get("done"):
+            open_streams.discard(message["id"])
+    return messages
+
+
+def content_of(messages):
+    return "".join(m["data"]["content"] for m in messages if m.get("data", {}).get("type") == "content")
+
+
+def eventually(check, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not check():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def hang_up(client, ws):
+    """
+    Disconnect and wait for the server to finish the session. Leaving the
+    TestClient block cancels the app straight after the disconnect, which
+    fails the test if the session is still unwinding.
+    """
+    ws.close()
+    eventually(lambda: client.get("/api/sockets/stats").json()["connections"] == 0)
+
+
+def test_socket_message_reuses_the_frame():
+    assert socket_message("s1", b'data: {"type": "content", "content": "hi"}\n\n') == '{"id":"s1","data":{"type": "content", "content": "hi"}}'
+    assert socket_message("s1", "data: [DONE]\n\n") is None
+
+
+def test_streams_are_multiplexed(client):
+    with client.websocket_connect("/ws/chat") as ws:
+        ws.send_json(chat("a", "first"))
+        ws.send_json(chat("b", "second"))
+        messages = until_done(ws, ["a", "b"])
+        hang_up(client, ws)
+    for stream_id in ("a", "b"):
+        assert content_of(messages[stream_id]) == "Hello world"
+        assert messages[stream_id][-1] == {"id": stream_id, "done": True}
+
+
+def test_cancel_stops_one_stream_and_its_upstream_call(client, upstream):
+    upstream.words = ["word "] * 40
+    upstream.delay = 0.02
+    cancelled = client.get("/api/sockets/stats").json()["cancelled"]
+    with client.websocket_connect("/ws/chat") as ws:
+        ws.send_json(chat("slow", "cancel me"))
+        ws.send_json(chat("kept", "keep me"))
+        # Wait until the stream to cancel is producing
+        messages = {}
+        while not content_of(messages.get("slow", [])):
+            message = ws.receive_json()
+            messages.setdefault(message["id"], []).append(message)
+        ws.send_json({"type": "cancel", "id": "slow"})
+        until_done(ws, ["slow"], messages)
+        # Its upstream stream is closed while the other one carries on
+        eventually(lambda: upstream.closed_early == 1)
+        until_done(ws, ["kept"], messages)
+        hang_up(client, ws)
+
+    assert messages["slow"][-1] == {"id": "slow", "done": True, "cancelled": True}
+    assert content_of(messages["slow"]).count("word") < 40
+    assert content_of(messages["kept"]) == "word " * 40
+    assert client.get("/api/sockets/stats").json()["cancelled"] == cancelled + 1
+    eventually(lambda: client.get("/api/admission/stats").json()["in_flight"] == 0)
+
+
+def test_cancel_of_unknown_stream_is_ignored(client):
+    with client.websocket_connect("/ws/chat") as ws:
+        ws.send_json({"type": "cancel", "id": "nothing"})
+        ws.send_json(chat("a", "still served"))
+        assert content_of(until_done(ws, ["a"])["a"]) == "Hello world"
+        hang_up(client, ws)
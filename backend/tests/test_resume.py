@@ -0,0 +1,115 @@
+import asyncio
+
+import pytest
+
+from app.resume import ResumableStreams, ResumeUnavailable, parse_last_event_id
+
+
+async def frames(count, closed, forever=False):
+    """`count` SSE frames, then (with `forever`) a wait that only a cancel ends"""
+    try:
+        for n in range(count):
+            yield f"data: {n}\n\n"
+        if forever:
+            await asyncio.Event().wait()
+    finally:
+        closed.append(True)
+
+
+async def collect(events):
+    return [event async for event in events]
+
+
+def test_parse_last_event_id():
+    assert parse_last_event_id("abc:3") == ("abc", 3)
+    assert parse_last_event_id("7") == (None, 7)
+    with pytest.raises(ValueError):
+        parse_last_event_id("abc:x")
+
+
+def test_replay_after_last_event_id():
+    async def run():
+        streams = ResumableStreams()
+        stream = streams.open(frames(3, []), "key", "stream-1")
+        await stream.task
+        return await collect(streams.resume(stream, 0)), streams.stats()
+
+    events, stats = asyncio.run(run())
+    assert events == [b"id: stream-1:1\ndata: 1\n\n", b"id: stream-1:2\ndata: 2\n\n"]
+    assert stats["resumed"] == 1
+
+
+def test_trimmed_events_are_unavailable(monkeypatch):
+    # Room for about one event per stream
+    monkeypatch.setenv("STREAM_RESUME_STREAM_BYTES", "30")
+
+    async def run():
+        streams = ResumableStreams()
+        stream = streams.open(frames(3, []), "key", "stream-1")
+        await stream.task
+        assert not stream.available(-1)
+        assert stream.available(1)
+        with pytest.raises(ResumeUnavailable):
+            await collect(stream.follow(-1))
+
+    asyncio.run(run())
+
+
+def test_abandoned_after_grace(monkeypatch):
+    monkeypatch.setenv("STREAM_RESUME_GRACE", "0.05")
+
+    async def run():
+        streams = ResumableStreams()
+        closed = []
+        stream = streams.open(frames(1, closed, forever=True), "key", "stream-1")
+        reader = streams.attach(stream)
+        assert await reader.__anext__() == b"id: stream-1:0\ndata: 0\n\n"
+        await reader.aclose()
+        # Still generating during the grace period
+        await asyncio.sleep(0.01)
+        assert not stream.done and closed == []
+        await asyncio.sleep(0.1)
+        return stream, closed, streams.stats()
+
+    stream, closed, stats = asyncio.run(run())
+    assert stream.done and closed == [True]
+    assert stats["abandoned"] == 1
+
+
+def test_cancel_stops_without_waiting_for_grace(monkeypatch):
+    monkeypatch.setenv("STREAM_RESUME_GRACE", "10")
+
+    async def run():
+        streams = ResumableStreams()
+        closed = []
+        stream = streams.open(frames(1, closed, forever=True), "key", "stream-1")
+        reader = streams.attach(stream)
+        await reader.__anext__()
+        await reader.aclose()
+        assert streams.cancel(stream)
+        await asyncio.gather(stream.task, return_exceptions=True)
+        assert not streams.cancel(stream)
+        return stream, closed, streams.stats()
+
+    stream, closed, stats = asyncio.run(run())
+    assert stream.done and closed == [True]
+    assert stats["cancelled"] == 1 and stats["abandoned"] == 0
+
+
+def test_streams_are_only_buffered_with_stream_id(client):
+    body = {"model": "openai/gpt-4o-mini", "messages": [{"role": "user", "content": "hi"}], "stream": True}
+    started = client.get("/api/streams/stats").json()["started"]
+
+    plain = client.post("/api/chat", json=body)
+    assert "x-stream-id" not in plain.headers
+    assert client.get("/api/streams/stats").json()["started"] == started
+
+    resumable = client.post("/api/chat", json=body, headers={"X-Stream-Id": "resume-test-1"})
+    assert resumable.headers["x-stream-id"] == "resume-test-1"
+    assert client.get("/api/streams/stats").json()["started"] == started + 1
+
+    # Replayable after the fact, and too late to cancel
+    replay = client.get("/api/chat/streams/resume-test-1", headers={"Last-Event-ID": "resume-test-1:0"})
+    assert replay.content == resumable.content.split(b"\n\n", 1)[1]
+    assert client.delete("/api/chat/streams/resume-test-1").json() == {"stream_id": "resume-test-1", "cancelled": False}
+    assert client.delete("/api/chat/streams/no-such-stream").status_code == 404
@@ -0,0 +1,83 @@
+import asyncio
+
+import pytest
+
+from app.routing import HedgedStream, LatencyTracker, hedged_call
+
+CANDIDATES = [("primary", "openai/gpt-4o"), ("fallback", "openai/gpt-4o-mini")]
+
+
+def stream_of(words, delay, closed):
+    async def events():
+        try:
+            await asyncio.sleep(delay)
+            for word in words:
+                yield {"type": "content", "content": word}
+        finally:
+            closed.append(words[0])
+
+    return events()
+
+
+def run_stream(delays, deadline_ms):
+    closed = []
+
+    async def run():
+        router = HedgedStream(
+            CANDIDATES,
+            lambda attempt: stream_of([attempt.name, "!"], delays[attempt.index], closed),
+            deadline_ms,
+            LatencyTracker(),
+        )
+        events = [event["content"] async for event in router]
+        return events, router.report("primary")
+
+    events, report = asyncio.run(run())
+    return events, report, closed
+
+
+def test_fast_primary_is_not_hedged():
+    events, report, closed = run_stream([0.0, 0.0], deadline_ms=200)
+    assert events == ["primary", "!"]
+    assert report["hedged"] is False and report["answered_by"] == "primary"
+
+
+def test_slow_primary_is_hedged_and_cancelled():
+    events, report, closed = run_stream([1.0, 0.0], deadline_ms=20)
+    assert events == ["fallback", "!"]
+    assert report["hedged"] is True and report["answered_by"] == "fallback"
+    # The losing stream is closed, not left running upstream
+    assert sorted(closed) == ["fallback", "primary"]
+
+
+def test_failed_primary_falls_back_at_once():
+    async def call(attempt):
+        if attempt.index == 0:
+            raise RuntimeError("primary down")
+        return attempt.name
+
+    tracker = LatencyTracker()
+    result, router = asyncio.run(hedged_call(CANDIDATES, call, 10000, tracker))
+    assert result == "fallback"
+    assert [attempt["outcome"] for attempt in router.report("primary")["attempts"]] == ["failed", "won"]
+    assert tracker.stats()["models"]["openai/gpt-4o"]["failures"] == 1
+
+
+def test_every_candidate_failing_raises_the_last_error():
+    async def call(attempt):
+        raise RuntimeError(f"{attempt.name} down")
+
+    with pytest.raises(RuntimeError, match="fallback down"):
+        asyncio.run(hedged_call(CANDIDATES, call, 10000, LatencyTracker()))
+
+
+def test_deadline_follows_recent_latency(monkeypatch):
+    monkeypatch.setenv("ROUTING_MIN_SAMPLES", "5")
+    tracker = LatencyTracker()
+    assert tracker.deadline("openai/gpt-4o") == 8.0
+    for _ in range(10):
+        tracker.record("openai/gpt-4o", 2.0)
+    assert tracker.deadline("openai/gpt-4o") == 3.0
+    tracker.record("openai/gpt-4o", 60.0)
+    # Clamped to ROUTING_MAX_DEADLINE_MS
+    assert tracker.deadline("openai/gpt-4o") == 20.0
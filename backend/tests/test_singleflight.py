@@ -0,0 +1,105 @@
+import asyncio
+import json
+
+import httpx
+import pytest
+
+from app.ledger import usage_ledger
+
+HEADERS = {"X-Cache-Bypass": "1"}
+
+
+def body(content, stream):
+    return {"model": "openai/gpt-4o-mini", "messages": [{"role": "user", "content": content}], "stream": stream}
+
+
+def leader_and_follower(client, request):
+    """POST `request` twice, the second while the first is still upstream"""
+    from app.main import app
+
+    async def run():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as http:
+            leader = asyncio.create_task(http.post("/api/chat", json=request, headers=HEADERS))
+            await asyncio.sleep(0.03)
+            follower = await http.post("/api/chat", json=request, headers=HEADERS)
+            return await leader, follower
+
+    return client.portal.call(run)
+
+
+def usage_of(response, stream):
+    if not stream:
+        return response.json()["usage"]
+    for line in response.text.splitlines():
+        if line.startswith("data: {") and '"usage"' in line:
+            return json.loads(line[len("data: "):])["usage"]
+
+
+@pytest.mark.parametrize("stream", [False, True])
+def test_follower_skips_admission_and_costs_nothing(client, upstream, monkeypatch, stream):
+    monkeypatch.setattr(usage_ledger, "enabled", True)
+    monkeypatch.setattr(usage_ledger, "_pending", usage_ledger._pending.__class__())
+    upstream.delay = 0.05
+    admitted = client.get("/api/admission/stats").json()["admitted"]
+
+    leader, follower = leader_and_follower(client, body(f"coalesce {stream}", stream))
+    assert len(upstream.requests) == 1
+    assert client.get("/api/admission/stats").json()["admitted"] == admitted + 1
+
+    leader_usage, follower_usage = usage_of(leader, stream), usage_of(follower, stream)
+    assert "coalesced" not in leader_usage
+    assert follower_usage["coalesced"] is True
+    assert follower_usage["total_tokens"] == leader_usage["total_tokens"]
+
+    # (ts, model, status, stream, prompt, completion, total, cost, latency)
+    records = sorted(usage_ledger._pending, key=lambda record: record[2])
+    assert [record[2] for record in records] == ["coalesced", "ok"]
+    assert records[0][7] == 0.0
+    assert records[1][7] > 0.0
+
+    metrics = client.get("/metrics").text
+    flag = "true" if stream else "false"
+    assert f'modellab_requests_total{{model="openai/gpt-4o-mini",status="coalesced",stream="{flag}"}} 1.0' in metrics
+
+
+def test_joiner_takes_a_slot_if_the_call_ended_first(client, upstream):
+    from app.admission import PRIORITY_STANDARD
+    from app.main import complete_chat
+    from app.schemas import ChatRequest
+
+    admitted = client.get("/api/admission/stats").json()["admitted"]
+    request = ChatRequest.model_validate(body("no flight to join", False))
+    result = client.portal.call(complete_chat, request, None, None, PRIORITY_STANDARD)
+    assert result["message"]["content"] == "Hello world"
+    stats = client.get("/api/admission/stats").json()
+    assert stats["admitted"] == admitted + 1
+    assert stats["in_flight"] == 0
+
+
+def test_shared_call_keeps_the_leaders_slot_after_the_leader_leaves(client, upstream):
+    from app.admission import PRIORITY_STANDARD, admission
+    from app.main import complete_chat
+    from app.schemas import ChatRequest
+
+    upstream.delay = 0.05
+    request = ChatRequest.model_validate(body("leader leaves", False))
+
+    async def run():
+        ticket = await admission.acquire(request.model)
+        leader = asyncio.create_task(complete_chat(request, None, None, None, ticket))
+        await asyncio.sleep(0.01)
+        follower = asyncio.create_task(complete_chat(request, None, None, PRIORITY_STANDARD))
+        await asyncio.sleep(0.01)
+        # The leader's client disconnects, its request frees the ticket
+        leader.cancel()
+        ticket.release()
+        while_shared = admission.stats()["in_flight"]
+        result = await follower
+        await asyncio.sleep(0)
+        return while_shared, result, admission.stats()["in_flight"]
+
+    while_shared, result, after = client.portal.call(run)
+    assert while_shared == 1
+    assert result["message"]["content"] == "Hello world"
+    assert after == 0
+    assert len(upstream.requests) == 1
@@ -0,0 +1,96 @@
+import asyncio
+import json
+
+import httpx
+
+from app.sse import SSEParser, coalesce_content, content_frame, decode_chunk
+from app.upstream import UpstreamClient
+
+
+def chunk(content):
+    return json.dumps({"choices": [{"delta": {"content": content}}]}, ensure_ascii=False).encode("utf-8")
+
+
+def feed_pieces(parser, data, size):
+    events = []
+    for start in range(0, len(data), size):
+        events += parser.feed(data[start:start + size])
+    return events + parser.close()
+
+
+def test_crlf_split_across_chunks():
+    parser = SSEParser()
+    assert parser.feed(b"data: one\r") == []
+    assert parser.feed(b"\n\r") == []
+    assert parser.feed(b"\ndata: two\r\n") == [b"one"]
+    assert parser.feed(b"\r\n") == [b"two"]
+
+
+def test_fields_comments_and_multiline_data():
+    stream = b": keep-alive\nid: 7\nevent: message\ndata: a\ndata:b\nretry: 10\n\ndata: c\n\n"
+    assert SSEParser().feed(stream) == [b"a\nb", b"c"]
+
+
+def test_multibyte_utf8_split_across_chunks():
+    text = "héllo wörld 你好 🙂"
+    data = b"data: " + chunk(text) + b"\n\n"
+    # One byte at a time splits every multi-byte character
+    events = feed_pieces(SSEParser(), data, 1)
+    assert len(events) == 1
+    assert decode_chunk(events[0]) == [{"type": "content", "content": text, "raw": text.encode("utf-8")}]
+
+
+def test_unterminated_done_is_left_for_close():
+    parser = SSEParser()
+    assert parser.feed(b"data: " + chunk("hi") + b"\n\ndata: [DONE]") == [chunk("hi")]
+    assert parser.close() == [b"[DONE]"]
+    assert parser.close() == []
+
+
+def test_decode_chunk_keeps_escapes_raw():
+    events = decode_chunk(chunk('say "hi"\n'))
+    assert events == [{"type": "content", "content": 'say "hi"\n', "raw": b'say \\"hi\\"\\n'}]
+    assert content_frame(events[0]) == b'data: {"type": "content", "content": "say \\"hi\\"\\n"}\n\n'
+
+
+def test_decode_chunk_usage_and_junk():
+    usage = {"prompt_tokens": 3, "completion_tokens": 1, "total_tokens": 4}
+    assert decode_chunk(json.dumps({"choices": [{"delta": {}}], "usage": usage}).encode()) == [{"type": "usage", "usage": usage}]
+    assert decode_chunk(json.dumps({"choices": [{"delta": {"content": None}}]}).encode()) == []
+    assert decode_chunk(b"{not json") == []
+    assert decode_chunk(b"[1, 2]") == []
+
+
+def test_stream_completion_reads_split_stream():
+    body = b"".join(b"data: " + chunk(word) + b"\r\n\r\n" for word in ["café", " ok"]) + b"data: [DONE]"
+
+    async def pieces():
+        for start in range(0, len(body), 3):
+            yield body[start:start + 3]
+
+    def handler(request):
+        return httpx.Response(200, content=pieces(), headers={"content-type": "text/event-stream"})
+
+    async def run():
+        client = UpstreamClient()
+        client._client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        try:
+            return [event["content"] async for event in client.stream_completion({"model": "m", "messages": []})]
+        finally:
+            await client.close()
+
+    assert asyncio.run(run()) == ["café", " ok"]
+
+
+def test_coalesce_sends_first_token_then_merges():
+    async def events():
+        for word in ["a", "b", "c"]:
+            yield {"type": "content", "content": word, "raw": word.encode()}
+        yield {"type": "usage", "usage": {}}
+
+    async def run():
+        return [event async for event in coalesce_content(events(), max_bytes=512, max_delay_ms=1000)]
+
+    merged = asyncio.run(run())
+    assert [event.get("content") for event in merged] == ["a", "bc", None]
+    assert merged[1]["raw"] == b"bc"
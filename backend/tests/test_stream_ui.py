@@ -0,0 +1,102 @@
+"""
+End to end: a streamed /api/chat answer, relayed the way app/api/chat/route.ts
+relays it and read by the chat UI, both through lib/sse.mjs run with node.
+"""
+import json
+import os
+import shutil
+import subprocess
+from pathlib import Path
+
+import pytest
+
+SSE_MODULE = Path(__file__).resolve().parents[2] / "lib" / "sse.mjs"
+
+# Feeds the backend's bytes in 7-byte pieces through the proxy's relay (or
+# straight to the UI), then prints what the chat UI rendered
+RENDER = """
+import { forwardEvents, readChatStream } from MODULE;
+
+const chunks = [];
+for await (const chunk of process.stdin) chunks.push(chunk);
+const input = Buffer.concat(chunks);
+const pieces = [];
+for (let i = 0; i < input.length; i += 7) pieces.push(input.subarray(i, i + 7));
+
+let delivered = pieces;
+let lastId = null;
+if (process.env.RELAY === '1') {
+  const decoder = new TextDecoder();
+  const encoder = new TextEncoder();
+  let buffer = '';
+  delivered = [];
+  for (const piece of pieces) {
+    buffer += decoder.decode(piece, { stream: true });
+    const forwarded = forwardEvents(buffer);
+    buffer = forwarded.rest;
+    lastId = forwarded.lastId ?? lastId;
+    if (forwarded.output) delivered.push(encoder.encode(forwarded.output));
+  }
+}
+
+let index = 0;
+const reader = { read: async () => index < delivered.length ? { done: false, value: delivered[index++] } : { done: true } };
+const renders = [];
+const { content, usage } = await readChatStream(reader, text => renders.push(text));
+const relayed = Buffer.concat(delivered.map(piece => Buffer.from(piece))).toString('utf8');
+console.log(JSON.stringify({ content, usage, renders, lastId, relayed }));
+"""
+
+pytestmark = pytest.mark.skipif(shutil.which("node") is None, reason="needs node")
+
+
+def render(body: bytes, relay: bool) -> dict:
+    script = RENDER.replace("MODULE", json.dumps(SSE_MODULE.as_uri()))
+    result = subprocess.run(
+        ["node", "--input-type=module", "-e", script],
+        input=body,
+        capture_output=True,
+        env={**os.environ, "RELAY": "1" if relay else "0"},
+        timeout=30,
+        check=True,
+    )
+    return json.loads(result.stdout)
+
+
+def stream_chat(client, **headers) -> bytes:
+    response = client.post(
+        "/api/chat",
+        json={"model": "openai/gpt-4o-mini", "messages": [{"role": "user", "content": "hi"}], "stream": True},
+        headers=headers,
+    )
+    assert response.status_code == 200
+    return response.content
+
+
+def test_proxied_resumable_stream_renders(client):
+    body = stream_chat(client, **{"X-Stream-Id": "ui-stream-0001"})
+    assert b"id: ui-stream-0001:" in body
+
+    rendered = render(body, relay=True)
+    assert rendered["content"] == "Hello world"
+    assert rendered["renders"][-1] == "Hello world"
+    assert rendered["usage"]["prompt_tokens"] == 5
+    assert "id:" not in rendered["relayed"]
+    assert rendered["lastId"].startswith("ui-stream-0001:")
+
+
+def test_ui_reads_events_with_id_lines(client):
+    body = stream_chat(client, **{"X-Stream-Id": "ui-stream-0002"})
+
+    rendered = render(body, relay=False)
+    assert rendered["content"] == "Hello world"
+    assert rendered["usage"]["completion_tokens"] == 2
+
+
+def test_stream_without_stream_id_renders(client):
+    body = stream_chat(client)
+    assert b"id:" not in body
+
+    rendered = render(body, relay=True)
+    assert rendered["content"] == "Hello world"
+    assert rendered["lastId"] is None
@@ -19,6 +19,7 @@ import {
 import { SidebarTrigger, useSidebar } from "@/components/ui/sidebar"
 import { ChatMessage } from "@/components/chat-message"
 import { supabase } from "@/lib/supabase"
+import { readChatStream } from "@/lib/sse.mjs"
 import { LoadingDots } from "@/components/loading-dots"
 import {
   DropdownMenu,
@@ -264,58 +265,24 @@ export function ChatInterface({
       if (contentType?.includes('text/event-stream')) {
         // Handle streaming response
         const reader = response.body?.getReader()
-        const decoder = new TextDecoder()
         
         if (!reader) {
           throw new Error('No response body')
         }
         
-        let buffer = ''
-        
-        while (true) {
-          const { done, value } = await reader.read()
-          
-          if (done) break
-          
-          buffer += decoder.decode(value, { stream: true })
-          
-          const lines = buffer.split('\n\n')
-          buffer = lines.pop() || ''
-          
-          for (const line of lines) {
-            if (line.startsWith('data: ')) {
-              const dataStr = line.slice(6)
-              
-              if (dataStr.trim() === '[DONE]') continue
-              
-              try {
-                const data = JSON.parse(dataStr)
-                
-                if (data.error) {
-                  throw new Error(data.error)
-                }
-                
-                if (data.type === 'content' && data.content) {
-                  finalContent += data.content
-                  
-                  // Update loading message with current content for real-time display
-                  const streamingMessage: Message = {
-                    ...loadingMessage,
-                    content: finalContent
-                  }
-                  
-                  onUpdateChat(chat.id, {
-                    messages: [...updatedMessages, streamingMessage]
-                  })
-                } else if (data.type === 'usage' && data.usage) {
-                  usageData = data.usage
-                }
-              } catch (parseError) {
-                console.warn('Failed to parse SSE data:', parseError)
-              }
-            }
+        const streamed = await readChatStream(reader, (content) => {
+          // Update loading message with current content for real-time display
+          const streamingMessage: Message = {
+            ...loadingMessage,
+            content
           }
-        }
+          
+          onUpdateChat(chat.id, {
+            messages: [...updatedMessages, streamingMessage]
+          })
+        })
+        finalContent = streamed.content
+        usageData = streamed.usage
       } else {
         // Non-streaming response
         const data = await response.json()
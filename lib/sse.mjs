@@ -0,0 +1,120 @@
+/**
+ * Server-sent events as the chat route forwards them and the chat UI reads
+ * them. Plain JavaScript, so the backend tests can run it with node against
+ * a real stream.
+ */
+
+/**
+ * Splits the complete events off the front of `buffer`
+ * @param {string} buffer
+ * @returns {{ events: string[], rest: string }}
+ */
+export function splitEvents(buffer) {
+  const text = buffer.replace(/\r\n/g, '\n');
+  const end = text.lastIndexOf('\n\n');
+  if (end === -1) {
+    return { events: [], rest: text };
+  }
+  const events = text.slice(0, end).split('\n\n').filter(event => event !== '');
+  return { events, rest: text.slice(end + 2) };
+}
+
+/**
+ * Reads one event field by field: its `id`, and its `data` lines joined
+ * with newlines (null when it has none, e.g. a comment)
+ * @param {string} event
+ * @returns {{ id: string | null, data: string | null }}
+ */
+export function parseEvent(event) {
+  let id = null;
+  const data = [];
+  for (const line of event.split('\n')) {
+    if (line === '' || line.startsWith(':')) {
+      continue;
+    }
+    const colon = line.indexOf(':');
+    const field = colon === -1 ? line : line.slice(0, colon);
+    let value = colon === -1 ? '' : line.slice(colon + 1);
+    if (value.startsWith(' ')) {
+      value = value.slice(1);
+    }
+    if (field === 'id') {
+      id = value;
+    } else if (field === 'data') {
+      data.push(value);
+    }
+  }
+  return { id, data: data.length > 0 ? data.join('\n') : null };
+}
+
+/**
+ * Forwards the complete events in `buffer` as data-only events, keeping the
+ * last `id:` for resuming the stream
+ * @param {string} buffer
+ * @returns {{ output: string, rest: string, lastId: string | null }}
+ */
+export function forwardEvents(buffer) {
+  const { events, rest } = splitEvents(buffer);
+  let output = '';
+  let lastId = null;
+  for (const event of events) {
+    const { id, data } = parseEvent(event);
+    if (id !== null) {
+      lastId = id;
+    }
+    if (data !== null) {
+      output += data.split('\n').map(line => `data: ${line}`).join('\n') + '\n\n';
+    }
+  }
+  return { output, rest, lastId };
+}
+
+/**
+ * Reads a chat answer streamed by /api/chat, calling `onContent` with the
+ * text so far after every content frame
+ * @param {ReadableStreamDefaultReader<Uint8Array>} reader
+ * @param {(content: string) => void} onContent
+ * @returns {Promise<{ content: string, usage: any }>}
+ */
+export async function readChatStream(reader, onContent) {
+  const decoder = new TextDecoder();
+  let buffer = '';
+  let content = '';
+  let usage = null;
+
+  while (true) {
+    const { done, value } = await reader.read();
+
+    if (done) break;
+
+    buffer += decoder.decode(value, { stream: true });
+
+    const { events, rest } = splitEvents(buffer);
+    buffer = rest;
+
+    for (const event of events) {
+      const { data: dataStr } = parseEvent(event);
+
+      if (dataStr === null || dataStr.trim() === '[DONE]') continue;
+
+      try {
+        const data = JSON.parse(dataStr);
+
+        if (data.error) {
+          throw new Error(data.error);
+        }
+
+        if (data.type === 'content' && data.content) {
+          content += data.content;
+          onContent(content);
+        } else if (data.type === 'usage' && data.usage) {
+          usage = data.usage;
+        }
+      } catch (parseError) {
+        console.warn('Failed to parse SSE data:', parseError);
+      }
+    }
+  }
+
+  return { content, usage };
+}